@@ -0,0 +1,309 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import tracing
+
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+DEFAULT_SIMILARITY_THRESHOLD = 0.95
+
+
+class AnswerCache:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 similarity_threshold=DEFAULT_SIMILARITY_THRESHOLD):
+        """
+        Initialize an in-memory cache of generated answers.
+
+        Entries are scoped to a corpus fingerprint, so an answer is only
+        reused for the exact set of documents it was generated from.
+
+        Args:
+            max_entries (int): Maximum number of cached answers (LRU eviction)
+            ttl_seconds (float): Lifetime of a cached answer
+            similarity_threshold (float): Minimum cosine similarity between
+                query embeddings for a near-duplicate question to hit
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # (fingerprint, normalized query) -> entry
+        self._matrices = {}  # fingerprint -> (keys, unit query vectors, expiry times), rebuilt lazily
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def corpus_fingerprint(doc_hashes):
+        """
+        Compute the fingerprint of a document set.
+
+        Args:
+            doc_hashes (iterable): Content hashes of the indexed documents
+
+        Returns:
+            str: SHA-256 hex digest, independent of the document order
+        """
+        return hashlib.sha256("\n".join(sorted(doc_hashes)).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def normalize_query(query):
+        """
+        Normalize a question for exact matching.
+
+        Args:
+            query (str): User question
+
+        Returns:
+            str: Lower-cased question with collapsed whitespace and without
+            trailing punctuation
+        """
+        return re.sub(r"\s+", " ", query).strip().rstrip("?!. ").lower()
+
+    def lookup(self, fingerprint, query, embed_query=None):
+        """
+        Look up a cached answer.
+
+        The normalized question is matched exactly first. If that misses
+        and embed_query is given, the question is embedded and the most
+        similar cached question of the same corpus is used when it is above
+        the similarity threshold.
+
+        Args:
+            fingerprint (str): Corpus fingerprint
+            query (str): User question
+            embed_query (callable): Returns the embedding of a question;
+                only called on an exact-match miss
+
+        Returns:
+            tuple: ((answer, sources) or None, query_vector or None)
+        """
+        cached = self._exact(fingerprint, query, count_miss=embed_query is None)
+        if cached is not None or embed_query is None:
+            return cached, None
+
+        # Embed outside the lock, it is a network call
+        query_vector = embed_query(query)
+        return self._semantic(fingerprint, query_vector), query_vector
+
+    async def alookup(self, fingerprint, query, aembed_query=None):
+        """
+        Look up a cached answer without blocking the event loop.
+
+        Same as lookup, with a coroutine function to embed the question.
+
+        Args:
+            fingerprint (str): Corpus fingerprint
+            query (str): User question
+            aembed_query (callable): Coroutine function returning the
+                embedding of a question; only awaited on an exact-match miss
+
+        Returns:
+            tuple: ((answer, sources) or None, query_vector or None)
+        """
+        cached = self._exact(fingerprint, query, count_miss=aembed_query is None)
+        if cached is not None or aembed_query is None:
+            return cached, None
+
+        query_vector = await aembed_query(query)
+        return self._semantic(fingerprint, query_vector), query_vector
+
+    def get(self, fingerprint, query):
+        """
+        Look up a cached answer by exact normalized question only.
+
+        Args:
+            fingerprint (str): Corpus fingerprint
+            query (str): User question
+
+        Returns:
+            tuple or None: (answer, sources) on a hit
+        """
+        return self.lookup(fingerprint, query)[0]
+
+    def put(self, fingerprint, query, answer, sources, query_vector=None):
+        """
+        Store an answer.
+
+        Args:
+            fingerprint (str): Corpus fingerprint
+            query (str): User question
+            answer (str): Generated answer
+            sources (list): Sources shown with the answer
+            query_vector (list): Embedding of the question, enables
+                near-duplicate matching
+        """
+        key = (fingerprint, self.normalize_query(query))
+        vector = None
+        if query_vector is not None:
+            vector = np.asarray(query_vector, dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            vector = vector / norm if norm else None
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {
+                "answer": answer,
+                "sources": sources,
+                "vector": vector,
+                "expires": time.time() + self.ttl_seconds,
+            }
+            self._matrices.pop(fingerprint, None)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def stats(self):
+        """
+        Report cache usage.
+
+        Returns:
+            dict: Exact hits, semantic hits, misses and entry count
+        """
+        with self._lock:
+            return {
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+            }
+
+    def _exact(self, fingerprint, query, count_miss):
+        """
+        Look up a question by its normalized text.
+
+        Args:
+            fingerprint (str): Corpus fingerprint
+            query (str): User question
+            count_miss (bool): Count a miss; False when a semantic lookup follows
+
+        Returns:
+            tuple or None: (answer, sources) on a hit
+        """
+        key = (fingerprint, self.normalize_query(query))
+        with self._lock:
+            entry = self._get_entry(key)
+            if entry is not None:
+                self.exact_hits += 1
+                tracing.count("answer_cache.exact_hit")
+                return entry["answer"], entry["sources"]
+            if count_miss:
+                self.misses += 1
+                tracing.count("answer_cache.miss")
+            return None
+
+    def _semantic(self, fingerprint, query_vector):
+        """
+        Look up the most similar cached question of a corpus.
+
+        Args:
+            fingerprint (str): Corpus fingerprint
+            query_vector (list): Embedding of the question
+
+        Returns:
+            tuple or None: (answer, sources) on a hit
+        """
+        with self._lock:
+            key = self._nearest(fingerprint, query_vector)
+            entry = self._get_entry(key) if key else None
+            if entry is None:
+                self.misses += 1
+                tracing.count("answer_cache.miss")
+                return None
+            self.semantic_hits += 1
+            tracing.count("answer_cache.semantic_hit")
+            return entry["answer"], entry["sources"]
+
+    def _get_entry(self, key):
+        """
+        Return a live entry and mark it as recently used, dropping it if expired.
+
+        Must be called with the lock held.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry["expires"] < time.time():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _nearest(self, fingerprint, query_vector):
+        """
+        Find the most similar cached question of a corpus.
+
+        Must be called with the lock held.
+
+        Args:
+            fingerprint (str): Corpus fingerprint
+            query_vector (list): Embedding of the question
+
+        Returns:
+            tuple or None: Key of the best entry above the threshold
+        """
+        now = time.time()
+        if fingerprint not in self._matrices:
+            keys = [
+                key for key, entry in self._entries.items()
+                if key[0] == fingerprint and entry["vector"] is not None and entry["expires"] >= now
+            ]
+            if not keys:
+                return None
+            matrix = np.stack([self._entries[key]["vector"] for key in keys])
+            expires = np.array([self._entries[key]["expires"] for key in keys])
+            self._matrices[fingerprint] = (keys, matrix, expires)
+
+        keys, matrix, expires = self._matrices[fingerprint]
+        vector = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if not norm or vector.shape[0] != matrix.shape[1]:
+            return None
+
+        # Expired entries must not hide a live match below them
+        similarities = matrix @ (vector / norm)
+        expired = expires < now
+        similarities[expired] = -np.inf
+        best = int(np.argmax(similarities))
+        for index in np.flatnonzero(expired):
+            self._remove(keys[index])
+        if similarities[best] < self.similarity_threshold:
+            return None
+        return keys[best]
+
+    def _remove(self, key):
+        """Remove an entry and invalidate its corpus matrix. Must be called with the lock held."""
+        self._entries.pop(key, None)
+        self._matrices.pop(key[0], None)
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    """
+    Return the process-wide answer cache, configured from the environment.
+
+    ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL (seconds) and ANSWER_CACHE_THRESHOLD
+    override the defaults.
+
+    Returns:
+        AnswerCache: Shared cache instance
+    """
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = AnswerCache(
+                max_entries=int(os.getenv("ANSWER_CACHE_SIZE", DEFAULT_MAX_ENTRIES)),
+                ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL", DEFAULT_TTL_SECONDS)),
+                similarity_threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", DEFAULT_SIMILARITY_THRESHOLD)),
+            )
+        return _shared_cache
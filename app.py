@@ -3,10 +3,15 @@ import os
 from pdf_processor import PDFProcessor
 from vector_store import VectorStore
 from chat_handler import ChatHandler
-from auth import create_user, verify_user
+from conversation_memory import ConversationMemory
+from answer_cache import AnswerCache
+from document_library import DocumentLibrary, open_library, start_janitor
+from ingestion_service import ACTIVE_STATES, get_ingestion_service
+from auth import create_user, issue_session, revoke_sessions, verify_session, verify_user
+from session_tokens import needs_refresh, session_ttl
+import tracing
 from PIL import Image
-import json
-from pathlib import Path
+import streamlit.components.v1 as components
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -15,61 +20,159 @@ load_dotenv()
 
 
 
-_STATE_FILE = Path(__file__).parent / "current_user.json"
+# Signed session token in a cookie, so a refresh or another replica resumes the session.
+# Links from older versions carried it in the URL; it is read once and removed from there.
+SESSION_PARAM = "session"
+SESSION_COOKIE = "pdf_chat_session"
 
-def save_current_user(email: str):
+def restore_session():
+    """Return the user of a valid session token in the cookie, renewing it past half its lifetime."""
     try:
-        _STATE_FILE.write_text(json.dumps({"user": email}))
+        # the cookie the browser sent, so sync_session_cookie knows whether to rewrite or expire it
+        st.session_state.cookie_token = st.context.cookies.get(SESSION_COOKIE)
+        token = st.query_params.get(SESSION_PARAM) or st.session_state.cookie_token
     except Exception:
-        pass
-
-def load_current_user():
-    try:
-        if _STATE_FILE.exists():
-            data = json.loads(_STATE_FILE.read_text())
-            return data.get("user")
-    except Exception:
-        pass
-    return None
-
-def clear_current_user():
-    try:
-        if _STATE_FILE.exists():
-            _STATE_FILE.unlink()
-    except Exception:
-        pass
-
+        token = None
+    # keep the token out of the address bar, history and Referer headers
+    clear_query_session()
+
+    claims = verify_session(token)
+    if claims is None:
+        return None
+    if needs_refresh(claims):
+        token = issue_session(claims["sub"])
+    st.session_state.session_token = token
+    return claims["sub"]
+
+def remember_session(email: str):
+    """Issue a session token after a real login or signup."""
+    st.session_state.session_token = issue_session(email)
+
+def forget_session():
+    """Revoke every session token of the signed-in user, including copies elsewhere."""
+    if st.session_state.get("user"):
+        revoke_sessions(st.session_state.user)
+    st.session_state.session_token = None
+
+def sync_session_cookie():
+    """Write the current session token to the browser cookie, or expire it after logout."""
+    token = st.session_state.get("session_token")
+    if st.session_state.get("cookie_token") == token:
+        return
+    max_age = session_ttl() if token else 0
+    components.html(
+        f"<script>window.parent.document.cookie = "
+        f"'{SESSION_COOKIE}={token or ''}; Max-Age={max_age}; Path=/; SameSite=Lax' + "
+        f"(window.parent.location.protocol === 'https:' ? '; Secure' : '');</script>",
+        height=0
+    )
+    st.session_state.cookie_token = token
 
-def set_query_user(email: str):
+def clear_query_session():
     try:
         
-        st.query_params = {"user": email}
+        if SESSION_PARAM in st.query_params:
+            del st.query_params[SESSION_PARAM]
     except Exception:
         pass
 
-def clear_query_user():
-    try:
-        
-        st.query_params = {}
-    except Exception:
-        pass
+# Chat messages kept for display; the model sees a bounded window and summary from the memory
+MAX_CHAT_MESSAGES = 100
 
 # Initialize session state
 if "messages" not in st.session_state:
     st.session_state.messages = []
-if "vector_store" not in st.session_state:
-    st.session_state.vector_store = None
-if "uploaded_files" not in st.session_state:
-    st.session_state.uploaded_files = []
+if "memory" not in st.session_state:
+    st.session_state.memory = ConversationMemory()
+if "session_uploads" not in st.session_state:
+    # content hashes of the PDFs ingested from the uploader in this session
+    st.session_state.session_uploads = set()
+if "ignored_uploads" not in st.session_state:
+    # content hashes of PDFs that failed or were removed from the library;
+    # not ingested again while they stay in the uploader
+    st.session_state.ignored_uploads = set()
+if "upload_hashes" not in st.session_state:
+    # uploader file ID -> content hash, so each upload is hashed once
+    st.session_state.upload_hashes = {}
+if "ingest_jobs" not in st.session_state:
+    # content hash -> ingestion job ID for the PDFs uploaded in this session
+    st.session_state.ingest_jobs = {}
 if "user" not in st.session_state:
     
-    try:
-        params = st.query_params
-        q_user = params.get("user", [None])[0]
-    except Exception:
-        q_user = None
+    st.session_state.user = restore_session()
+
+def get_library() -> DocumentLibrary:
+    """Return the document library of the signed-in user, reopening it after login or once the janitor closed it."""
+    library = st.session_state.get("library")
+    if library is None or library.closed or library.user != st.session_state.user:
+        # Only the manifest is read here; the collection is opened on first use
+        library = open_library(st.session_state.user)
+        st.session_state.library = library
+    return library
+
+def show_ingestion_jobs():
+    """Show the progress of background ingestion jobs, polling while any is running."""
+    service = get_ingestion_service()
+    statuses = [service.status(job_id) for job_id in st.session_state.ingest_jobs.values()]
+    statuses = [status for status in statuses if status]
+    active = any(status["state"] in ACTIVE_STATES for status in statuses)
+
+    @st.fragment(run_every=1.0 if active else None)
+    def job_panel():
+        running = False
+        for status in [service.status(job_id) for job_id in st.session_state.ingest_jobs.values()]:
+            if not status:
+                continue
+            if status["state"] in ACTIVE_STATES:
+                running = True
+                label = (
+                    f"{status['filename']}: {status['state']} · {status['pages']} pages · "
+                    f"{status['chunks']} chunks · {status['batches']} batches embedded"
+                )
+                st.progress(status["embedded"] / status["chunks"] if status["chunks"] else 0.0, text=label)
+            elif status["state"] == "failed":
+                # Remember the failure so the file is not retried on every rerun
+                st.session_state.ignored_uploads.add(status["doc_hash"])
+                st.error(status["error"], icon=":material/dangerous:")
+            for warning in status["warnings"]:
+                st.warning(warning)
+        if active and not running:
+            # Finished documents become queryable: refresh the library and the chat
+            st.rerun()
 
-    st.session_state.user = q_user or load_current_user()
+    job_panel()
+
+def show_trace_panel():
+    """Show the stage breakdown of the last question and recent stage latencies when tracing is on."""
+    if not tracing.enabled():
+        return
+    with st.expander("Debug: latency", icon=":material/timer:"):
+        traces = tracing.recent_traces("question", limit=1)
+        if traces:
+            last = traces[0]
+            st.caption(f"Last question: {last['seconds'] * 1000:.0f}ms · trace {last['trace_id']}")
+            st.table([
+                {"stage": stage, "ms": round(entry["seconds"] * 1000, 1), "calls": entry["calls"]}
+                for stage, entry in sorted(last["stages"].items(), key=lambda item: -item[1]["seconds"])
+            ])
+            if last["counts"]:
+                st.write(", ".join(f"{name}: {value}" for name, value in sorted(last["counts"].items())))
+        summary = tracing.stage_summary()
+        if summary:
+            st.caption("Rolling window")
+            st.table([
+                {"stage": stage, "count": window["count"], "p50 ms": round(window["p50"] * 1000, 1),
+                 "p99 ms": round(window["p99"] * 1000, 1)}
+                for stage, window in summary.items() if window["count"]
+            ])
+
+def format_pages(source: dict) -> str:
+    """Return 'Page N' or 'Pages N-M' for a source entry."""
+    page = source.get("page", "Unknown")
+    page_end = source.get("page_end", page)
+    if page_end != page:
+        return f"Pages {page}-{page_end}"
+    return f"Page {page}"
 
 def show_snackbar(message: str, type: str = "info", duration: int = 3000):
         
@@ -118,9 +221,8 @@ def show_login_screen():
             if submitted:
                 if verify_user(email, password):
                     st.session_state.user = email
-                    # persist current user so refresh doesn't log out
-                    save_current_user(email)
-                    set_query_user(email)
+                    # a signed session token keeps the user signed in across refreshes and replicas
+                    remember_session(email)
                     st.session_state.page = "home"
                     st.success("Logged in")
                     st.rerun()
@@ -160,8 +262,7 @@ def show_signup_screen():
                     if ok:
                         st.session_state.user = email
                         
-                        save_current_user(email)
-                        set_query_user(email)
+                        remember_session(email)
                         st.session_state.page = "home"
                         st.success(msg)
                         st.rerun()
@@ -181,6 +282,7 @@ def main():
         layout="wide"
     )
     
+    sync_session_cookie()
     st.markdown("## :material/robot_2: INTELLIGENT PDF CHATBOT")  
      
     st.markdown("Upload PDF documents and ask questions based on their content!")
@@ -197,12 +299,12 @@ def main():
                 st.session_state.page = "home"
                 st.rerun()
             if st.button("Logout", icon=":material/logout:", key="logout"):
-                # clear persisted user on logout
-                clear_current_user()
-                clear_query_user()
-                for key in ["user", "messages", "vector_store", "uploaded_files"]:
+                # revoke the session tokens; the cookie is expired on the next run
+                forget_session()
+                for key in ["messages", "memory", "library", "session_uploads", "ignored_uploads", "upload_hashes", "ingest_jobs"]:
                     if key in st.session_state:
                         del st.session_state[key]
+                st.session_state.user = None
                 st.session_state.page = "login"
                 st.rerun()
         else:
@@ -233,6 +335,11 @@ def main():
         st.error("GEMINI_API_KEY not found in environment variables. Please add your Gemini API key to continue.",icon=":material/warning:")
         st.stop()
     
+    # Evict libraries that have not been used for a long time in the background
+    start_janitor()
+    tracing.start_metrics_server()
+    library = get_library()
+    
     # Sidebar for file upload
     with st.sidebar:
         st.markdown("""
@@ -268,69 +375,86 @@ def main():
             if not valid_files:
                 pass
             else:
-                # Check if valid files have changed
-                current_files = [f.name for f in valid_files]
-                if current_files != st.session_state.uploaded_files:
-                    st.session_state.uploaded_files = current_files
-
-                    with st.spinner("Processing PDFs..."):
-                        try:
-                            # Initialize processors
-                            pdf_processor = PDFProcessor()
-                            vector_store = VectorStore()
-
-                            # Process all uploaded files
-                            all_documents = []
-                            file_sources = {}
-
-                            for uploaded_file in valid_files:
-                                # Extract text from PDF
-                                text = pdf_processor.extract_text(uploaded_file)
-
-                                # Create chunks with metadata
-                                chunks = pdf_processor.create_chunks(text, uploaded_file.name)
-                                all_documents.extend(chunks)
-
-                                # Store file source mapping
-                                file_sources[uploaded_file.name] = len(chunks)
-
-                            if all_documents:
-                                # Create vector store
-                                vectorstore = vector_store.create_vectorstore(all_documents)
-                                st.session_state.vector_store = vectorstore
-
-                                # Display success message
-                                total_chunks = len(all_documents)
-                                st.success(f"Successfully processed {len(valid_files)} PDF(s) into {total_chunks} chunks",icon=":material/check:")
-                                # Show file details
-                                
-                                st.markdown("""
+                # Key uploads by content hash so only new or changed files are processed
+                pdf_processor = PDFProcessor()
+                known_hashes = st.session_state.upload_hashes
+                upload_hashes = {}
+                current_docs = {}
+                for f in valid_files:
+                    file_id = getattr(f, "file_id", None)
+                    doc_hash = known_hashes.get(file_id) if file_id else None
+                    if doc_hash is None:
+                        doc_hash = pdf_processor.compute_file_hash(f)
+                    if file_id:
+                        upload_hashes[file_id] = doc_hash
+                    current_docs.setdefault(doc_hash, f)
+                st.session_state.upload_hashes = upload_hashes
+
+                session_uploads = st.session_state.session_uploads
+                ignored_uploads = st.session_state.ignored_uploads
+                ingest_jobs = st.session_state.ingest_jobs
+                new_hashes = [
+                    h for h in current_docs
+                    if not library.has_document(h) and h not in ignored_uploads and h not in ingest_jobs
+                ]
+                # Files ingested in this session and removed from the uploader leave the library too;
+                # files that were already in the library stay
+                removed_hashes = [h for h in session_uploads if h not in current_docs]
+                session_uploads.update(new_hashes)
+
+                try:
+                    service = get_ingestion_service()
+                    for doc_hash in removed_hashes:
+                        if doc_hash in ingest_jobs:
+                            service.cancel(ingest_jobs.pop(doc_hash))
+                        library.remove_document(doc_hash, VectorStore())
+                        session_uploads.discard(doc_hash)
+                        ignored_uploads.discard(doc_hash)
+
+                    # Process new files in the background; the chat stays usable meanwhile
+                    for doc_hash in new_hashes:
+                        ingest_jobs[doc_hash] = service.submit(library, current_docs[doc_hash], doc_hash=doc_hash)
+
+                except Exception as e:
+                    st.error(f"Error processing PDFs: {str(e)}",icon=":material/dangerous:")
+
+        show_ingestion_jobs()
+
+        if library.documents:
+            # Show the documents kept in the library of the user
+            st.markdown("""
 <link href="https://fonts.googleapis.com/css2?family=Material+Symbols+Outlined" rel="stylesheet">
 <div style="display:flex; align-items:center; gap:8px;">
   <span class="material-symbols-outlined" style="font-size:26px;">
     picture_as_pdf
   </span>
-  <h3 style="margin:0;">Processed Files:</h3>
+  <h3 style="margin:0;">Your Library:</h3>
 </div>
 """, unsafe_allow_html=True)
-                                for file_name, chunk_count in file_sources.items():
-                                    st.write(f"• {file_name}: {chunk_count} chunks")
-                            else:
-                                st.error("No text could be extracted from the uploaded PDFs",icon=":material/dangerous:")
-
-                        except Exception as e:
-                            st.error(f"Error processing PDFs: {str(e)}",icon=":material/dangerous:")
-                            st.session_state.vector_store = None
+            for doc_hash, doc in list(library.documents.items()):
+                cols = st.columns([5, 1])
+                cols[0].write(f"• {doc['filename']}: {doc['chunks']} chunks")
+                if cols[1].button(":material/close:", key=f"remove_{doc_hash}", help="Remove from library"):
+                    try:
+                        library.remove_document(doc_hash, VectorStore())
+                        # Keep it out of the library even if it is still in the uploader
+                        st.session_state.ignored_uploads.add(doc_hash)
+                    except Exception as e:
+                        st.error(f"Error removing document: {str(e)}",icon=":material/dangerous:")
+                    st.rerun()
 
         if st.button("Clear Chat History", key="clear_chat",icon=":material/delete:"):
             if "messages" in st.session_state:
                 del st.session_state.messages
+            st.session_state.memory.clear()
             st.rerun()
+
+        show_trace_panel()
     
     
     st.markdown("## :material/chat: Chat with Your Documents") 
     
-    if not st.session_state.vector_store:
+    if not library.documents:
         # st.markdown("## :material/pan_tool_alt: Chat with Your Documents") 
         st.markdown("""
                     <link href="https://fonts.googleapis.com/icon?family=Material+Icons" rel="stylesheet">
@@ -350,7 +474,7 @@ Please upload PDF files in the sidebar to start chatting!
             if "sources" in message and message["sources"]:
                 with st.expander("Sources",icon=":material/search:"):
                     for source in message["sources"]:
-                        st.write(f"• **{source['filename']}** (Page {source.get('page', 'Unknown')})")
+                        st.write(f"• **{source['filename']}** ({format_pages(source)})")
     
 
     if prompt := st.chat_input("Ask a question about your documents..."):
@@ -364,30 +488,54 @@ Please upload PDF files in the sidebar to start chatting!
         
         # Generate and display assistant response
         with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
-                try:
-                    chat_handler = ChatHandler(st.session_state.vector_store)
-                    response, sources = chat_handler.get_response(prompt)
-                    
-                    st.markdown(response)
-                    
-                    # Display sources if available
-                    if sources:
-                        with st.expander("Sources",icon=":material/search:"):
-                            for source in sources:
-                                st.write(f"• **{source['filename']}** (Page {source.get('page', 'Unknown')})")
-                    
-                    # Add assistant message to chat history
-                    st.session_state.messages.append({
-                        "role": "assistant", 
-                        "content": response,
-                        "sources": sources
-                    })
-                    
-                except Exception as e:
-                    error_msg = f"❌ Error generating response: {str(e)}"
-                    st.error(error_msg)
-                    st.session_state.messages.append({"role": "assistant", "content": error_msg})
+            try:
+                # Answers only use, and cached answers are only reused for, the recorded documents
+                doc_hashes = set(library.documents)
+                # The persistent collection is opened on the first question after login
+                chat_handler = ChatHandler(
+                    library.vectorstore(VectorStore()),
+                    corpus_fingerprint=AnswerCache.corpus_fingerprint(doc_hashes),
+                    doc_hashes=doc_hashes,
+                    lexical_index=library.lexical_index(),
+                    memory=st.session_state.memory
+                )
+                with st.spinner("Thinking..."):
+                    stream, sources = chat_handler.stream_response(prompt)
+
+                # Render the answer token by token as it is generated
+                response = st.write_stream(stream)
+
+                timings = chat_handler.last_timings
+                if timings.get("cache_hit"):
+                    st.caption(f"Answered from cache in {timings['total']:.2f}s")
+                elif "first_token" in timings:
+                    caption = f"First token after {timings['first_token']:.2f}s · complete after {timings['total']:.2f}s"
+                    if "rerank" in timings:
+                        caption += f" · reranking {timings['rerank'] * 1000:.1f}ms"
+                    if "context_tokens" in timings:
+                        caption += f" · {timings['context_tokens']} context tokens ({timings['tokens_saved']} saved)"
+                    st.caption(caption)
+
+                # Display sources if available
+                if sources:
+                    with st.expander("Sources",icon=":material/search:"):
+                        for source in sources:
+                            st.write(f"• **{source['filename']}** ({format_pages(source)})")
+
+                # Add assistant message to chat history
+                st.session_state.messages.append({
+                    "role": "assistant", 
+                    "content": response,
+                    "sources": sources
+                })
+
+            except Exception as e:
+                error_msg = f"❌ Error generating response: {str(e)}"
+                st.error(error_msg)
+                st.session_state.messages.append({"role": "assistant", "content": error_msg})
+
+        # Only the most recent messages are kept and redrawn
+        del st.session_state.messages[:-MAX_CHAT_MESSAGES]
 
 if __name__ == "__main__":
     main()
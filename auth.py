@@ -3,25 +3,205 @@ import json
 import hashlib
 import binascii
 import secrets
+import sqlite3
+import threading
+import time
+
+from session_tokens import issue_token, read_token
 
 USERS_FILE = os.path.join(os.path.dirname(__file__), "users.json")
+USERS_DB = os.path.join(os.path.dirname(__file__), "users.sqlite3")
 
 PBKDF2_ROUNDS = 100_000
 
+# Session versions read from the store are reused this long when verifying tokens
+DEFAULT_SESSION_VERSION_TTL = 30
+
+
+class UserStore:
+    def __init__(self, path=None, legacy_file=USERS_FILE):
+        """
+        Open the user store, creating it if needed.
+
+        Users live in a SQLite file in WAL mode keyed by email, so a lookup
+        is one primary key probe and concurrent signups from several
+        processes are serialized by SQLite instead of overwriting each
+        other. Users of an existing users.json are imported once, after
+        which the file is renamed to users.json.migrated.
+
+        Args:
+            path (str): SQLite file location (USERS_DB or users.sqlite3 next
+                to the app by default)
+            legacy_file (str): users.json to migrate, if it exists
+        """
+        self.path = path or os.getenv("USERS_DB", USERS_DB)
+        self._lock = threading.Lock()
+        self._versions = {}  # email -> (session version, time read)
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS users ("
+                "email TEXT PRIMARY KEY, salt TEXT NOT NULL, hash TEXT NOT NULL, "
+                "session_version INTEGER NOT NULL DEFAULT 0) WITHOUT ROWID"
+            )
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(users)")]
+            if "session_version" not in columns:
+                # Stores created before session revocation
+                try:
+                    self._conn.execute("ALTER TABLE users ADD COLUMN session_version INTEGER NOT NULL DEFAULT 0")
+                except sqlite3.OperationalError:
+                    # Another process added it first
+                    pass
+            if legacy_file and os.path.exists(legacy_file):
+                self._migrate(legacy_file)
+        except Exception as e:
+            raise Exception(f"Error opening user store: {str(e)}")
+
+    def _migrate(self, legacy_file):
+        """Import users.json; users already in the store are kept."""
+        try:
+            with open(legacy_file, "r", encoding="utf-8") as f:
+                users = json.load(f)
+        except FileNotFoundError:
+            # Another process migrated it first
+            return
+        rows = [
+            (email, rec["salt"], rec["hash"]) for email, rec in users.items()
+            if isinstance(rec, dict) and rec.get("salt") and rec.get("hash")
+        ]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO users (email, salt, hash) VALUES (?, ?, ?) ON CONFLICT (email) DO NOTHING", rows
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        try:
+            os.replace(legacy_file, legacy_file + ".migrated")
+        except FileNotFoundError:
+            pass
+
+    def add(self, email, salt, pwd_hash):
+        """
+        Insert a user unless the email is taken, atomically.
+
+        Returns:
+            bool: True if the user was inserted
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO users (email, salt, hash) VALUES (?, ?, ?) ON CONFLICT (email) DO NOTHING",
+                (email, salt, pwd_hash)
+            )
+        return cursor.rowcount == 1
+
+    def upsert(self, email, salt, pwd_hash):
+        """Insert a user or replace the password of an existing one."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO users (email, salt, hash) VALUES (?, ?, ?) "
+                "ON CONFLICT (email) DO UPDATE SET salt = excluded.salt, hash = excluded.hash",
+                (email, salt, pwd_hash)
+            )
+
+    def get(self, email):
+        """
+        Look up a user.
+
+        Returns:
+            tuple or None: (salt, hash)
+        """
+        with self._lock:
+            return self._conn.execute("SELECT salt, hash FROM users WHERE email = ?", (email,)).fetchone()
+
+    def delete(self, email):
+        """
+        Remove a user.
+
+        Returns:
+            bool: True if the user existed
+        """
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM users WHERE email = ?", (email,))
+            self._versions.pop(email, None)
+        return cursor.rowcount == 1
+
+    def owns_library(self, name):
+        """
+        Check whether a library name opens the library of a user.
+
+        Library names are matched like DocumentLibrary does, ignoring case
+        and surrounding whitespace.
+
+        Returns:
+            bool: True if the name is the email of a user
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM users WHERE email = ? COLLATE NOCASE LIMIT 1", (name.strip(),)
+            ).fetchone()
+        return row is not None
+
+    def session_version(self, email, max_age=0):
+        """
+        Return the session version of a user, signed into their session tokens.
 
-def _load_users():
-    if not os.path.exists(USERS_FILE):
-        return {}
-    try:
-        with open(USERS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return {}
+        Args:
+            email (str): User email
+            max_age (float): Reuse a version read by this process at most
+                this many seconds ago instead of querying the database
 
+        Returns:
+            int or None: Current version; None if the user does not exist
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._versions.get(email)
+            if cached and now - cached[1] < max_age:
+                return cached[0]
+            row = self._conn.execute("SELECT session_version FROM users WHERE email = ?", (email,)).fetchone()
+            version = row[0] if row else None
+            self._versions[email] = (version, now)
+        return version
 
-def _save_users(users: dict):
-    with open(USERS_FILE, "w", encoding="utf-8") as f:
-        json.dump(users, f, indent=2)
+    def bump_session_version(self, email):
+        """
+        Invalidate all session tokens of a user issued so far.
+
+        Returns:
+            bool: True if the user exists
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE users SET session_version = session_version + 1 WHERE email = ?", (email,)
+            )
+            # Revocation takes effect in this process at once; elsewhere once their cache expires
+            self._versions.pop(email, None)
+        return cursor.rowcount == 1
+
+    def emails(self):
+        """Return all emails in sorted order."""
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT email FROM users ORDER BY email")]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_user_store() -> UserStore:
+    """Return the process-wide user store."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = UserStore()
+        return _store
 
 
 def _hash_password(password: str, salt: str) -> str:
@@ -39,42 +219,68 @@ def create_user(email: str, password: str) -> tuple[bool, str]:
     if "@" not in email or "." not in email:
         return False, "Invalid email address"
 
-    users = _load_users()
-    if email in users:
+    store = get_user_store()
+    if store.get(email) is not None:
         return False, "User already exists"
 
     salt = secrets.token_hex(16)
     pwd_hash = _hash_password(password, salt)
-    users[email] = {
-        "salt": salt,
-        "hash": pwd_hash
-    }
-    _save_users(users)
+    # The insert is atomic, so a concurrent signup for the same email cannot overwrite this one
+    if not store.add(email, salt, pwd_hash):
+        return False, "User already exists"
     return True, "User created"
 
 
 def verify_user(email: str, password: str) -> bool:
     """Verify an email/password pair. Returns True if valid."""
-    users = _load_users()
-    if email not in users:
+    rec = get_user_store().get(email)
+    if rec is None:
         return False
-    rec = users[email]
-    salt = rec.get("salt")
-    expected = rec.get("hash")
+    salt, expected = rec
     if not salt or not expected:
         return False
-    return _hash_password(password, salt) == expected
+    return secrets.compare_digest(_hash_password(password, salt), expected)
+
+
+def issue_session(email: str) -> str:
+    """Return a signed session token for a user, bound to their current session version."""
+    return issue_token(email, version=get_user_store().session_version(email) or 0)
+
+
+def verify_session(token: str):
+    """
+    Verify a session token against its signature, expiry and the user's session version.
+
+    The version is cached per process for SESSION_VERSION_TTL_SECONDS
+    (30 s by default), so most verifications stay in memory; a logout on
+    another process or replica takes effect there within that time.
+
+    Returns:
+        dict or None: Claims of a valid token whose user exists and has not
+        revoked it (see revoke_sessions); None otherwise
+    """
+    claims = read_token(token)
+    if claims is None:
+        return None
+    max_age = float(os.getenv("SESSION_VERSION_TTL_SECONDS", DEFAULT_SESSION_VERSION_TTL))
+    if claims.get("ver") != get_user_store().session_version(claims["sub"], max_age=max_age):
+        return None
+    return claims
+
+
+def revoke_sessions(email: str) -> bool:
+    """End every session of a user, on all devices and replicas. Returns True if the user exists."""
+    return get_user_store().bump_session_version(email)
+
+
+def is_user_library(name: str) -> bool:
+    """Return True if a library name is the email of a user, i.e. opens that user's library."""
+    return get_user_store().owns_library(name)
 
 
 def list_users() -> list:
-    users = _load_users()
-    return list(users.keys())
+    return get_user_store().emails()
 
 
 def delete_user(email: str) -> bool:
-    users = _load_users()
-    if email in users:
-        users.pop(email)
-        _save_users(users)
-        return True
-    return False
+    return get_user_store().delete(email)
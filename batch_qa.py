@@ -0,0 +1,254 @@
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from embedding_scheduler import TokenBucket, is_retryable_error
+
+DEFAULT_WORKERS = 8
+
+# Questions embedded and searched together
+DEFAULT_WINDOW = 100
+
+DEFAULT_MAX_RETRIES = 5
+
+
+def load_questions(path):
+    """
+    Read a question set.
+
+    JSON Lines files hold one object per line with a "question" and an
+    optional "id"; any other file holds one question per line. Questions
+    without an ID are numbered by line.
+
+    Args:
+        path (str): Question file
+
+    Returns:
+        list: {"id": ..., "question": ...} dicts in file order
+    """
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                record = json.loads(line)
+                questions.append({"id": str(record.get("id", number)), "question": record["question"]})
+            else:
+                questions.append({"id": str(number), "question": line})
+    return questions
+
+
+def completed_ids(output_path):
+    """
+    Return the IDs of questions already answered in an output file.
+
+    A line cut off by a crash is removed, so appending continues on a
+    clean line. Records with an error are not counted and are retried.
+
+    Args:
+        output_path (str): JSON Lines output of an earlier run
+
+    Returns:
+        set: Question IDs
+    """
+    if not os.path.exists(output_path):
+        return set()
+
+    with open(output_path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+            data = data[:data.rfind(b"\n") + 1]
+
+    done = set()
+    for line in data.splitlines():
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if "error" not in record:
+            done.add(str(record["id"]))
+    return done
+
+
+class BatchQA:
+    def __init__(self, chat_handler, max_workers=None, requests_per_minute=None, window=None,
+                 max_retries=DEFAULT_MAX_RETRIES):
+        """
+        Initialize a batch question answerer.
+
+        Questions are processed in windows: the questions of a window are
+        embedded with one batched call and searched with one batched vector
+        search, then their answers are generated on a bounded thread pool.
+        Generation of one window overlaps with retrieval of the next.
+
+        Args:
+            chat_handler (ChatHandler): Handler over the corpus; its
+                retrieval settings and answer cache are used
+            max_workers (int): Concurrent generation requests (default:
+                BATCH_QA_WORKERS or 8)
+            requests_per_minute (float): Generation request limit (default:
+                GENERATION_RPM, unlimited if 0 or unset)
+            window (int): Questions embedded and searched together
+            max_retries (int): Retries of rate limited or failed generations
+        """
+        self.chat_handler = chat_handler
+        self.max_workers = max_workers or int(os.getenv("BATCH_QA_WORKERS", DEFAULT_WORKERS))
+        if requests_per_minute is None:
+            requests_per_minute = float(os.getenv("GENERATION_RPM", "0"))
+        self.rate_limiter = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.window = window or DEFAULT_WINDOW
+        self.max_retries = max_retries
+        self.base_delay = 1.0
+        self.max_delay = 30.0
+        self._write_lock = threading.Lock()
+        self._report = {}
+        self._progress_callback = None
+
+    def run(self, questions, output_path, k=4, progress_callback=None):
+        """
+        Answer questions and append the results to a JSON Lines file.
+
+        Each result is written as soon as it is ready, in completion order,
+        as {"id", "question", "answer", "sources", "cached", "seconds"}, or
+        with "error" instead of the answer. Questions already answered in
+        output_path are skipped, so an interrupted run can be restarted
+        with the same arguments.
+
+        Args:
+            questions (list): Question strings or {"id", "question"} dicts
+            output_path (str): JSON Lines output file
+            k (int): Number of chunks to retrieve per question
+            progress_callback (callable): Called with the report after every result
+
+        Returns:
+            dict: "total", "skipped", "answered", "cached", "failed" and "seconds"
+        """
+        started = time.perf_counter()
+        items = [
+            item if isinstance(item, dict) else {"id": str(number), "question": item}
+            for number, item in enumerate(questions, start=1)
+        ]
+        done = completed_ids(output_path)
+        pending = [item for item in items if str(item["id"]) not in done]
+        self._report = {
+            "total": len(items),
+            "skipped": len(items) - len(pending),
+            "answered": 0,
+            "cached": 0,
+            "failed": 0,
+        }
+        self._progress_callback = progress_callback
+
+        running = set()
+        with open(output_path, "a", encoding="utf-8") as output, \
+                ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="batch-qa") as pool:
+            for start in range(0, len(pending), self.window):
+                # Prepare the next window only once the pool is about to run dry
+                while len(running) > self.max_workers:
+                    _, running = wait(running, return_when=FIRST_COMPLETED)
+
+                window = pending[start:start + self.window]
+                try:
+                    searched = self._search_window(window, k)
+                except Exception as e:
+                    for item in window:
+                        self._write(output, item, error=f"Error retrieving context: {str(e)}")
+                    continue
+
+                for item, query_vector, vector_docs in searched:
+                    running.add(pool.submit(self._answer, output, item, query_vector, vector_docs, k))
+
+        self._report["seconds"] = time.perf_counter() - started
+        return dict(self._report)
+
+    def _search_window(self, window, k):
+        """
+        Embed and search a window of questions.
+
+        Args:
+            window (list): {"id", "question"} dicts
+            k (int): Number of chunks to retrieve per question
+
+        Returns:
+            list: (item, query_vector, vector_docs) per question
+        """
+        handler = self.chat_handler
+        helper = handler.vector_store_helper
+        queries = [item["question"] for item in window]
+
+        # One batched embedding call and one batched vector search
+        query_vectors = helper.query_embedder.embed_queries(queries)
+        vector_results = helper.similarity_search_by_vectors(
+            handler.vectorstore, query_vectors, k=handler.vector_fetch_k(k)
+        )
+        return list(zip(window, query_vectors, vector_results))
+
+    def _answer(self, output, item, query_vector, vector_docs, k):
+        """
+        Answer one searched question and write the result.
+
+        Args:
+            output: Open output file
+            item (dict): {"id", "question"}
+            query_vector (list): Embedding of the question
+            vector_docs (list): Vector search results for the question
+            k (int): Number of chunks to retrieve
+        """
+        started = time.perf_counter()
+        try:
+            result = self.chat_handler.answer_with_vector(
+                item["question"], query_vector, k=k, vector_docs=vector_docs, generate=self._generate
+            )
+        except Exception as e:
+            self._write(output, item, error=f"Error generating response: {str(e)}")
+            return
+        self._write(output, item, seconds=time.perf_counter() - started, **result)
+
+    def _generate(self, request):
+        """
+        Send a generation request, retrying rate limit and server errors with jittered backoff.
+
+        Args:
+            request (GenerateContentRequest): Request built by the chat handler
+
+        Returns:
+            GenerateContentResponse: Response of the GenerativeService API
+        """
+        attempt = 0
+        while True:
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            try:
+                return self.chat_handler.client.generate_content(request=request)
+            except Exception as e:
+                attempt += 1
+                if attempt > self.max_retries or not is_retryable_error(e):
+                    raise
+                delay = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+                time.sleep(random.uniform(0, delay))
+
+    def _write(self, output, item, answer=None, sources=None, cached=False, seconds=0.0, error=None):
+        """Append one result line and update the report."""
+        record = {"id": item["id"], "question": item["question"]}
+        if error is None:
+            record.update({"answer": answer, "sources": sources, "cached": cached, "seconds": round(seconds, 3)})
+        else:
+            record["error"] = error
+
+        with self._write_lock:
+            output.write(json.dumps(record) + "\n")
+            output.flush()
+            if error is not None:
+                self._report["failed"] += 1
+            elif cached:
+                self._report["cached"] += 1
+            else:
+                self._report["answered"] += 1
+            if self._progress_callback:
+                self._progress_callback(dict(self._report))
@@ -0,0 +1,96 @@
+"""
+Compare chunking throughput of TextChunker and RecursiveCharacterTextSplitter.
+
+Synthetic PDFs are extracted once with PDFProcessor, then the joined document
+text is chunked repeatedly by both. The splitter is timed the way
+PDFProcessor used it: split into strings, then every chunk is located again
+in the text to recover its offsets. Both must produce the same spans.
+
+Usage:
+    python benchmarks/chunker_benchmark.py --pages 100,1000
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter  # noqa: E402
+from synthetic_pdf import make_pdf, synthetic_pages  # noqa: E402
+
+from context_packer import estimate_tokens  # noqa: E402
+from pdf_processor import PAGE_SEPARATOR, PDFProcessor  # noqa: E402
+from text_chunker import DEFAULT_SEPARATORS, TextChunker  # noqa: E402
+
+
+def splitter_spans(splitter, text, chunk_overlap):
+    """Split with a LangChain splitter and recover the chunk offsets."""
+    spans = []
+    search_from = 0
+    for chunk in splitter.split_text(text):
+        if not chunk.strip():
+            continue
+        start = text.find(chunk, search_from)
+        if start < 0:
+            start = text.find(chunk)
+        spans.append((start, start + len(chunk)))
+        search_from = max(start + 1, start + len(chunk) - chunk_overlap)
+    return spans
+
+
+def best_time(function, repeat):
+    """Return the result and the fastest of repeat runs in seconds."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", default="100,1000", help="Comma-separated synthetic PDF sizes in pages")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=200)
+    parser.add_argument("--tokens", action="store_true", help="Measure chunk sizes in estimated tokens")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement, the fastest is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    length_function = estimate_tokens if args.tokens else None
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=args.chunk_size,
+        chunk_overlap=args.chunk_overlap,
+        length_function=length_function or len,
+        separators=list(DEFAULT_SEPARATORS)
+    )
+    chunker = TextChunker(args.chunk_size, args.chunk_overlap, length_function=length_function)
+
+    for pages in [int(size) for size in args.pages.split(",")]:
+        source = io.BytesIO(make_pdf(synthetic_pages(pages, seed=args.seed)))
+        source.name = f"synthetic-{pages}.pdf"
+        text = PAGE_SEPARATOR.join(page_text for _, page_text in PDFProcessor().iter_pages(source))
+        megabytes = len(text.encode("utf-8")) / 1e6
+
+        expected, splitter_seconds = best_time(
+            lambda: splitter_spans(splitter, text, args.chunk_overlap), args.repeat
+        )
+        spans, chunker_seconds = best_time(lambda: chunker.split_spans(text), args.repeat)
+        if spans != expected:
+            sys.exit(f"{pages} pages: TextChunker spans differ from RecursiveCharacterTextSplitter")
+
+        print(
+            f"{pages:>6} pages  {megabytes:7.2f} MB  {len(spans):>7} chunks  "
+            f"splitter {megabytes / splitter_seconds:7.2f} MB/s  "
+            f"chunker {megabytes / chunker_seconds:7.2f} MB/s  "
+            f"{splitter_seconds / chunker_seconds:.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
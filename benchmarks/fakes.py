@@ -0,0 +1,217 @@
+"""
+Deterministic offline stand-ins for the Gemini embedding and generation APIs.
+
+install_fakes() swaps the process-wide client registry, so VectorStore,
+ChatHandler and everything built on them run without GEMINI_API_KEY.
+"""
+import asyncio
+import hashlib
+import re
+import threading
+import time
+
+import numpy as np
+from google.ai.generativelanguage_v1beta import types
+from langchain_core.embeddings import Embeddings
+
+from clients import ClientRegistry, set_registry
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+from query_embedder import QueryEmbedder
+
+DEFAULT_DIMENSION = 768
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+class HashEmbeddings(Embeddings):
+    def __init__(self, dimension=DEFAULT_DIMENSION, latency=0.0, latency_per_text=0.0):
+        """
+        Initialize deterministic bag-of-words embeddings.
+
+        Every word maps to a fixed random unit vector seeded by its hash; a
+        text is the normalized sum of its word vectors, so texts sharing
+        words are similar and retrieval behaves plausibly.
+
+        Args:
+            dimension (int): Vector dimension
+            latency (float): Seconds slept per call, like a network round trip
+            latency_per_text (float): Additional seconds slept per text
+        """
+        self.dimension = dimension
+        self.latency = latency
+        self.latency_per_text = latency_per_text
+        self.calls = 0
+        self._words = {}
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        self._sleep(len(texts))
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        self._sleep(1)
+        return self._embed(text)
+
+    async def aembed_documents(self, texts):
+        await asyncio.sleep(self._delay(len(texts)))
+        return [self._embed(text) for text in texts]
+
+    async def aembed_query(self, text):
+        await asyncio.sleep(self._delay(1))
+        return self._embed(text)
+
+    def _embed(self, text):
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word in _WORD_PATTERN.findall(text.lower()) or [text]:
+            vector += self._word_vector(word)
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def _word_vector(self, word):
+        with self._lock:
+            vector = self._words.get(word)
+        if vector is None:
+            seed = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+            vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+            with self._lock:
+                self._words[word] = vector
+        return vector
+
+    def _delay(self, texts):
+        with self._lock:
+            self.calls += 1
+        return self.latency + self.latency_per_text * texts
+
+    def _sleep(self, texts):
+        delay = self._delay(texts)
+        if delay:
+            time.sleep(delay)
+
+
+class FakeGenerativeClient:
+    def __init__(self, latency=0.0, first_token_latency=None, answer_words=80, stream_chunks=8):
+        """
+        Initialize a stand-in for GenerativeServiceClient.
+
+        The answer is derived from a hash of the request, so equal requests
+        get equal answers.
+
+        Args:
+            latency (float): Seconds until the complete answer is returned
+            first_token_latency (float): Seconds until the first streamed
+                chunk (default: a quarter of latency)
+            answer_words (int): Words per answer
+            stream_chunks (int): Chunks a streamed answer is split into
+        """
+        self.latency = latency
+        self.first_token_latency = latency / 4 if first_token_latency is None else first_token_latency
+        self.answer_words = answer_words
+        self.stream_chunks = stream_chunks
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, request):
+        time.sleep(self._start())
+        return self._response(self._answer(request))
+
+    def stream_generate_content(self, request):
+        time.sleep(self._start(stream=True))
+        for position, chunk in enumerate(self._chunks(self._answer(request))):
+            if position:
+                time.sleep(self._chunk_delay())
+            yield self._response(chunk)
+
+    def _start(self, stream=False):
+        with self._lock:
+            self.calls += 1
+        return self.first_token_latency if stream else self.latency
+
+    def _chunk_delay(self):
+        return max(self.latency - self.first_token_latency, 0.0) / max(self.stream_chunks - 1, 1)
+
+    def _answer(self, request):
+        digest = hashlib.sha256(types.GenerateContentRequest.serialize(request)).hexdigest()
+        return " ".join(digest[i % 56:i % 56 + 8] for i in range(self.answer_words))
+
+    def _chunks(self, answer):
+        words = answer.split(" ")
+        size = max(len(words) // self.stream_chunks, 1)
+        for start in range(0, len(words), size):
+            yield " ".join(words[start:start + size]) + " "
+
+    @staticmethod
+    def _response(text):
+        return types.GenerateContentResponse(candidates=[
+            types.Candidate(content=types.Content(role="model", parts=[types.Part(text=text)]))
+        ])
+
+
+class FakeAsyncGenerativeClient(FakeGenerativeClient):
+    """Stand-in for GenerativeServiceAsyncClient."""
+
+    async def generate_content(self, request):
+        await asyncio.sleep(self._start())
+        return self._response(self._answer(request))
+
+
+class FakeClientRegistry(ClientRegistry):
+    def __init__(self, dimension=DEFAULT_DIMENSION, embed_latency=0.0, embed_latency_per_text=0.0,
+                 generate_latency=0.0):
+        """
+        Initialize a registry that hands out the offline stand-ins.
+
+        Document embeddings still go through CachedEmbeddings, backed by
+        an in-memory cache, so the cache lookups are part of what is measured.
+
+        Args:
+            dimension (int): Embedding dimension
+            embed_latency (float): Seconds per embedding call
+            embed_latency_per_text (float): Additional seconds per embedded text
+            generate_latency (float): Seconds per generation
+        """
+        super().__init__()
+        self.document_embeddings = HashEmbeddings(dimension, embed_latency, embed_latency_per_text)
+        self.query_embeddings = HashEmbeddings(dimension, embed_latency, embed_latency_per_text)
+        self.generative = FakeGenerativeClient(generate_latency)
+        self.async_generative = FakeAsyncGenerativeClient(generate_latency)
+        self._cache = EmbeddingCache(path=":memory:")
+
+    def generative_client(self):
+        return self.generative
+
+    def async_generative_client(self):
+        return self.async_generative
+
+    def embeddings(self, model, task_type):
+        key = (model, task_type)
+        with self._lock:
+            if key not in self._embeddings:
+                self._embeddings[key] = CachedEmbeddings(self.document_embeddings, self._cache, model, task_type)
+            return self._embeddings[key]
+
+    def query_embedder(self, model):
+        with self._lock:
+            if model not in self._query_embedders:
+                self._query_embedders[model] = QueryEmbedder(self.query_embeddings)
+            return self._query_embedders[model]
+
+    def embedding_rate_limiter(self):
+        return None
+
+    def health_check(self, timeout=5.0):
+        return True
+
+
+def install_fakes(**kwargs):
+    """
+    Route all Gemini clients of the process to offline stand-ins.
+
+    Args:
+        **kwargs: FakeClientRegistry arguments
+
+    Returns:
+        FakeClientRegistry: The installed registry
+    """
+    registry = FakeClientRegistry(**kwargs)
+    set_registry(registry)
+    return registry
@@ -0,0 +1,140 @@
+"""
+Compare the Chroma and NumPy index backends on random embeddings.
+
+Measures build time, reopen time from disk, top-k query latency and the
+recall of each backend against exact cosine search.
+
+Usage:
+    python benchmarks/index_benchmark.py --chunks 5000 --dim 768 --queries 200
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_community.vectorstores import Chroma  # noqa: E402
+from langchain_core.embeddings import Embeddings  # noqa: E402
+
+from numpy_index import DTYPES, NumpyIndex  # noqa: E402
+
+BATCH_SIZE = 100
+
+
+class _NoEmbeddings(Embeddings):
+    """Placeholder embedding function; the benchmark only passes precomputed vectors."""
+
+    def embed_documents(self, texts):
+        raise NotImplementedError
+
+    def embed_query(self, text):
+        raise NotImplementedError
+
+
+def _write(index, upsert, vectors):
+    """Write vectors in ingest-sized batches and return the elapsed time."""
+    started = time.perf_counter()
+    for start in range(0, len(vectors), BATCH_SIZE):
+        end = min(start + BATCH_SIZE, len(vectors))
+        upsert(
+            ids=[f"doc:{i}" for i in range(start, end)],
+            embeddings=vectors[start:end].tolist(),
+            documents=[f"chunk {i}" for i in range(start, end)],
+            metadatas=[{"doc_hash": "doc", "chunk_index": i} for i in range(start, end)],
+        )
+    return time.perf_counter() - started
+
+
+def _query(index, queries, k):
+    """Run all queries and return (latencies in ms, result rows per query)."""
+    latencies = []
+    results = []
+    for query in queries:
+        started = time.perf_counter()
+        docs = index.similarity_search_by_vector(query.tolist(), k=k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        results.append([doc.metadata["chunk_index"] for doc in docs])
+    return latencies, results
+
+
+def _summary(name, build_seconds, open_seconds, latencies, results, exact, k):
+    recall = np.mean([len(set(got) & set(want)) / k for got, want in zip(results, exact)])
+    return {
+        "backend": name,
+        "build_s": round(build_seconds, 3),
+        "open_ms": round(open_seconds * 1000, 2),
+        "query_p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "query_p95_ms": round(float(np.percentile(latencies, 95)), 3),
+        f"recall@{k}": round(float(recall), 4),
+    }
+
+
+def run(chunks, dim, num_queries, k, seed):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((chunks, dim)).astype(np.float32)
+    queries = rng.standard_normal((num_queries, dim)).astype(np.float32)
+
+    unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    exact = [np.argsort(-(unit @ (q / np.linalg.norm(q))))[:k].tolist() for q in queries]
+
+    results = []
+    workdir = tempfile.mkdtemp()
+    try:
+        # Chroma persisted to disk, as used by the document library
+        directory = os.path.join(workdir, "chroma")
+        started = time.perf_counter()
+        chroma = Chroma(embedding_function=_NoEmbeddings(), persist_directory=directory,
+                        collection_metadata={"hnsw:space": "cosine"})
+        open_seconds = time.perf_counter() - started
+        build = _write(chroma, chroma._collection.upsert, vectors)
+        latencies, found = _query(chroma, queries, k)
+        results.append(_summary("chroma", build, open_seconds, latencies, found, exact, k))
+
+        for dtype in DTYPES:
+            directory = os.path.join(workdir, f"numpy-{dtype}")
+            index = NumpyIndex(dtype=dtype, persist_directory=directory)
+            build = _write(index, index.upsert, vectors)
+            started = time.perf_counter()
+            index.persist()
+            build += time.perf_counter() - started
+
+            # Reopen memory-mapped, the way a returning user loads the library
+            started = time.perf_counter()
+            index = NumpyIndex.load(directory)
+            open_seconds = time.perf_counter() - started
+            latencies, found = _query(index, queries, k)
+            results.append(_summary(f"numpy-{dtype}", build, open_seconds, latencies, found, exact, k))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=5000, help="Number of indexed vectors")
+    parser.add_argument("--dim", type=int, default=768, help="Embedding dimension")
+    parser.add_argument("--queries", type=int, default=200, help="Number of timed queries")
+    parser.add_argument("-k", type=int, default=4, help="Results per query")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    results = run(args.chunks, args.dim, args.queries, args.k, args.seed)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    columns = list(results[0])
+    print("  ".join(f"{column:>14}" for column in columns))
+    for row in results:
+        print("  ".join(f"{row[column]!s:>14}" for column in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+Benchmark the PDF-chat pipeline offline, stage by stage.
+
+Gemini is replaced by deterministic stand-ins (benchmarks/fakes.py) with
+configurable latency, so results depend only on this code and the machine.
+For each synthetic PDF size the benchmark measures extraction pages/s,
+chunking MB/s, index build time, retrieval p50/p99 and end-to-end QPS, and
+writes the results as JSON for comparison between commits.
+
+Usage:
+    python benchmarks/pipeline_benchmark.py --pages 10,100,500
+    python benchmarks/pipeline_benchmark.py --compare benchmarks/results/pipeline-<commit>.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from fakes import install_fakes  # noqa: E402
+from synthetic_pdf import make_pdf, synthetic_pages, synthetic_questions  # noqa: E402
+
+from chat_handler import ChatHandler  # noqa: E402
+from lexical_index import LexicalIndex  # noqa: E402
+from pdf_processor import PDFProcessor  # noqa: E402
+from vector_store import VectorStore  # noqa: E402
+
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, "results")
+
+# Metrics where a larger value is better; all others are timings
+_HIGHER_IS_BETTER = ("extract_pages_per_s", "chunk_mb_per_s", "index_chunks_per_s", "qps")
+
+
+def _percentile(values, q):
+    return round(float(np.percentile(values, q)), 3) if values else None
+
+
+def _git_commit():
+    """Return the current commit hash, or None outside a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=BENCHMARK_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _measure_end_to_end(vectorstore, lexical_index, questions, concurrency, k):
+    """Answer questions on concurrent threads, one ChatHandler each, and return QPS."""
+    position = iter(range(len(questions)))
+    lock = threading.Lock()
+
+    def worker():
+        handler = ChatHandler(vectorstore, lexical_index=lexical_index)
+        while True:
+            with lock:
+                index = next(position, None)
+            if index is None:
+                return
+            handler.get_response(questions[index], k=k)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(questions) / (time.perf_counter() - started)
+
+
+def run_size(pages, args, seed):
+    """Run every stage on one synthetic PDF and return its metrics."""
+    data = make_pdf(synthetic_pages(pages, seed=seed))
+    source = io.BytesIO(data)
+    source.name = f"synthetic-{pages}.pdf"
+    processor = PDFProcessor()
+
+    started = time.perf_counter()
+    page_texts = list(processor.iter_pages(source))
+    extract_seconds = time.perf_counter() - started
+    text_bytes = sum(len(text.encode("utf-8")) for _, text in page_texts)
+
+    lexical_index = LexicalIndex()
+    started = time.perf_counter()
+    chunks = list(processor.iter_chunks(page_texts, source.name, doc_hash=f"synthetic-{pages}",
+                                        lexical_index=lexical_index))
+    chunk_seconds = time.perf_counter() - started
+
+    vector_store = VectorStore(backend=args.backend, requests_per_minute=args.embedding_rpm)
+    started = time.perf_counter()
+    vectorstore = vector_store.create_vectorstore(chunks)
+    index_seconds = time.perf_counter() - started
+
+    # Retrieval as ChatHandler runs it: query embedding, search, fusion and reranking
+    handler = ChatHandler(vectorstore, lexical_index=lexical_index)
+    latencies = []
+    for question in synthetic_questions(args.queries, seed=seed + 1):
+        started = time.perf_counter()
+        handler._retrieve(question, None, args.k)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    qps = _measure_end_to_end(
+        vectorstore, lexical_index, synthetic_questions(args.questions, seed=seed + 2), args.concurrency, args.k
+    )
+    return {
+        "pages": pages,
+        "pdf_bytes": len(data),
+        "chunks": len(chunks),
+        "extract_pages_per_s": round(len(page_texts) / extract_seconds, 1),
+        "chunk_mb_per_s": round(text_bytes / 1e6 / chunk_seconds, 2),
+        "index_build_s": round(index_seconds, 3),
+        "index_chunks_per_s": round(len(chunks) / index_seconds, 1),
+        "retrieval_p50_ms": _percentile(latencies, 50),
+        "retrieval_p99_ms": _percentile(latencies, 99),
+        "qps": round(qps, 2),
+    }
+
+
+def compare(current, baseline_path, tolerance):
+    """Print the change of every metric against a baseline and return the regressions."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {row["pages"]: row for row in json.load(f)["results"]}
+
+    regressions = []
+    for row in current["results"]:
+        before = baseline.get(row["pages"])
+        if before is None:
+            continue
+        for metric, value in row.items():
+            old = before.get(metric)
+            if metric in ("pages", "pdf_bytes", "chunks") or not old or value is None:
+                continue
+            change = (value - old) / old
+            worse = -change if metric in _HIGHER_IS_BETTER else change
+            flag = "  REGRESSION" if worse > tolerance else ""
+            print(f"{row['pages']:>6} pages  {metric:<20} {old:>10} -> {value:<10} {change:+.1%}{flag}")
+            if flag:
+                regressions.append((row["pages"], metric))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", default="10,100,500", help="Comma-separated synthetic PDF sizes in pages")
+    parser.add_argument("--backend", default="numpy", choices=("chroma", "numpy"), help="Vector index backend")
+    parser.add_argument("--dim", type=int, default=768, help="Embedding dimension")
+    parser.add_argument("--queries", type=int, default=200, help="Timed retrievals per size")
+    parser.add_argument("--questions", type=int, default=100, help="Answered questions per size for QPS")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent sessions for QPS")
+    parser.add_argument("-k", type=int, default=4, help="Chunks retrieved per question")
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0, help="Simulated latency per embedding call")
+    parser.add_argument(
+        "--embedding-rpm", type=float, default=0,
+        help="Embedding request quota applied while indexing (default: unlimited, to measure local cost)"
+    )
+    parser.add_argument("--generate-latency-ms", type=float, default=0.0, help="Simulated latency per generation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/pipeline-<commit>.json)")
+    parser.add_argument("--compare", help="Earlier result file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Relative change reported as a regression")
+    args = parser.parse_args()
+
+    install_fakes(
+        dimension=args.dim,
+        embed_latency=args.embed_latency_ms / 1000,
+        generate_latency=args.generate_latency_ms / 1000,
+    )
+
+    commit = _git_commit()
+    results = []
+    for pages in [int(size) for size in args.pages.split(",")]:
+        row = run_size(pages, args, args.seed)
+        results.append(row)
+        print("  ".join(f"{key}={value}" for key, value in row.items()))
+
+    report = {
+        "benchmark": "pipeline",
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "tolerance")},
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"pipeline-{(commit or 'local')[:12]}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        regressions = compare(report, args.compare, args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
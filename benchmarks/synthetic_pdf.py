@@ -0,0 +1,110 @@
+"""
+Synthetic PDF documents and questions for benchmarks.
+
+Pages are filled with seeded pseudo-English text and identifiers such as
+"ERR-4021", and written as a minimal uncompressed PDF that PyPDF2 reads.
+"""
+import random
+
+_VOCABULARY = (
+    "account agreement amount analysis annual application approval asset audit balance billing budget "
+    "capacity certificate claim clause compliance component configuration contract coverage customer "
+    "data delivery department deposit device document duration employee energy equipment estimate "
+    "facility failure fee filter firmware frequency guarantee hardware incident installation insurance "
+    "interest inventory invoice liability license limit maintenance manual margin measurement module "
+    "network notice obligation operation order output payment penalty performance period policy power "
+    "pressure procedure product project quality quarter rate record renewal report requirement revenue "
+    "risk schedule sensor service shipment signal software specification supplier support system "
+    "temperature term termination threshold transfer update usage valve vendor version voltage warranty"
+).split()
+_CONNECTIVES = "the a of to and in for with on by is are must shall may be this that from at".split()
+
+LINES_PER_PAGE = 50
+WORDS_PER_LINE = 12
+
+
+def synthetic_pages(pages, seed=0):
+    """
+    Generate page texts.
+
+    Args:
+        pages (int): Number of pages
+        seed (int): Random seed
+
+    Returns:
+        list: One text per page, lines separated by newlines
+    """
+    rng = random.Random(seed)
+    texts = []
+    for page in range(pages):
+        lines = [f"Section {page + 1}.{rng.randint(1, 9)} {rng.choice(_VOCABULARY).title()}"]
+        for _ in range(LINES_PER_PAGE - 1):
+            words = []
+            for _ in range(WORDS_PER_LINE):
+                roll = rng.random()
+                if roll < 0.45:
+                    words.append(rng.choice(_CONNECTIVES))
+                elif roll < 0.97:
+                    words.append(rng.choice(_VOCABULARY))
+                else:
+                    words.append(f"ERR-{rng.randint(1000, 9999)}")
+            lines.append(" ".join(words))
+        texts.append("\n".join(lines))
+    return texts
+
+
+def synthetic_questions(count, seed=0):
+    """
+    Generate distinct questions over the synthetic vocabulary.
+
+    Args:
+        count (int): Number of questions
+        seed (int): Random seed
+
+    Returns:
+        list: Question strings
+    """
+    rng = random.Random(seed)
+    questions = []
+    for number in range(count):
+        topic = " ".join(rng.sample(_VOCABULARY, 3))
+        questions.append(f"What does the document say about {topic} (case {number})?")
+    return questions
+
+
+def make_pdf(pages):
+    """
+    Write page texts as a PDF with one Helvetica text block per page.
+
+    Args:
+        pages (list): Page texts, lines separated by newlines
+
+    Returns:
+        bytes: PDF file content
+    """
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        ("<< /Type /Pages /Kids [%s] /Count %d >>" % (
+            " ".join(f"{4 + 2 * i} 0 R" for i in range(len(pages))), len(pages)
+        )).encode(),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, text in enumerate(pages):
+        lines = [line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in text.split("\n")]
+        stream = ("BT /F1 10 Tf 40 760 Td 14 TL " + " ".join(f"({line}) '" for line in lines) + " ET").encode("latin-1")
+        objects.append((
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>"
+        ).encode())
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
@@ -1,28 +1,100 @@
+import asyncio
 import os
-from google.ai import generativelanguage_v1beta as genai
+import time
+import tracing
 from google.ai.generativelanguage_v1beta import types
-from google.api_core import client_options as client_options_lib
-from vector_store import VectorStore
+from answer_cache import get_answer_cache
+from clients import generative_model_name, get_registry
+from context_packer import ContextPacker
+from vector_store import HYBRID_FETCH_FACTOR, HYBRID_MIN_FETCH, VectorStore
+
+SYSTEM_PROMPT = (
+    "You are a helpful AI assistant that answers questions based solely on the provided document content.\n\n"
+    "Instructions:\n"
+    "1. Answer the question using ONLY the information provided in the context below\n"
+    "2. Be concise but comprehensive in your response\n"
+    "3. If the context doesn't contain enough information to answer the question, say so clearly\n"
+    "4. Do not make up information that isn't in the provided context\n"
+    "5. Use a friendly and professional tone\n"
+    "6. Structure your answer clearly with bullet points or numbered lists when appropriate\n"
+    "7. Use the earlier conversation only to understand what the question refers to"
+)
+
+NO_DOCUMENTS_MESSAGE = "I couldn't find any relevant information in the uploaded documents to answer your question."
+NO_RESPONSE_MESSAGE = "I apologize, but I couldn't generate a response. Please try rephrasing your question."
+TIMEOUT_MESSAGE = "I'm sorry, answering took too long. Please try again."
+RETRIEVAL_MODES = ("vector", "hybrid")
+
+# Seconds an async request may take before it is abandoned
+DEFAULT_REQUEST_TIMEOUT = 60
+
+# Candidates fetched per returned chunk when results are diversified
+MMR_FETCH_FACTOR = 4
 
 class ChatHandler:
-    def __init__(self, vectorstore):
+    def __init__(self, vectorstore, corpus_fingerprint=None, answer_cache=None, lexical_index=None,
+                 retrieval_mode=None, diversify=None, context_budget=None, memory=None, doc_hashes=None):
         """
         Initialize chat handler with Gemini AI client and vector store.
         
         Args:
             vectorstore: Chroma vector store instance
+            corpus_fingerprint (str): Fingerprint of the indexed documents
+                (see AnswerCache.corpus_fingerprint); enables answer caching
+            answer_cache (AnswerCache): Cache to use instead of the shared one
+            lexical_index (LexicalIndex): BM25 index over the same chunks
+            retrieval_mode (str): "vector" or "hybrid" (default: RETRIEVAL_MODE,
+                or "hybrid" when a lexical index is given)
+            diversify (bool): Over-fetch and rerank with maximal marginal
+                relevance, so overlapping neighbour chunks are not all
+                returned (default: RETRIEVAL_MMR, on)
+            context_budget (int): Maximum prompt context tokens (default:
+                CONTEXT_TOKEN_BUDGET or 2000)
+            memory (ConversationMemory): History of the conversation; follow-up
+                questions are condensed into standalone retrieval queries and
+                answered with the recent turns and the summary in the prompt
+            doc_hashes (set): Documents answers may use, normally those the
+                corpus_fingerprint was computed from; chunks of any other
+                document, e.g. one still being ingested, are skipped
+                (default: all chunks in the index)
         """
         self.vectorstore = vectorstore
         self.vector_store_helper = VectorStore()
         
-        # Initialize Gemini AI (Generative Language) client
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            raise ValueError("GEMINI_API_KEY not found in environment variables")
-
-        # Use API key via client options
-        client_opts = client_options_lib.ClientOptions(api_key=api_key)
-        self.client = genai.GenerativeServiceClient(client_options=client_opts)
+        # Hybrid retrieval fuses vector and BM25 rankings
+        self.lexical_index = lexical_index
+        self.retrieval_mode = retrieval_mode or os.getenv("RETRIEVAL_MODE") or (
+            "hybrid" if lexical_index is not None else "vector"
+        )
+        if self.retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unsupported retrieval mode: {self.retrieval_mode}")
+        
+        # MMR reranking of over-fetched candidates, bounded by a latency budget
+        if diversify is None:
+            diversify = os.getenv("RETRIEVAL_MMR", "1").lower() not in ("0", "false", "no")
+        self.diversify = diversify
+        self.mmr_lambda = float(os.getenv("MMR_LAMBDA", "0.5"))
+        self.rerank_budget = float(os.getenv("RERANK_BUDGET_MS", "50")) / 1000
+        
+        # Merges overlapping chunks and caps the context size
+        self.context_packer = ContextPacker(context_budget)
+        
+        # Reuse the process-wide Gemini AI (Generative Language) client
+        self.client = get_registry().generative_client()
+        
+        # Answers are only reused for the same set of documents
+        self.corpus_fingerprint = corpus_fingerprint
+        self.answer_cache = (answer_cache or get_answer_cache()) if corpus_fingerprint else None
+        self.doc_hashes = set(doc_hashes) if doc_hashes is not None else None
+        
+        # Async requests are abandoned after this many seconds
+        self.request_timeout = float(os.getenv("REQUEST_TIMEOUT", DEFAULT_REQUEST_TIMEOUT))
+        
+        # Bounded history of the conversation, if this handler serves one
+        self.memory = memory
+        
+        # Stage timings in seconds of the last answered question
+        self.last_timings = {}
     
     def get_response(self, query, k=4):
         """
@@ -31,98 +103,444 @@ class ChatHandler:
         Args:
             query (str): User question
             k (int): Number of similar documents to retrieve
-            
+        
         Returns:
             tuple: (response_text, sources_list)
         """
+        started = time.perf_counter()
+        trace = tracing.start_trace("question", k=k)
         try:
-            # Perform similarity search
-            relevant_docs = self.vector_store_helper.similarity_search(
-                self.vectorstore, query, k=k
-            )
-            
-            if not relevant_docs:
-                return "I couldn't find any relevant information in the uploaded documents to answer your question.", []
-            
-            # Prepare context from relevant documents
-            context = ""
-            sources = []
-            
-            for doc in relevant_docs:
-                context += f"\n--- Source: {doc.metadata.get('filename', 'Unknown')} ---\n"
-                context += doc.page_content + "\n"
+            with tracing.activate(trace):
+                # Follow-up questions are looked up and searched as standalone queries
+                history = self._history()
+                search_query = self.memory.condense_query(query) if history else query
+                # A follow-up that was not condensed depends on the conversation
+                standalone = not history or search_query != query
                 
-                # Add source information
-                source_info = {
-                    "filename": doc.metadata.get('filename', 'Unknown'),
-                    "page": doc.metadata.get('page', 'Unknown')
-                }
+                # Answer repeated questions from the cache without calling the LLM
+                cached, query_vector = self._cached_answer(search_query, started, lookup=standalone)
+                if cached:
+                    self._remember(query, cached[0])
+                    return cached
                 
-                # Avoid duplicate sources
-                if source_info not in sources:
-                    sources.append(source_info)
-            
-            # Create prompt for Gemini (Generative Language)
-            system_instruction = types.Content(parts=[types.Part(text=(
-                "You are a helpful AI assistant that answers questions based solely on the provided document content.\n\n"
-                "Instructions:\n"
-                "1. Answer the question using ONLY the information provided in the context below\n"
-                "2. Be concise but comprehensive in your response\n"
-                "3. If the context doesn't contain enough information to answer the question, say so clearly\n"
-                "4. Do not make up information that isn't in the provided context\n"
-                "5. Use a friendly and professional tone\n"
-                "6. Structure your answer clearly with bullet points or numbered lists when appropriate"
-            ))])
-
-            user_prompt = f"""Context from uploaded documents:
-{context}
-
-Question: {query}
-
-Please provide a detailed answer based on the context above."""
-
-            user_content = types.Content(role="user", parts=[types.Part(text=user_prompt)])
-
-            # Build generation config
-            gen_config = types.GenerationConfig(
-                temperature=0.1,
-                max_output_tokens=1000,
-            )
-
-            # Normalize model name (GenerativeService expects model names like 'models/xyz')
-            model_name = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
-            if not model_name.startswith("models/"):
-                model_name = f"models/{model_name}"
-
-            # Build request
-            request = types.GenerateContentRequest(
-                model=model_name,
-                system_instruction=system_instruction,
-                contents=[user_content],
-                generation_config=gen_config,
-            )
-
-            # Call the GenerativeService API
-            response = self.client.generate_content(request=request)
-
-            # Extract text from the first candidate if present
-            if response and response.candidates:
-                candidate = response.candidates[0]
-                # Join any text parts from the candidate content
-                text_parts = []
-                if candidate.content and candidate.content.parts:
-                    for p in candidate.content.parts:
-                        if getattr(p, 'text', None):
-                            text_parts.append(p.text)
-                response_text = "\n".join(text_parts).strip()
+                # Perform similarity search, reusing the query vector of the cache lookup
+                relevant_docs = self._retrieve(search_query, query_vector, k)
+                self.last_timings["retrieval"] = time.perf_counter() - started
+                
+                if not relevant_docs:
+                    return NO_DOCUMENTS_MESSAGE, []
+                
+                # Prepare context from relevant documents
+                context, sources = self._build_context(relevant_docs)
+                request = self._build_request(query, context, history)
+                
+                # Call the GenerativeService API
+                with tracing.span("generate"):
+                    response = self.client.generate_content(request=request)
+                self.last_timings["total"] = time.perf_counter() - started
+                
+                response_text = self._response_text(response)
                 if response_text:
+                    # Answers shaped by this conversation are not shared with other sessions
+                    if not history:
+                        self._store_answer(query, query_vector, response_text, sources)
+                    self._remember(query, response_text)
                     return response_text, sources
-
-            return "I apologize, but I couldn't generate a response. Please try rephrasing your question.", sources
                 
+                return NO_RESPONSE_MESSAGE, sources
+        
+        except Exception as e:
+            trace.set(error=str(e))
+            error_msg = f"Error generating response: {str(e)}"
+            return error_msg, []
+        finally:
+            trace.finish(**self.last_timings)
+    
+    async def aget_response(self, query, k=4, timeout=None):
+        """
+        Get AI response without blocking the event loop.
+        
+        Embedding and generation use the async Gemini AI clients, the local
+        index search runs on a worker thread, so one event loop can serve
+        many sessions concurrently. Cancelling the calling task cancels
+        the in-flight API call. Each handler answers one question at a
+        time, use one handler per session.
+        
+        Args:
+            query (str): User question
+            k (int): Number of similar documents to retrieve
+            timeout (float): Seconds before the request is abandoned
+                (default: REQUEST_TIMEOUT or 60)
+        
+        Returns:
+            tuple: (response_text, sources_list)
+        """
+        started = time.perf_counter()
+        trace = tracing.start_trace("question", k=k)
+        try:
+            async with asyncio.timeout(timeout or self.request_timeout):
+                with tracing.activate(trace):
+                    # Follow-up questions are looked up and searched as standalone queries
+                    history = self._history()
+                    search_query = await self.memory.acondense_query(query) if history else query
+                    # A follow-up that was not condensed depends on the conversation
+                    standalone = not history or search_query != query
+                    
+                    # Answer repeated questions from the cache without calling the LLM
+                    cached, query_vector = await self._acached_answer(search_query, started, lookup=standalone)
+                    if cached:
+                        self._remember(query, cached[0])
+                        return cached
+                    
+                    if query_vector is None:
+                        query_vector = await self.vector_store_helper.query_embedder.aembed_query(search_query)
+                    relevant_docs = await asyncio.to_thread(self._retrieve, search_query, query_vector, k)
+                    self.last_timings["retrieval"] = time.perf_counter() - started
+                    
+                    if not relevant_docs:
+                        return NO_DOCUMENTS_MESSAGE, []
+                    
+                    # Prepare context from relevant documents
+                    context, sources = self._build_context(relevant_docs)
+                    request = self._build_request(query, context, history)
+                    
+                    # Call the GenerativeService API on the client of this event loop
+                    client = get_registry().async_generative_client()
+                    with tracing.span("generate"):
+                        response = await client.generate_content(request=request)
+                    self.last_timings["total"] = time.perf_counter() - started
+                    
+                    response_text = self._response_text(response)
+                    if response_text:
+                        # Answers shaped by this conversation are not shared with other sessions
+                        if not history:
+                            self._store_answer(query, query_vector, response_text, sources)
+                        self._remember(query, response_text)
+                        return response_text, sources
+                    
+                    return NO_RESPONSE_MESSAGE, sources
+        
+        except TimeoutError:
+            self.last_timings["timed_out"] = True
+            self.last_timings["total"] = time.perf_counter() - started
+            return TIMEOUT_MESSAGE, []
+        
         except Exception as e:
+            trace.set(error=str(e))
             error_msg = f"Error generating response: {str(e)}"
             return error_msg, []
+        finally:
+            trace.finish(**self.last_timings)
+    
+    def stream_response(self, query, k=4):
+        """
+        Get AI response as a stream of text deltas.
+        
+        Retrieval runs before this method returns, so the sources are known
+        up front. Generation starts when the returned generator is consumed.
+        Once it is exhausted, self.last_timings holds the retrieval time,
+        the time to the first token and the total time, all measured from
+        the call to this method.
+        
+        Args:
+            query (str): User question
+            k (int): Number of similar documents to retrieve
+        
+        Returns:
+            tuple: (text_delta_generator, sources_list)
+        """
+        started = time.perf_counter()
+        trace = tracing.start_trace("question", k=k, stream=True)
+        try:
+            with tracing.activate(trace):
+                # Follow-up questions are looked up and searched as standalone queries
+                history = self._history()
+                search_query = self.memory.condense_query(query) if history else query
+                # A follow-up that was not condensed depends on the conversation
+                standalone = not history or search_query != query
+                
+                # Answer repeated questions from the cache without calling the LLM
+                cached, query_vector = self._cached_answer(search_query, started, lookup=standalone)
+                if cached:
+                    self._remember(query, cached[0])
+                    trace.finish(**self.last_timings)
+                    return iter([cached[0]]), cached[1]
+                
+                # Perform similarity search, reusing the query vector of the cache lookup
+                relevant_docs = self._retrieve(search_query, query_vector, k)
+                self.last_timings["retrieval"] = time.perf_counter() - started
+                
+                if not relevant_docs:
+                    trace.finish(**self.last_timings)
+                    return iter([NO_DOCUMENTS_MESSAGE]), []
+                
+                # Prepare context from relevant documents
+                context, sources = self._build_context(relevant_docs)
+                request = self._build_request(query, context, history)
+        
+        except Exception as e:
+            trace.finish(error=str(e), **self.last_timings)
+            return iter([f"Error generating response: {str(e)}"]), []
+        
+        # Answers shaped by this conversation are not shared with other sessions
+        return self._stream_text(request, started, query, query_vector, sources, trace, cache=not history), sources
+    
+    def _stream_text(self, request, started, query, query_vector, sources, trace=None, cache=True):
+        """
+        Yield text deltas from the streaming GenerativeService API.
+        
+        The complete answer is stored in the answer cache once the stream
+        has finished.
+        
+        Args:
+            request (GenerateContentRequest): Request to send
+            started (float): perf_counter value the timings are measured from
+            query (str): User question
+            query_vector (list): Embedding of the question, if computed
+            sources (list): Sources of the answer
+            trace (Trace): Trace of the question, finished with the stream
+            cache (bool): Store the complete answer in the answer cache
+        
+        Yields:
+            str: Text deltas in generation order
+        """
+        parts = []
+        generate_started = time.perf_counter()
+        try:
+            for chunk in self.client.stream_generate_content(request=request):
+                text = self._response_text(chunk, strip=False)
+                if not text:
+                    continue
+                if not parts:
+                    self.last_timings["first_token"] = time.perf_counter() - started
+                parts.append(text)
+                yield text
+            
+            if not parts:
+                yield NO_RESPONSE_MESSAGE
+            else:
+                answer = "".join(parts).strip()
+                if cache:
+                    self._store_answer(query, query_vector, answer, sources)
+                self._remember(query, answer)
+        
+        except Exception as e:
+            if trace is not None:
+                trace.set(error=str(e))
+            yield f"Error generating response: {str(e)}"
+        finally:
+            self.last_timings["total"] = time.perf_counter() - started
+            if trace is not None:
+                # The generator runs outside the trace context, so record generation on it directly
+                generate_seconds = time.perf_counter() - generate_started
+                tracing.observe("generate", generate_seconds)
+                trace.add("generate", generate_seconds)
+                trace.finish(**self.last_timings)
+    
+    def answer_with_vector(self, query, query_vector, k=4, vector_docs=None, generate=None):
+        """
+        Answer a question whose embedding and vector search are precomputed.
+        
+        For batched callers that embed and search many questions at once.
+        The answer cache is used like in get_response, the conversation
+        memory is not, and self.last_timings is left untouched, so several
+        threads can answer with one handler concurrently.
+        
+        Args:
+            query (str): User question
+            query_vector (list): Embedding of the question
+            k (int): Number of chunks to retrieve
+            vector_docs (list): Vector search results for the question, at
+                least vector_fetch_k(k) of them; searched if None
+            generate (callable): Sends a GenerateContentRequest and returns
+                the response, e.g. with rate limiting and retries (default:
+                self.client.generate_content); its errors are raised
+        
+        Returns:
+            dict: "answer", "sources" and "cached" (True if the answer came
+            from the answer cache)
+        """
+        if self.answer_cache:
+            cached, _ = self.answer_cache.lookup(self.corpus_fingerprint, query, lambda _: query_vector)
+            if cached is not None:
+                return {"answer": cached[0], "sources": cached[1], "cached": True}
+        
+        # BM25 fusion and MMR run locally, per question
+        timings = {}
+        relevant_docs = self._retrieve(query, query_vector, k, vector_docs=vector_docs, timings=timings)
+        if not relevant_docs:
+            return {"answer": NO_DOCUMENTS_MESSAGE, "sources": [], "cached": False}
+        
+        context, sources = self._build_context(relevant_docs, timings)
+        request = self._build_request(query, context)
+        with tracing.span("generate"):
+            response = (generate or self.client.generate_content)(request=request)
+        
+        answer = self._response_text(response)
+        if not answer:
+            return {"answer": NO_RESPONSE_MESSAGE, "sources": sources, "cached": False}
+        self._store_answer(query, query_vector, answer, sources)
+        return {"answer": answer, "sources": sources, "cached": False}
+    
+    def vector_fetch_k(self, k):
+        """
+        Return how many vector search results retrieval uses for k chunks.
+        
+        Batched callers search this many results per question and pass
+        them to answer_with_vector as vector_docs.
+        
+        Args:
+            k (int): Number of chunks to retrieve
+        
+        Returns:
+            int: Vector search results per question
+        """
+        fetch_k = k * MMR_FETCH_FACTOR if self.diversify else k
+        if self.retrieval_mode == "hybrid":
+            return max(fetch_k * HYBRID_FETCH_FACTOR, HYBRID_MIN_FETCH)
+        return fetch_k
+    
+    def _retrieve(self, query, query_vector, k, vector_docs=None, timings=None):
+        """
+        Retrieve the chunks most relevant to a question.
+        
+        Args:
+            query (str): User question
+            query_vector (list): Embedding of the question, or None to embed it
+            k (int): Number of similar documents to retrieve
+            vector_docs (list): Precomputed vector search results, at least
+                vector_fetch_k(k) of them; skips the vector search
+            timings (dict): Receives the rerank time (default: self.last_timings)
+        
+        Returns:
+            list: Retrieved Document objects
+        """
+        helper = self.vector_store_helper
+        if query_vector is None:
+            query_vector = helper.query_embedder.embed_query(query)
+        fetch_k = k * MMR_FETCH_FACTOR if self.diversify else k
+        
+        if self.retrieval_mode == "hybrid":
+            candidates = helper.hybrid_search(
+                self.vectorstore, self.lexical_index, query, k=fetch_k, query_vector=query_vector,
+                vector_docs=vector_docs
+            )
+        elif vector_docs is not None:
+            candidates = vector_docs[:fetch_k]
+        else:
+            candidates = helper.similarity_search_by_vector(self.vectorstore, query_vector, k=fetch_k)
+        candidates = self._committed(candidates)
+        
+        if not self.diversify:
+            return candidates
+        
+        docs = helper.max_marginal_relevance(
+            self.vectorstore, query_vector, candidates, k=k,
+            lambda_mult=self.mmr_lambda, time_budget=self.rerank_budget
+        )
+        (self.last_timings if timings is None else timings)["rerank"] = helper.last_rerank["seconds"]
+        return docs
+    
+    def _committed(self, docs):
+        """Drop chunks of documents outside self.doc_hashes, e.g. one still being ingested."""
+        if self.doc_hashes is None:
+            return docs
+        return [doc for doc in docs if doc.metadata.get("doc_hash") in self.doc_hashes]
+    
+    def _cached_answer(self, query, started, lookup=True):
+        """
+        Look up a question in the answer cache.
+        
+        Resets self.last_timings for the new question.
+        
+        Args:
+            query (str): User question
+            started (float): perf_counter value the timings are measured from
+            lookup (bool): Skip the cache if False, only resetting the timings
+        
+        Returns:
+            tuple: ((answer, sources) or None, query_vector or None)
+        """
+        self.last_timings = {}
+        if not self.answer_cache or not lookup:
+            return None, None
+        
+        # The query is only embedded when there is no exact match
+        cached, query_vector = self.answer_cache.lookup(
+            self.corpus_fingerprint, query, self.vector_store_helper.query_embedder.embed_query
+        )
+        
+        if cached is not None:
+            self.last_timings["cache_hit"] = True
+            self.last_timings["total"] = time.perf_counter() - started
+        return cached, query_vector
+    
+    async def _acached_answer(self, query, started, lookup=True):
+        """
+        Look up a question in the answer cache without blocking the event loop.
+        
+        Resets self.last_timings for the new question.
+        
+        Args:
+            query (str): User question
+            started (float): perf_counter value the timings are measured from
+            lookup (bool): Skip the cache if False, only resetting the timings
+        
+        Returns:
+            tuple: ((answer, sources) or None, query_vector or None)
+        """
+        self.last_timings = {}
+        if not self.answer_cache or not lookup:
+            return None, None
+        
+        cached, query_vector = await self.answer_cache.alookup(
+            self.corpus_fingerprint, query, self.vector_store_helper.query_embedder.aembed_query
+        )
+        
+        if cached is not None:
+            self.last_timings["cache_hit"] = True
+            self.last_timings["total"] = time.perf_counter() - started
+        return cached, query_vector
+    
+    def _store_answer(self, query, query_vector, answer, sources):
+        """
+        Store a generated answer in the answer cache, if caching is enabled.
+        
+        Args:
+            query (str): User question
+            query_vector (list): Embedding of the question
+            answer (str): Generated answer
+            sources (list): Sources of the answer
+        """
+        if self.answer_cache and answer:
+            self.answer_cache.put(self.corpus_fingerprint, query, answer, sources, query_vector)
+    
+    def _remember(self, question, answer):
+        """
+        Record an answered question in the conversation memory, if there is one.
+        
+        A summary update for a turn leaving the window runs on a background
+        thread, so it never delays returning or streaming the answer.
+        
+        Args:
+            question (str): Question as asked
+            answer (str): Answer shown to the user
+        """
+        if self.memory is not None and answer:
+            self.memory.add_turn(question, answer, wait=False)
+    
+    def _history(self):
+        """
+        Return the conversation history for the prompt.
+        
+        Returns:
+            tuple or None: (summary, recent turn messages), see
+            ConversationMemory.history; None without a memory or before the
+            first answered question
+        """
+        if self.memory is None or not len(self.memory):
+            return None
+        return self.memory.history()
     
     def get_response_with_scores(self, query, k=4, score_threshold=0.5):
         """
@@ -132,7 +550,7 @@ Please provide a detailed answer based on the context above."""
             query (str): User question
             k (int): Number of similar documents to retrieve
             score_threshold (float): Minimum relevance score
-            
+        
         Returns:
             tuple: (response_text, sources_list)
         """
@@ -144,89 +562,119 @@ Please provide a detailed answer based on the context above."""
             
             # Filter documents by score threshold
             relevant_docs = [
-                doc for doc, score in docs_with_scores 
+                doc for doc, score in docs_with_scores
                 if score <= score_threshold  # Lower scores mean higher similarity in some implementations
             ]
+            relevant_docs = self._committed(relevant_docs)
             
             if not relevant_docs:
                 return "I couldn't find sufficiently relevant information in the uploaded documents to answer your question confidently.", []
             
             # Use the regular response method with filtered documents
-            context = ""
-            sources = []
+            context, sources = self._build_context(relevant_docs)
             
-            for doc in relevant_docs:
-                context += f"\n--- Source: {doc.metadata.get('filename', 'Unknown')} ---\n"
-                context += doc.page_content + "\n"
-                
-                # Add source information
-                source_info = {
-                    "filename": doc.metadata.get('filename', 'Unknown'),
-                    "page": doc.metadata.get('page', 'Unknown')
-                }
-                
-                # Avoid duplicate sources
-                if source_info not in sources:
-                    sources.append(source_info)
+            # Call the GenerativeService API
+            response = self.client.generate_content(request=self._build_request(query, context))
             
-            # Generate response using the context
-            system_instruction = types.Content(parts=[types.Part(text=(
-                "You are a helpful AI assistant that answers questions based solely on the provided document content.\n\n"
-                "Instructions:\n"
-                "1. Answer the question using ONLY the information provided in the context below\n"
-                "2. Be concise but comprehensive in your response\n"
-                "3. If the context doesn't contain enough information to answer the question, say so clearly\n"
-                "4. Do not make up information that isn't in the provided context\n"
-                "5. Use a friendly and professional tone\n"
-                "6. Structure your answer clearly with bullet points or numbered lists when appropriate"
-            ))])
-
-            user_prompt = f"""Context from uploaded documents:
+            response_text = self._response_text(response)
+            if response_text:
+                return response_text, sources
+            
+            return NO_RESPONSE_MESSAGE, sources
+        
+        except Exception as e:
+            error_msg = f"Error generating response with scores: {str(e)}"
+            return error_msg, []
+    
+    def _build_context(self, relevant_docs, timings=None):
+        """
+        Build the prompt context and the de-duplicated source list.
+        
+        Overlapping and adjacent chunks are merged and the context is
+        limited to the token budget. The context size and the tokens saved
+        are recorded in timings.
+        
+        Args:
+            relevant_docs (list): Retrieved Document objects
+            timings (dict): Receives the context size (default: self.last_timings)
+        
+        Returns:
+            tuple: (context_text, sources_list)
+        """
+        with tracing.span("context.pack"):
+            packed = self.context_packer.pack(relevant_docs)
+        timings = self.last_timings if timings is None else timings
+        timings["context_tokens"] = packed["tokens"]
+        timings["tokens_saved"] = packed["tokens_saved"]
+        tracing.count("context.tokens", packed["tokens"])
+        tracing.count("context.tokens_saved", packed["tokens_saved"])
+        return packed["context"], packed["sources"]
+    
+    @staticmethod
+    def _build_request(query, context, history=None):
+        """
+        Build the GenerateContentRequest for a question and its context.
+        
+        Args:
+            query (str): User question
+            context (str): Retrieved document context
+            history (tuple): (summary, recent turn messages) of the
+                conversation, sent before the question
+        
+        Returns:
+            GenerateContentRequest: Request for the GenerativeService API
+        """
+        # Create prompt for Gemini (Generative Language)
+        system_instruction = types.Content(parts=[types.Part(text=SYSTEM_PROMPT)])
+        summary, turns = history or ("", [])
+        
+        # Older turns only reach the prompt through their summary
+        summary_block = f"Summary of the earlier conversation:\n{summary}\n\n" if summary else ""
+        user_prompt = f"""{summary_block}Context from uploaded documents:
 {context}
 
 Question: {query}
 
 Please provide a detailed answer based on the context above."""
 
-            user_content = types.Content(role="user", parts=[types.Part(text=user_prompt)])
-
-            # Build generation config
-            gen_config = types.GenerationConfig(
-                temperature=0.1,
-                max_output_tokens=1000,
-            )
-
-            # Normalize model name (GenerativeService expects model names like 'models/xyz')
-            model_name = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
-            if not model_name.startswith("models/"):
-                model_name = f"models/{model_name}"
-
-            # Build request
-            request = types.GenerateContentRequest(
-                model=model_name,
-                system_instruction=system_instruction,
-                contents=[user_content],
-                generation_config=gen_config,
-            )
-
-            # Call the GenerativeService API
-            response = self.client.generate_content(request=request)
-
-            # Extract text from the first candidate if present
-            if response and response.candidates:
-                candidate = response.candidates[0]
-                # Join any text parts from the candidate content
-                text_parts = []
-                if candidate.content and candidate.content.parts:
-                    for p in candidate.content.parts:
-                        if getattr(p, 'text', None):
-                            text_parts.append(p.text)
-                response_text = "\n".join(text_parts).strip()
-                if response_text:
-                    return response_text, sources
-
-            return "I apologize, but I couldn't generate a response. Please try rephrasing your question.", sources
-                
-        except Exception as e:
-            error_msg = f"Error generating response with scores: {str(e)}"
-            return error_msg, []
+        user_content = types.Content(role="user", parts=[types.Part(text=user_prompt)])
+        
+        # Build generation config
+        gen_config = types.GenerationConfig(
+            temperature=0.1,
+            max_output_tokens=1000,
+        )
+        
+        return types.GenerateContentRequest(
+            model=generative_model_name(),
+            system_instruction=system_instruction,
+            contents=[*turns, user_content],
+            generation_config=gen_config,
+        )
+    
+    @staticmethod
+    def _response_text(response, strip=True):
+        """
+        Extract the text of the first candidate of a response.
+        
+        Args:
+            response (GenerateContentResponse): Full response or stream chunk
+            strip (bool): Join parts with newlines and strip the result;
+                stream chunks are returned as they are
+        
+        Returns:
+            str: Candidate text, empty if there is none
+        """
+        if not response or not response.candidates:
+            return ""
+        
+        candidate = response.candidates[0]
+        # Join any text parts from the candidate content
+        text_parts = []
+        if candidate.content and candidate.content.parts:
+            for p in candidate.content.parts:
+                if getattr(p, 'text', None):
+                    text_parts.append(p.text)
+        if not strip:
+            return "".join(text_parts)
+        return "\n".join(text_parts).strip()
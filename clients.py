@@ -0,0 +1,260 @@
+import asyncio
+import os
+import threading
+import weakref
+
+import grpc
+from google.ai import generativelanguage_v1beta as genai
+from google.ai.generativelanguage_v1beta.services.generative_service.transports import (
+    GenerativeServiceGrpcAsyncIOTransport,
+    GenerativeServiceGrpcTransport,
+)
+from google.auth import api_key as api_key_credentials
+from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+from embedding_cache import CachedEmbeddings, get_embedding_cache
+from embedding_scheduler import DEFAULT_REQUESTS_PER_MINUTE, TokenBucket
+from query_embedder import QueryEmbedder
+
+# Keep the gRPC connection warm between questions and detect dead peers
+CHANNEL_OPTIONS = [
+    ("grpc.keepalive_time_ms", 30_000),
+    ("grpc.keepalive_timeout_ms", 10_000),
+    ("grpc.keepalive_permit_without_calls", 1),
+    ("grpc.http2.max_pings_without_data", 0),
+    ("grpc.max_send_message_length", -1),
+    ("grpc.max_receive_message_length", -1),
+]
+
+_UNHEALTHY_STATES = (grpc.ChannelConnectivity.TRANSIENT_FAILURE, grpc.ChannelConnectivity.SHUTDOWN)
+
+
+def get_api_key():
+    """
+    Return the Gemini API key from the environment.
+
+    Returns:
+        str: API key
+
+    Raises:
+        ValueError: If GEMINI_API_KEY is not set
+    """
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        raise ValueError("GEMINI_API_KEY not found in environment variables")
+    return api_key
+
+
+def generative_model_name():
+    """
+    Return the generation model from GEMINI_MODEL in GenerativeService form.
+
+    Returns:
+        str: Model name like "models/gemini-2.5-flash"
+    """
+    model_name = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+    if not model_name.startswith("models/"):
+        model_name = f"models/{model_name}"
+    return model_name
+
+
+class ClientRegistry:
+    def __init__(self):
+        """
+        Initialize an empty registry of shared Gemini clients.
+
+        Clients are created on first use and reused by every ChatHandler and
+        VectorStore in the process, so a question does not pay for a new
+        channel and TLS handshake.
+        """
+        self._lock = threading.Lock()
+        self._channel = None
+        self._channel_state = None
+        self._generative_client = None
+        self._async_clients = weakref.WeakKeyDictionary()  # event loop -> async client
+        self._embeddings = {}
+        self._query_embedders = {}
+        self._rate_limiter = None
+
+    def generative_client(self):
+        """
+        Return the shared GenerativeServiceClient.
+
+        The client is rebuilt if its channel has failed or was shut down.
+
+        Returns:
+            GenerativeServiceClient: Client on a keep-alive gRPC channel
+        """
+        with self._lock:
+            if self._generative_client is None or self._channel_state in _UNHEALTHY_STATES:
+                self._close_channel()
+                credentials = api_key_credentials.Credentials(get_api_key())
+                channel = GenerativeServiceGrpcTransport.create_channel(
+                    credentials=credentials,
+                    options=CHANNEL_OPTIONS
+                )
+                channel.subscribe(self._on_channel_state, try_to_connect=False)
+                self._channel = channel
+                self._channel_state = grpc.ChannelConnectivity.IDLE
+                self._generative_client = genai.GenerativeServiceClient(
+                    transport=GenerativeServiceGrpcTransport(channel=channel)
+                )
+            return self._generative_client
+
+    def async_generative_client(self):
+        """
+        Return the GenerativeServiceAsyncClient of the running event loop.
+
+        gRPC asyncio channels belong to the loop that created them, so every
+        loop gets its own client, shared by all coroutines running on it.
+        Must be called from a coroutine.
+
+        Returns:
+            GenerativeServiceAsyncClient: Client on a keep-alive gRPC asyncio channel
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                credentials = api_key_credentials.Credentials(get_api_key())
+                channel = GenerativeServiceGrpcAsyncIOTransport.create_channel(
+                    credentials=credentials,
+                    options=CHANNEL_OPTIONS
+                )
+                client = genai.GenerativeServiceAsyncClient(
+                    transport=GenerativeServiceGrpcAsyncIOTransport(channel=channel)
+                )
+                self._async_clients[loop] = client
+            return client
+
+    def embeddings(self, model, task_type):
+        """
+        Return the shared, cached embeddings client for a model and task type.
+
+        Args:
+            model (str): Embedding model name
+            task_type (str): Embedding task type
+
+        Returns:
+            CachedEmbeddings: Embeddings client backed by the on-disk cache
+        """
+        key = (model, task_type)
+        with self._lock:
+            if key not in self._embeddings:
+                gemini_embeddings = GoogleGenerativeAIEmbeddings(
+                    model=model,
+                    google_api_key=get_api_key(),
+                    task_type=task_type
+                )
+                self._embeddings[key] = CachedEmbeddings(
+                    gemini_embeddings,
+                    get_embedding_cache(),
+                    model=model,
+                    task_type=task_type
+                )
+            return self._embeddings[key]
+
+    def query_embedder(self, model):
+        """
+        Return the shared query embedder for a model.
+
+        Queries are embedded with the retrieval-query task type, which is
+        the counterpart of the retrieval-document type used for chunks.
+
+        Args:
+            model (str): Embedding model name
+
+        Returns:
+            QueryEmbedder: Embedder with an in-memory LRU of query vectors
+        """
+        with self._lock:
+            if model not in self._query_embedders:
+                self._query_embedders[model] = QueryEmbedder(GoogleGenerativeAIEmbeddings(
+                    model=model,
+                    google_api_key=get_api_key(),
+                    task_type="retrieval_query"
+                ))
+            return self._query_embedders[model]
+
+    def embedding_rate_limiter(self):
+        """
+        Return the token bucket shared by all embedding requests of the process.
+
+        Returns:
+            TokenBucket or None: Limiter for EMBEDDING_RPM, None when limiting is disabled
+        """
+        with self._lock:
+            if self._rate_limiter is None:
+                requests_per_minute = float(os.getenv("EMBEDDING_RPM", DEFAULT_REQUESTS_PER_MINUTE))
+                self._rate_limiter = TokenBucket(requests_per_minute) if requests_per_minute > 0 else False
+            return self._rate_limiter or None
+
+    def health_check(self, timeout=5.0):
+        """
+        Check that the generation channel can connect.
+
+        Args:
+            timeout (float): Seconds to wait for the channel to become ready
+
+        Returns:
+            bool: True if the channel is ready
+        """
+        self.generative_client()
+        try:
+            grpc.channel_ready_future(self._channel).result(timeout=timeout)
+            return True
+        except grpc.FutureTimeoutError:
+            return False
+
+    def close(self):
+        """Close the channel and drop all clients."""
+        with self._lock:
+            self._close_channel()
+            # Async channels close with their event loop
+            self._async_clients.clear()
+            self._embeddings.clear()
+            self._query_embedders.clear()
+
+    def _on_channel_state(self, state):
+        """Record connectivity changes reported by gRPC."""
+        self._channel_state = state
+
+    def _close_channel(self):
+        """Close the current channel. Must be called with the lock held."""
+        if self._channel is not None:
+            self._channel.unsubscribe(self._on_channel_state)
+            self._channel.close()
+        self._channel = None
+        self._channel_state = None
+        self._generative_client = None
+
+
+_registry = ClientRegistry()
+
+
+def get_registry():
+    """
+    Return the process-wide client registry.
+
+    Returns:
+        ClientRegistry: Shared registry
+    """
+    return _registry
+
+
+def set_registry(registry):
+    """
+    Replace the process-wide client registry.
+
+    Used to plug in offline stand-ins, e.g. for benchmarks; clients that
+    were already handed out keep using the previous registry.
+
+    Args:
+        registry (ClientRegistry): Registry returned by get_registry from now on
+
+    Returns:
+        ClientRegistry: The previous registry
+    """
+    global _registry
+    previous, _registry = _registry, registry
+    return previous
@@ -0,0 +1,144 @@
+import math
+import os
+
+DEFAULT_TOKEN_BUDGET = 2000
+CHARS_PER_TOKEN = 4
+
+# Spans that would be cut to fewer tokens than this are left out instead
+_MIN_PARTIAL_TOKENS = 50
+
+# Chunks this many characters apart still touch; the splitter drops the
+# whitespace between them, at most the blank line between two pages
+_ADJACENT_GAP = 2
+
+
+def estimate_tokens(text):
+    """
+    Estimate the number of model tokens in a text.
+
+    Args:
+        text (str): Text
+
+    Returns:
+        int: Approximate token count (four characters per token)
+    """
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+class ContextPacker:
+    def __init__(self, token_budget=None):
+        """
+        Initialize a packer that turns retrieved chunks into prompt context.
+
+        Args:
+            token_budget (int): Maximum context tokens (default:
+                CONTEXT_TOKEN_BUDGET or 2000)
+        """
+        self.token_budget = token_budget or int(os.getenv("CONTEXT_TOKEN_BUDGET", DEFAULT_TOKEN_BUDGET))
+
+    def pack(self, docs):
+        """
+        Merge overlapping and adjacent chunks and fill the token budget.
+
+        Chunks are grouped by source file and sorted by position. Chunks
+        whose character spans overlap or touch are merged into one span, so
+        the overlap between neighbouring chunks is sent once. Spans are then
+        added in relevance order, the rank of a span being the best rank of
+        its chunks, until the budget is used up.
+
+        Args:
+            docs (list): Retrieved Document objects, most relevant first
+
+        Returns:
+            dict: "context" (prompt text), "sources" (one entry per included
+            span), "tokens" (estimated context tokens), "tokens_saved"
+            (compared to concatenating every chunk) and "chunks_dropped"
+        """
+        spans = self.merge_spans(docs)
+        spans.sort(key=lambda span: span["rank"])
+
+        parts = []
+        sources = []
+        used = 0
+        dropped = 0
+        for span in spans:
+            header = f"\n--- Source: {span['filename']} ---\n"
+            text = span["text"]
+            available = self.token_budget - used - estimate_tokens(header)
+            if estimate_tokens(text) > available:
+                if available < _MIN_PARTIAL_TOKENS:
+                    dropped += span["chunks"]
+                    continue
+                text = text[:available * CHARS_PER_TOKEN]
+            part = header + text + "\n"
+            parts.append(part)
+            used += estimate_tokens(part)
+
+            source = {"filename": span["filename"], "page": span["page"], "page_end": span["page_end"]}
+            if source not in sources:
+                sources.append(source)
+
+        naive = sum(
+            estimate_tokens(f"\n--- Source: {doc.metadata.get('filename', 'Unknown')} ---\n{doc.page_content}\n")
+            for doc in docs
+        )
+        return {
+            "context": "".join(parts),
+            "sources": sources,
+            "tokens": used,
+            "tokens_saved": max(naive - used, 0),
+            "chunks_dropped": dropped,
+        }
+
+    @staticmethod
+    def merge_spans(docs):
+        """
+        Merge chunks of the same file whose character spans overlap or touch.
+
+        Chunks without span metadata are kept as they are.
+
+        Args:
+            docs (list): Retrieved Document objects, most relevant first
+
+        Returns:
+            list: Span dicts with "filename", "text", "start", "end", "page",
+            "page_end", "rank" and "chunks" (number of merged chunks), in
+            file and position order
+        """
+        groups = {}
+        spans = []
+        for rank, doc in enumerate(docs):
+            metadata = doc.metadata
+            span = {
+                "filename": metadata.get("filename", "Unknown"),
+                "text": doc.page_content,
+                "start": metadata.get("start"),
+                "end": metadata.get("end"),
+                "page": metadata.get("page", "Unknown"),
+                "page_end": metadata.get("page_end", metadata.get("page", "Unknown")),
+                "rank": rank,
+                "chunks": 1,
+            }
+            if span["start"] is None or span["end"] is None:
+                spans.append(span)
+                continue
+            key = metadata.get("doc_hash") or span["filename"]
+            groups.setdefault(key, []).append(span)
+
+        merged = []
+        for group in groups.values():
+            group.sort(key=lambda span: span["start"])
+            current = None
+            for span in group:
+                if current is not None and span["start"] <= current["end"] + _ADJACENT_GAP:
+                    if span["end"] > current["end"]:
+                        glue = " " if span["start"] > current["end"] else ""
+                        current["text"] += glue + span["text"][max(current["end"] - span["start"], 0):]
+                        current["end"] = span["end"]
+                        current["page_end"] = span["page_end"]
+                    current["rank"] = min(current["rank"], span["rank"])
+                    current["chunks"] += 1
+                    continue
+                current = dict(span)
+                merged.append(current)
+        return merged + spans
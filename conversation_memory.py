@@ -0,0 +1,269 @@
+import logging
+import math
+import os
+import threading
+from collections import deque
+
+from google.ai.generativelanguage_v1beta import types
+
+from clients import generative_model_name, get_registry
+from context_packer import CHARS_PER_TOKEN
+import tracing
+
+# Recent question/answer pairs sent verbatim with every prompt
+DEFAULT_WINDOW_TURNS = 4
+
+# Upper bounds in tokens for one turn in the window and for the summary
+DEFAULT_TURN_TOKENS = 300
+DEFAULT_SUMMARY_TOKENS = 300
+
+# Upper bound in tokens for a condensed retrieval query
+_QUERY_TOKENS = 100
+
+# Thinking would spend the small output budget before any text is produced, so
+# it is turned off where the model allows it and kept at the minimum elsewhere;
+# other models keep their default
+_THINKING_BUDGETS = (("gemini-2.5-flash", 0), ("gemini-2.5-pro", 128))
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a user and an assistant about "
+    "uploaded documents. Update the summary with the new exchange. Keep the topics, documents, "
+    "sections and facts the user may refer back to, drop small talk, and stay under {words} words. "
+    "Reply with the updated summary only."
+)
+
+CONDENSE_PROMPT = (
+    "Rewrite the user's follow-up question as a standalone search query for the uploaded documents, "
+    "resolving references such as \"it\", \"that section\" or \"what about ...\" from the conversation. "
+    "If the question is already standalone, return it unchanged. Reply with the query only."
+)
+
+
+def _truncate(text, tokens):
+    """Cut text to at most the given number of tokens, marking the cut with " ..."."""
+    limit = tokens * CHARS_PER_TOKEN
+    return text if len(text) <= limit else text[:max(limit - 4, 0)].rstrip() + " ..."
+
+
+class ConversationMemory:
+    def __init__(self, window_turns=None, turn_tokens=None, summary_tokens=None, condense=None):
+        """
+        Initialize the memory of one conversation.
+
+        The most recent turns are kept verbatim; a turn that leaves the
+        window is folded into a rolling summary with one small generation
+        call that sees only the previous summary and that turn. Turns and
+        summary are capped in tokens, so the history part of a prompt stays
+        the same size however long the conversation gets.
+
+        Args:
+            window_turns (int): Recent turns sent verbatim (default:
+                CONVERSATION_WINDOW_TURNS or 4)
+            turn_tokens (int): Token cap of a question plus answer in the
+                window; the question gets at most a third of it (default:
+                CONVERSATION_TURN_TOKENS or 300)
+            summary_tokens (int): Token cap of the rolling summary (default:
+                CONVERSATION_SUMMARY_TOKENS or 300)
+            condense (bool): Rewrite follow-up questions into standalone
+                retrieval queries (default: CONDENSE_QUERIES, on)
+        """
+        self.window_turns = window_turns or int(os.getenv("CONVERSATION_WINDOW_TURNS", DEFAULT_WINDOW_TURNS))
+        self.turn_tokens = turn_tokens or int(os.getenv("CONVERSATION_TURN_TOKENS", DEFAULT_TURN_TOKENS))
+        self.summary_tokens = summary_tokens or int(os.getenv("CONVERSATION_SUMMARY_TOKENS", DEFAULT_SUMMARY_TOKENS))
+        if condense is None:
+            condense = os.getenv("CONDENSE_QUERIES", "1").lower() not in ("0", "false", "no")
+        self.condense = condense
+        self.turns = deque()  # (question, answer), oldest first
+        self.summary = ""
+        self.summarized_turns = 0
+        self._evicted = deque()  # turns that left the window, not yet in the summary
+        self._epoch = 0  # bumped by clear(), so a running update does not outlive it
+        self._lock = threading.Lock()
+        self._summary_lock = threading.Lock()
+
+    def __len__(self):
+        return self.summarized_turns + len(self._evicted) + len(self.turns)
+
+    def clear(self):
+        """Forget the conversation."""
+        with self._lock:
+            self.turns.clear()
+            self._evicted.clear()
+            self.summary = ""
+            self.summarized_turns = 0
+            self._epoch += 1
+
+    def add_turn(self, question, answer, wait=True):
+        """
+        Record an answered question, summarizing the turn that leaves the window.
+
+        If the summary update fails, the old summary is kept and the
+        evicted turn is dropped, so a failing call never grows the prompt.
+
+        Args:
+            question (str): User question
+            answer (str): Assistant answer
+            wait (bool): Return once the summary is updated; if False it is
+                updated on a background thread and history() returns the
+                previous summary until then
+        """
+        # The answer gets what the question leaves of the turn budget
+        question = _truncate(question, self.turn_tokens // 3)
+        answer = _truncate(answer, self.turn_tokens - math.ceil(len(question) / CHARS_PER_TOKEN))
+        with self._lock:
+            self.turns.append((question, answer))
+            if len(self.turns) <= self.window_turns:
+                return
+            self._evicted.append(self.turns.popleft())
+
+        if wait:
+            self._fold_evicted()
+        else:
+            threading.Thread(target=self._fold_evicted, name="memory-summary", daemon=True).start()
+
+    def _fold_evicted(self):
+        """Fold the evicted turns into the summary, oldest first, one update at a time."""
+        with self._summary_lock:
+            while True:
+                with self._lock:
+                    if not self._evicted:
+                        return
+                    evicted = self._evicted.popleft()
+                    summary = self.summary
+                    epoch = self._epoch
+
+                try:
+                    with tracing.span("memory.summarize"):
+                        response = get_registry().generative_client().generate_content(
+                            request=self._summary_request(summary, evicted)
+                        )
+                    summary = _truncate(_text(response) or summary, self.summary_tokens)
+                except Exception as e:
+                    logger.warning("Conversation summary update failed, keeping the previous summary: %s", e)
+                    tracing.annotate(summary_error=str(e))
+                    tracing.count("memory.summarize_errors")
+
+                with self._lock:
+                    if epoch == self._epoch:
+                        self.summary = summary
+                        self.summarized_turns += 1
+
+    def condense_query(self, question):
+        """
+        Rewrite a follow-up question into a standalone retrieval query.
+
+        Args:
+            question (str): User question
+
+        Returns:
+            str: Standalone query; the question itself if there is no
+            history, condensing is off or the call fails
+        """
+        if not self.condense or not len(self):
+            return question
+        try:
+            with tracing.span("query.condense"):
+                response = get_registry().generative_client().generate_content(
+                    request=self._condense_request(question)
+                )
+            return _text(response) or question
+        except Exception as e:
+            _condense_failed(e)
+            return question
+
+    async def acondense_query(self, question):
+        """
+        Rewrite a follow-up question without blocking the event loop.
+
+        Args:
+            question (str): User question
+
+        Returns:
+            str: Standalone query, see condense_query
+        """
+        if not self.condense or not len(self):
+            return question
+        try:
+            with tracing.span("query.condense"):
+                response = await get_registry().async_generative_client().generate_content(
+                    request=self._condense_request(question)
+                )
+            return _text(response) or question
+        except Exception as e:
+            _condense_failed(e)
+            return question
+
+    def history(self):
+        """
+        Return the history part of an answer prompt.
+
+        Returns:
+            tuple: (summary text, list of Content messages alternating user
+            and model for the recent turns)
+        """
+        with self._lock:
+            turns = list(self.turns)
+            summary = self.summary
+        contents = []
+        for question, answer in turns:
+            contents.append(types.Content(role="user", parts=[types.Part(text=question)]))
+            contents.append(types.Content(role="model", parts=[types.Part(text=answer)]))
+        return summary, contents
+
+    def _transcript(self):
+        """Summary and recent turns as plain text."""
+        with self._lock:
+            turns = list(self.turns)
+            summary = self.summary
+        lines = [f"Summary of earlier conversation: {summary}"] if summary else []
+        for question, answer in turns:
+            lines.append(f"User: {question}")
+            lines.append(f"Assistant: {answer}")
+        return "\n".join(lines)
+
+    def _summary_request(self, summary, turn):
+        question, answer = turn
+        prompt = (
+            f"Current summary:\n{summary or '(empty)'}\n\n"
+            f"New exchange:\nUser: {question}\nAssistant: {answer}"
+        )
+        words = self.summary_tokens * 3 // 4
+        return _request(SUMMARY_PROMPT.format(words=words), prompt, self.summary_tokens)
+
+    def _condense_request(self, question):
+        prompt = f"Conversation:\n{self._transcript()}\n\nFollow-up question: {question}"
+        return _request(CONDENSE_PROMPT, prompt, _QUERY_TOKENS)
+
+
+def _condense_failed(error):
+    """Log a failed query rewrite; the question is then searched as asked."""
+    logger.warning("Query condensing failed, searching with the question as asked: %s", error)
+    tracing.annotate(condense_error=str(error))
+    tracing.count("query.condense_errors")
+
+
+def _request(instruction, prompt, max_tokens):
+    """Build a deterministic GenerateContentRequest for a memory task."""
+    model = generative_model_name()
+    generation_config = types.GenerationConfig(temperature=0.0, max_output_tokens=max_tokens)
+    for prefix, budget in _THINKING_BUDGETS:
+        if model.removeprefix("models/").startswith(prefix):
+            # Thinking tokens count against max_output_tokens
+            generation_config.thinking_config = types.ThinkingConfig(thinking_budget=budget)
+            generation_config.max_output_tokens = max_tokens + budget
+            break
+    return types.GenerateContentRequest(
+        model=model,
+        system_instruction=types.Content(parts=[types.Part(text=instruction)]),
+        contents=[types.Content(role="user", parts=[types.Part(text=prompt)])],
+        generation_config=generation_config,
+    )
+
+
+def _text(response):
+    """Return the stripped text of the first candidate, or an empty string."""
+    if not response or not response.candidates or not response.candidates[0].content:
+        return ""
+    return "".join(part.text for part in response.candidates[0].content.parts if part.text).strip()
@@ -0,0 +1,452 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from lexical_index import LexicalIndex
+
+DEFAULT_LIBRARY_DIR = os.path.join(os.path.dirname(__file__), ".library")
+DEFAULT_MAX_AGE_DAYS = 30
+DEFAULT_MAX_TOTAL_MB = 2048
+DEFAULT_JANITOR_INTERVAL = 15 * 60
+DEFAULT_IDLE_MINUTES = 30
+
+MANIFEST_FILE = "manifest.json"
+LEXICAL_DIR = "lexical"
+
+# last_used is written at most this often, not on every query
+_TOUCH_INTERVAL = 60
+
+# One lock per library directory, shared by all sessions of the process
+_path_locks = {}
+_path_locks_lock = threading.Lock()
+
+
+
+def library_root():
+    """Return the directory that holds all user libraries (PDF_LIBRARY_DIR or .library)."""
+    return os.getenv("PDF_LIBRARY_DIR", DEFAULT_LIBRARY_DIR)
+
+
+def _library_path(user, root=None):
+    """Return the directory of the library of a user."""
+    user_key = hashlib.sha256(user.strip().lower().encode("utf-8")).hexdigest()[:32]
+    return os.path.join(root or library_root(), user_key)
+
+
+def _path_lock(path):
+    """Return the lock that guards a library directory."""
+    with _path_locks_lock:
+        return _path_locks.setdefault(path, threading.RLock())
+
+
+def _read_manifest(path):
+    """
+    Read a library manifest.
+
+    Args:
+        path (str): Library directory
+
+    Returns:
+        dict: Manifest with "user", "documents" and "last_used" keys
+    """
+    try:
+        with open(os.path.join(path, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"user": None, "documents": {}, "last_used": 0}
+
+
+def _last_used(path):
+    """Return when a library was last used, falling back to its modification time."""
+    try:
+        return _read_manifest(path).get("last_used") or os.path.getmtime(path)
+    except OSError:
+        return 0
+
+
+def _directory_size(path):
+    """Return the total size in bytes of all files below a directory."""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
+
+
+class DocumentLibrary:
+    def __init__(self, user, root=None):
+        """
+        Open the persistent document library of a user.
+
+        Only the manifest is read here. The vector index is opened on first
+        use by vectorstore().
+
+        Args:
+            user (str): User identifier (email)
+            root (str): Directory holding all libraries (see library_root)
+        """
+        self.user = user
+        self.path = _library_path(user, root)
+        self._lock = _path_lock(self.path)
+        self._vectorstore = None
+        self._lexical_index = None
+        self._manifest = _read_manifest(self.path)
+        self._manifest["user"] = user
+        self._last_access = time.time()
+        self._busy = 0
+        self._closed = False
+
+    @property
+    def closed(self):
+        """True once close() released the library; open_library returns a new instance."""
+        return self._closed
+
+    @property
+    def idle_seconds(self):
+        """Seconds since the library was last used in this process, 0 while it is being written."""
+        with self._lock:
+            return 0 if self._busy else time.time() - self._last_access
+
+    @property
+    def documents(self):
+        """
+        Documents in the library.
+
+        Returns:
+            dict: content hash -> {"filename": ..., "chunks": ..., "added": ...}
+        """
+        return self._manifest["documents"]
+
+    def has_document(self, doc_hash):
+        """
+        Check whether a document is already indexed.
+
+        Args:
+            doc_hash (str): Content hash of the source file
+
+        Returns:
+            bool: True if the document is in the library
+        """
+        return doc_hash in self.documents
+
+    def vectorstore(self, vector_store):
+        """
+        Return the vector index of the library, opening it on first use.
+
+        Each backend keeps its index in its own subdirectory.
+
+        Args:
+            vector_store (VectorStore): Provides the embeddings client and backend
+
+        Returns:
+            Chroma or NumpyIndex: Persistent vector store of this user
+        """
+        with self._lock:
+            self._reopen()
+            if self._vectorstore is None:
+                self._vectorstore = vector_store.open_vectorstore(os.path.join(self.path, vector_store.backend))
+            self.touch()
+            return self._vectorstore
+
+    def lexical_index(self):
+        """
+        Return the BM25 index of the library, loading it on first use.
+
+        Returns:
+            LexicalIndex: Lexical index over the chunks of this user
+        """
+        with self._lock:
+            self._reopen()
+            if self._lexical_index is None:
+                self._lexical_index = LexicalIndex.load(os.path.join(self.path, LEXICAL_DIR))
+            return self._lexical_index
+
+    def add_documents(self, doc_hash, filename, documents, vector_store, progress_callback=None,
+                      lexical_index=None):
+        """
+        Embed the chunks of a file into the library and record it.
+
+        Chunks are written to the vector index batch by batch, before the
+        file is recorded in the manifest; chat handlers limited to the
+        recorded documents (see ChatHandler doc_hashes) skip them until then.
+
+        Args:
+            doc_hash (str): Content hash of the source file
+            filename (str): Source filename
+            documents (iterable): Chunk Document objects
+            vector_store (VectorStore): Embeds and writes the chunks
+            progress_callback (callable): Optional embedding progress callback
+            lexical_index (LexicalIndex): BM25 index of these chunks, built
+                while chunking (see PDFProcessor.iter_chunks); merged into
+                lexical_index() once the chunks are embedded, so the file
+                becomes searchable all at once
+
+        Returns:
+            dict: Embedding report (see EmbeddingScheduler.run)
+        """
+        with self._lock:
+            vectorstore = self.vectorstore(vector_store)
+            # Not closed as idle while the embedding runs outside the lock
+            self._busy += 1
+        try:
+            report = vector_store.add_documents(vectorstore, documents, progress_callback)
+        finally:
+            with self._lock:
+                self._busy -= 1
+                self._last_access = time.time()
+        with self._lock:
+            if report["embedded"]:
+                self.documents[doc_hash] = {
+                    "filename": filename,
+                    "chunks": report["embedded"],
+                    "added": time.time(),
+                }
+                self._save_manifest()
+                if lexical_index is not None:
+                    self.lexical_index().merge(lexical_index)
+                    self.lexical_index().persist(os.path.join(self.path, LEXICAL_DIR))
+        return report
+
+    def remove_document(self, doc_hash, vector_store):
+        """
+        Delete a file and its chunks from the library.
+
+        Args:
+            doc_hash (str): Content hash of the source file
+            vector_store (VectorStore): Deletes the chunks
+        """
+        with self._lock:
+            if not self.has_document(doc_hash):
+                return
+            vector_store.delete_documents(self.vectorstore(vector_store), doc_hash)
+            self.documents.pop(doc_hash, None)
+            self._save_manifest()
+            lexical_index = self.lexical_index()
+            lexical_index.delete(doc_hash)
+            lexical_index.persist(os.path.join(self.path, LEXICAL_DIR))
+
+    def discard_chunks(self, doc_hash, ids, vector_store):
+        """
+        Delete chunks left behind by an interrupted ingestion.
+
+        Nothing is deleted once the file is recorded in the manifest, so a
+        failed job never removes a committed document.
+
+        Args:
+            doc_hash (str): Content hash of the source file
+            ids (list): Chunk IDs written by the ingestion
+            vector_store (VectorStore): Deletes the chunks
+
+        Returns:
+            bool: True if the chunks were deleted
+        """
+        with self._lock:
+            if self.has_document(doc_hash) or not ids:
+                return False
+            vector_store.delete_chunks(self.vectorstore(vector_store), ids)
+            return True
+
+    def touch(self):
+        """Record that the library was used; the manifest is written at most once a minute."""
+        now = time.time()
+        with self._lock:
+            self._last_access = now
+            if now - self._manifest.get("last_used", 0) >= _TOUCH_INTERVAL:
+                self._manifest["last_used"] = now
+                self._save_manifest()
+
+    def close(self):
+        """
+        Release the vector and lexical index of the library.
+
+        The library is dropped from the shared instances, so the janitor
+        may delete it once it is old enough. Using it again reopens it.
+        """
+        with self._lock:
+            self._vectorstore = None
+            self._lexical_index = None
+            self._closed = True
+            with _libraries_lock:
+                if _libraries.get(self.path) is self:
+                    del _libraries[self.path]
+
+    def _reopen(self):
+        """Register a closed library again, rereading its manifest. Must be called with the lock held."""
+        if not self._closed:
+            return
+        with _libraries_lock:
+            _libraries.setdefault(self.path, self)
+        self._manifest = _read_manifest(self.path)
+        self._manifest["user"] = self.user
+        self._closed = False
+
+    def _save_manifest(self):
+        """Write the manifest atomically. Must be called with the lock held."""
+        os.makedirs(self.path, exist_ok=True)
+        manifest_path = os.path.join(self.path, MANIFEST_FILE)
+        tmp_path = f"{manifest_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._manifest, f, indent=2)
+        os.replace(tmp_path, manifest_path)
+
+
+_libraries = {}
+_libraries_lock = threading.Lock()
+
+
+def open_library(user, root=None):
+    """
+    Return the shared DocumentLibrary of a user.
+
+    Sessions and background jobs of the same user share one instance, so
+    their manifest updates do not overwrite each other.
+
+    Args:
+        user (str): User identifier (email)
+        root (str): Directory holding all libraries (see library_root)
+
+    Returns:
+        DocumentLibrary: Library of the user
+    """
+    # Under the directory lock, so the janitor cannot delete it while it opens
+    with _path_lock(_library_path(user, root)):
+        library = DocumentLibrary(user, root)
+        with _libraries_lock:
+            library = _libraries.setdefault(library.path, library)
+        library._last_access = time.time()
+        return library
+
+
+def close_idle_libraries(idle_seconds=None):
+    """
+    Close shared libraries that have not been used for a while.
+
+    Args:
+        idle_seconds (float): Minimum time since last use (default:
+            PDF_LIBRARY_IDLE_MINUTES or 30 minutes)
+
+    Returns:
+        list: Paths of the closed libraries
+    """
+    if idle_seconds is None:
+        idle_seconds = float(os.getenv("PDF_LIBRARY_IDLE_MINUTES", DEFAULT_IDLE_MINUTES)) * 60
+    with _libraries_lock:
+        libraries = list(_libraries.values())
+
+    closed = []
+    for library in libraries:
+        with library._lock:
+            if library.idle_seconds >= idle_seconds:
+                library.close()
+                closed.append(library.path)
+    return closed
+
+
+def sweep_libraries(root=None, max_age_seconds=None, max_total_bytes=None):
+    """
+    Delete unused libraries by age, then by total size.
+
+    Libraries unused for longer than max_age_seconds are removed. If the
+    remaining libraries are still larger than max_total_bytes, the least
+    recently used ones are removed until they fit. Libraries that are open
+    in this process are never removed; close_idle_libraries releases them.
+
+    Args:
+        root (str): Directory holding all libraries
+        max_age_seconds (float): Maximum time since last use
+        max_total_bytes (int): Maximum total size of all libraries
+
+    Returns:
+        list: Paths of the removed libraries
+    """
+    root = root or library_root()
+    if max_age_seconds is None:
+        max_age_seconds = float(os.getenv("PDF_LIBRARY_MAX_AGE_DAYS", DEFAULT_MAX_AGE_DAYS)) * 24 * 60 * 60
+    if max_total_bytes is None:
+        max_total_bytes = int(float(os.getenv("PDF_LIBRARY_MAX_MB", DEFAULT_MAX_TOTAL_MB)) * 1024 * 1024)
+
+    try:
+        entries = [os.path.join(root, name) for name in os.listdir(root)]
+    except OSError:
+        return []
+
+    with _libraries_lock:
+        open_paths = set(_libraries)
+
+    libraries = []
+    for path in entries:
+        if os.path.isdir(path) and path not in open_paths:
+            libraries.append((_last_used(path), path, _directory_size(path)))
+    libraries.sort()
+
+    now = time.time()
+    total = sum(size for _, _, size in libraries) + sum(_directory_size(path) for path in open_paths)
+    removed = []
+    for last_used, path, size in libraries:
+        if now - last_used <= max_age_seconds and total <= max_total_bytes:
+            continue
+        with _path_lock(path):
+            # open_library takes the same lock; check again that it was not opened or used meanwhile
+            with _libraries_lock:
+                reopened = path in _libraries
+            if reopened or _last_used(path) != last_used:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        removed.append(path)
+    return removed
+
+
+class LibraryJanitor(threading.Thread):
+    def __init__(self, interval=DEFAULT_JANITOR_INTERVAL, root=None):
+        """
+        Initialize a background thread that periodically closes idle libraries and sweeps them.
+
+        Args:
+            interval (float): Seconds between sweeps
+            root (str): Directory holding all libraries
+        """
+        super().__init__(name="library-janitor", daemon=True)
+        self.interval = interval
+        self.root = root
+        self._stop_event = threading.Event()
+
+    def run(self):
+        """Sweep until stopped; errors are ignored so the thread keeps running."""
+        while not self._stop_event.wait(self.interval):
+            try:
+                close_idle_libraries()
+                sweep_libraries(self.root)
+            except Exception:
+                pass
+
+    def stop(self):
+        """Ask the thread to stop after the current sweep."""
+        self._stop_event.set()
+
+
+_janitor = None
+_janitor_lock = threading.Lock()
+
+
+def start_janitor():
+    """
+    Start the process-wide library janitor once.
+
+    Returns:
+        LibraryJanitor: Running janitor thread
+    """
+    global _janitor
+    with _janitor_lock:
+        if _janitor is None:
+            _janitor = LibraryJanitor(
+                interval=float(os.getenv("PDF_LIBRARY_SWEEP_SECONDS", DEFAULT_JANITOR_INTERVAL))
+            )
+            _janitor.start()
+        return _janitor
@@ -0,0 +1,265 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+import tracing
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(__file__), ".cache", "embeddings.sqlite3")
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# SQLite limits the number of bound parameters per statement
+_SQL_BATCH_SIZE = 500
+
+
+class EmbeddingCache:
+    def __init__(self, path=None, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Initialize a persistent, size-bounded embedding cache.
+
+        Vectors are stored as float32 blobs in a SQLite file. When the stored
+        vectors exceed max_bytes the least recently used entries are evicted.
+
+        Args:
+            path (str): SQLite file location (EMBEDDING_CACHE_PATH or
+                .cache/embeddings.sqlite3 next to the app by default)
+            max_bytes (int): Upper bound for the total size of stored vectors
+        """
+        self.path = path or os.getenv("EMBEDDING_CACHE_PATH", DEFAULT_CACHE_PATH)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+            )
+            self._conn.commit()
+            self._size_bytes = self._conn.execute(
+                "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+            ).fetchone()[0]
+        except Exception as e:
+            raise Exception(f"Error opening embedding cache: {str(e)}")
+
+    @staticmethod
+    def make_key(model, task_type, text):
+        """
+        Build the cache key for a text.
+
+        Args:
+            model (str): Embedding model name
+            task_type (str): Embedding task type
+            text (str): Text that is embedded
+
+        Returns:
+            str: Cache key
+        """
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{model}|{(task_type or '').lower()}|{digest}"
+
+    def get_many(self, keys):
+        """
+        Look up cached vectors and mark them as recently used.
+
+        Args:
+            keys (list): Cache keys
+
+        Returns:
+            dict: Mapping of found keys to vectors
+        """
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), _SQL_BATCH_SIZE):
+                batch = keys[start:start + _SQL_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self._conn.commit()
+
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        """
+        Store vectors and evict least recently used entries if over budget.
+
+        Args:
+            items (dict): Mapping of cache keys to vectors
+        """
+        if not items:
+            return
+
+        now = time.time()
+        rows = [(key, array("f", vector).tobytes(), now) for key, vector in items.items()]
+        with self._lock:
+            for start in range(0, len(rows), _SQL_BATCH_SIZE):
+                batch = rows[start:start + _SQL_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                existing = dict(self._conn.execute(
+                    f"SELECT key, LENGTH(vector) FROM embeddings WHERE key IN ({placeholders})",
+                    [row[0] for row in batch]
+                ).fetchall())
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                    batch
+                )
+                self._size_bytes += sum(len(row[1]) - existing.get(row[0], 0) for row in batch)
+            self._conn.commit()
+
+            if self._size_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """
+        Delete least recently used entries until the cache is at 90% of its budget.
+
+        Must be called with the lock held.
+        """
+        target = int(self.max_bytes * 0.9)
+        while self._size_bytes > target:
+            rows = self._conn.execute(
+                "SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used LIMIT ?",
+                (_SQL_BATCH_SIZE,)
+            ).fetchall()
+            if not rows:
+                self._size_bytes = 0
+                break
+
+            evicted = []
+            for key, size in rows:
+                evicted.append((key,))
+                self._size_bytes -= size
+                if self._size_bytes <= target:
+                    break
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", evicted)
+        self._conn.commit()
+
+    def stats(self):
+        """
+        Report cache usage.
+
+        Returns:
+            dict: Hit and miss counts, hit rate, entry count and stored bytes
+        """
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": entries,
+                "size_bytes": self._size_bytes,
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    def __init__(self, embeddings, cache, model, task_type):
+        """
+        Wrap an embeddings client with a persistent cache.
+
+        Args:
+            embeddings: LangChain embeddings client that computes missing vectors
+            cache (EmbeddingCache): Cache used for lookups and stores
+            model (str): Embedding model name, part of the cache key
+            task_type (str): Embedding task type, part of the cache key
+        """
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model = model
+        self.task_type = task_type
+
+    def embed_documents(self, texts):
+        """
+        Embed texts, only calling the API for texts that are not cached.
+
+        Args:
+            texts (list): Texts to embed
+
+        Returns:
+            list: One vector per text
+        """
+        keys = [EmbeddingCache.make_key(self.model, self.task_type, text) for text in texts]
+        found = self.cache.get_many(keys)
+
+        # Embed each missing text once, even if it occurs several times
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+
+        tracing.count("embedding_cache.hit", len(found))
+        tracing.count("embedding_cache.miss", len(missing))
+        if missing:
+            with tracing.span("embed.api"):
+                vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(computed)
+            found.update(computed)
+
+        return [found[key] for key in keys]
+
+    def embed_query(self, text):
+        """
+        Embed a single query text through the cache.
+
+        Args:
+            text (str): Query text
+
+        Returns:
+            list: Query vector
+        """
+        key = EmbeddingCache.make_key(self.model, self.task_type, text)
+        found = self.cache.get_many([key])
+        if key in found:
+            return found[key]
+
+        vector = self.embeddings.embed_query(text)
+        self.cache.put_many({key: vector})
+        return vector
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """
+    Return the process-wide embedding cache, opening it on first use.
+
+    Returns:
+        EmbeddingCache: Shared cache instance
+    """
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            max_mb = int(os.getenv("EMBEDDING_CACHE_MAX_MB", DEFAULT_MAX_BYTES // (1024 * 1024)))
+            _shared_cache = EmbeddingCache(max_bytes=max_mb * 1024 * 1024)
+        return _shared_cache
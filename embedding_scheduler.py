@@ -0,0 +1,204 @@
+import itertools
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import tracing
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_REQUESTS_PER_MINUTE = 100
+
+# HTTP / gRPC status codes worth retrying: rate limiting and server errors
+_RETRYABLE_CODES = {429, 500, 502, 503, 504}
+_RETRYABLE_MARKERS = ("RESOURCE_EXHAUSTED", "UNAVAILABLE", "DEADLINE_EXCEEDED", "INTERNAL")
+
+
+class TokenBucket:
+    def __init__(self, requests_per_minute, capacity=None):
+        """
+        Initialize a thread-safe token bucket rate limiter.
+
+        Args:
+            requests_per_minute (float): Sustained request rate
+            capacity (int): Maximum burst size (defaults to one second of traffic, at least 1)
+        """
+        self.rate = requests_per_minute / 60.0
+        self.capacity = capacity or max(1, int(self.rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """
+        Block until the requested number of tokens is available.
+
+        Args:
+            tokens (int): Number of tokens to take
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait_time = (tokens - self._tokens) / self.rate
+            time.sleep(wait_time)
+
+
+def is_retryable_error(error):
+    """
+    Check whether an API error is a rate limit or a transient server error.
+
+    Args:
+        error (Exception): Raised error, including its chained causes
+
+    Returns:
+        bool: True if the request should be retried
+    """
+    while error is not None:
+        code = getattr(error, "code", None)
+        if callable(code):
+            code = None
+        code = code or getattr(error, "status_code", None)
+        if isinstance(code, int) and code in _RETRYABLE_CODES:
+            return True
+        if any(marker in str(error) for marker in _RETRYABLE_MARKERS):
+            return True
+        error = error.__cause__
+    return False
+
+
+class EmbeddingScheduler:
+    def __init__(self, embeddings, batch_size=None, max_workers=None, requests_per_minute=None,
+                 max_retries=5, base_delay=1.0, max_delay=30.0, rate_limiter=None):
+        """
+        Initialize a batched, rate-limited embedding scheduler.
+
+        Defaults come from EMBEDDING_BATCH_SIZE, EMBEDDING_WORKERS and
+        EMBEDDING_RPM when not given.
+
+        Args:
+            embeddings: LangChain embeddings client
+            batch_size (int): Number of chunks per embedding request
+            max_workers (int): Number of batches embedded concurrently
+            requests_per_minute (float): Request quota shared by all workers (0 disables limiting)
+            max_retries (int): Retries per batch for rate limit and server errors
+            base_delay (float): Initial backoff delay in seconds
+            max_delay (float): Maximum backoff delay in seconds
+            rate_limiter (TokenBucket): Limiter shared with other schedulers;
+                takes precedence over requests_per_minute
+        """
+        self.embeddings = embeddings
+        self.batch_size = batch_size or int(os.getenv("EMBEDDING_BATCH_SIZE", DEFAULT_BATCH_SIZE))
+        self.max_workers = max_workers or int(os.getenv("EMBEDDING_WORKERS", DEFAULT_MAX_WORKERS))
+        if rate_limiter is None:
+            if requests_per_minute is None:
+                requests_per_minute = float(os.getenv("EMBEDDING_RPM", DEFAULT_REQUESTS_PER_MINUTE))
+            rate_limiter = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def run(self, documents, write_batch, progress_callback=None):
+        """
+        Embed documents in batches on a worker pool and write each batch as it completes.
+
+        Batches are written from the calling thread, so write_batch does not
+        need to be thread-safe. A batch that still fails after all retries is
+        reported instead of aborting the remaining batches.
+
+        Args:
+            documents (iterable): Document objects, consumed lazily
+            write_batch (callable): Called with (documents, vectors) for every embedded batch
+            progress_callback (callable): Optional, called with the report after every batch
+
+        Returns:
+            dict: Report with batch and document counts and the errors of failed batches
+        """
+        report = {"batches": 0, "embedded": 0, "failed": 0, "errors": []}
+        batches = self._batches(documents)
+        max_in_flight = self.max_workers * 2
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="embed") as pool:
+            pending = {}
+
+            def submit_next():
+                batch = next(batches, None)
+                if batch is None:
+                    return False
+                # Spans of the worker count towards the trace of the caller
+                pending[pool.submit(tracing.bind(self._embed_batch), batch)] = batch
+                return True
+
+            # Keep a bounded number of batches in flight so large inputs are not buffered
+            while len(pending) < max_in_flight and submit_next():
+                pass
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch = pending.pop(future)
+                    report["batches"] += 1
+                    try:
+                        write_batch(batch, future.result())
+                        report["embedded"] += len(batch)
+                    except Exception as e:
+                        report["failed"] += len(batch)
+                        report["errors"].append(str(e))
+
+                    if progress_callback:
+                        progress_callback(report)
+                    submit_next()
+
+        return report
+
+    def _batches(self, documents):
+        """
+        Split an iterable of documents into lists of batch_size.
+
+        Args:
+            documents (iterable): Document objects
+
+        Yields:
+            list: Batch of documents
+        """
+        iterator = iter(documents)
+        while True:
+            batch = list(itertools.islice(iterator, self.batch_size))
+            if not batch:
+                return
+            yield batch
+
+    def _embed_batch(self, batch):
+        """
+        Embed one batch, retrying rate limit and server errors with jittered backoff.
+
+        Args:
+            batch (list): Document objects
+
+        Returns:
+            list: One vector per document
+        """
+        texts = [doc.page_content for doc in batch]
+        attempt = 0
+        while True:
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            try:
+                with tracing.span("embed.batch"):
+                    vectors = self.embeddings.embed_documents(texts)
+                tracing.count("embed.chunks", len(texts))
+                return vectors
+            except Exception as e:
+                attempt += 1
+                if attempt > self.max_retries or not is_retryable_error(e):
+                    raise
+                # Full jitter keeps concurrent workers from retrying in lockstep
+                delay = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+                time.sleep(random.uniform(0, delay))
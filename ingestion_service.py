@@ -0,0 +1,302 @@
+import hashlib
+import io
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from lexical_index import LexicalIndex
+from pdf_processor import PDFProcessor
+import tracing
+from vector_store import VectorStore
+
+DEFAULT_WORKERS = 2
+
+# Finished jobs are forgotten after this many seconds
+JOB_RETENTION_SECONDS = 60 * 60
+
+ACTIVE_STATES = ("queued", "extracting", "embedding")
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when it has been cancelled."""
+
+
+class IngestionJob:
+    def __init__(self, library, data, filename, doc_hash):
+        """
+        Initialize an ingestion job for one PDF.
+
+        Args:
+            library (DocumentLibrary): Library the document is added to
+            data (bytes): PDF file content
+            filename (str): Source filename
+            doc_hash (str): Content hash of the file
+        """
+        self.job_id = uuid.uuid4().hex
+        self.library = library
+        self.data = data
+        self.filename = filename
+        self.doc_hash = doc_hash
+        self.state = "queued"
+        self.pages = 0
+        self.chunks = 0
+        self.batches = 0
+        self.embedded = 0
+        self.failed = 0
+        self.error = None
+        self.warnings = []
+        self.created = time.time()
+        self.finished = None
+        # Submitters sharing this job; it is cancelled once all of them cancelled
+        self.owners = 1
+        self._chunk_ids = []
+        self._cancelled = threading.Event()
+
+    def status(self):
+        """
+        Return a snapshot of the job.
+
+        Returns:
+            dict: Job ID, filename, doc_hash, state ("queued", "extracting",
+            "embedding", "done", "failed" or "cancelled"), per-stage counters
+            (pages, chunks, batches, embedded, failed), error and warnings
+        """
+        return {
+            "job_id": self.job_id,
+            "filename": self.filename,
+            "doc_hash": self.doc_hash,
+            "state": self.state,
+            "pages": self.pages,
+            "chunks": self.chunks,
+            "batches": self.batches,
+            "embedded": self.embedded,
+            "failed": self.failed,
+            "error": self.error,
+            "warnings": list(self.warnings),
+        }
+
+    def cancel(self):
+        """Ask the job to stop; chunks it already wrote are removed again."""
+        self._cancelled.set()
+
+    def run(self):
+        """Extract, chunk and embed the PDF, streaming pages through every stage."""
+        with tracing.trace("ingest", filename=self.filename, doc_hash=self.doc_hash) as trace:
+            self._run()
+            trace.set(state=self.state, pages=self.pages, chunks=self.chunks, embedded=self.embedded)
+
+    def _run(self):
+        if self._cancelled.is_set():
+            self._finish("cancelled")
+            return
+        if self.library.has_document(self.doc_hash):
+            # Committed meanwhile, e.g. by a job of another process
+            self._finish("done")
+            return
+
+        pdf_processor = PDFProcessor()
+        vector_store = VectorStore()
+        lexical_index = LexicalIndex()
+        self.state = "extracting"
+        try:
+            source = io.BytesIO(self.data)
+            source.name = self.filename
+            pages = self._count_pages(pdf_processor.iter_pages_parallel(source))
+            chunks = self._count_chunks(pdf_processor.iter_chunks(
+                pages, self.filename, doc_hash=self.doc_hash, lexical_index=lexical_index
+            ))
+            report = self.library.add_documents(
+                self.doc_hash, self.filename, chunks, vector_store,
+                progress_callback=self._on_progress, lexical_index=lexical_index
+            )
+            self.warnings.extend(pdf_processor.warnings)
+
+            if self._cancelled.is_set():
+                raise JobCancelled()
+            if not self.chunks:
+                self._finish("failed", f"No text could be extracted from {self.filename}")
+            elif not report["embedded"]:
+                self._finish("failed", report["errors"][0] if report["errors"] else "No chunks were embedded")
+            else:
+                if report["failed"]:
+                    self.warnings.append(f"{report['failed']} chunk(s) could not be embedded: {report['errors'][0]}")
+                self._finish("done")
+
+        except Exception as e:
+            cancelled = self._cancelled.is_set()
+            try:
+                # Drop the chunks this job wrote, unless the document was committed
+                self.library.discard_chunks(self.doc_hash, self._chunk_ids, vector_store)
+            except Exception:
+                pass
+            if cancelled:
+                self._finish("cancelled")
+            else:
+                self._finish("failed", f"Error processing {self.filename}: {str(e)}")
+
+    def _count_pages(self, pages):
+        """Pass pages through, counting them and stopping on cancellation."""
+        for page in pages:
+            if self._cancelled.is_set():
+                raise JobCancelled()
+            self.pages += 1
+            yield page
+
+    def _count_chunks(self, chunks):
+        """Pass chunks through, counting them and recording their IDs."""
+        for chunk in chunks:
+            self.state = "embedding"
+            self.chunks += 1
+            self._chunk_ids.extend(VectorStore.document_ids([chunk]))
+            yield chunk
+
+    def _on_progress(self, report):
+        """Record embedding progress reported by the scheduler."""
+        self.batches = report["batches"]
+        self.embedded = report["embedded"]
+        self.failed = report["failed"]
+
+    def _finish(self, state, error=None):
+        """Record the final state and release the file content."""
+        self.state = state
+        self.error = error
+        self.finished = time.time()
+        self.data = None
+
+
+class IngestionService:
+    def __init__(self, max_workers=None):
+        """
+        Initialize a background ingestion service.
+
+        Jobs are queued on a thread pool, so uploads are processed while
+        the session keeps answering questions about documents that are
+        already indexed.
+
+        Args:
+            max_workers (int): Files processed concurrently (default:
+                INGEST_WORKERS or 2)
+        """
+        self.max_workers = max_workers or int(os.getenv("INGEST_WORKERS", DEFAULT_WORKERS))
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ingest")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, library, uploaded_file, doc_hash=None, filename=None):
+        """
+        Queue a PDF for ingestion into a library.
+
+        A file that is already being ingested into the same library is not
+        queued again; the running job is shared instead.
+
+        Args:
+            library (DocumentLibrary): Library the document is added to
+            uploaded_file: Streamlit uploaded file object, binary stream or bytes
+            doc_hash (str): Content hash of the file, computed if omitted
+            filename (str): Name stored with the chunks (default: the name of
+                the uploaded file)
+
+        Returns:
+            str: Job ID
+        """
+        data = uploaded_file if isinstance(uploaded_file, bytes) else PDFProcessor._read_bytes(uploaded_file)
+        filename = filename or PDFProcessor._display_name(uploaded_file)
+        doc_hash = doc_hash or hashlib.sha256(data).hexdigest()
+
+        with self._lock:
+            self._prune()
+            for job in self._jobs.values():
+                if (job.library.path == library.path and job.doc_hash == doc_hash
+                        and job.state in ACTIVE_STATES and not job._cancelled.is_set()):
+                    job.owners += 1
+                    return job.job_id
+            job = IngestionJob(library, data, filename, doc_hash)
+            self._jobs[job.job_id] = job
+        self._pool.submit(job.run)
+        return job.job_id
+
+    def status(self, job_id):
+        """
+        Return the status of a job.
+
+        Args:
+            job_id (str): Job ID returned by submit
+
+        Returns:
+            dict or None: Job snapshot (see IngestionJob.status), None if unknown
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job.status() if job else None
+
+    def jobs(self, library=None):
+        """
+        Return the status of all known jobs, oldest first.
+
+        Args:
+            library (DocumentLibrary): Only jobs of this library
+
+        Returns:
+            list: Job snapshots
+        """
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if library is None or job.library.path == library.path]
+        return [job.status() for job in sorted(jobs, key=lambda job: job.created)]
+
+    def cancel(self, job_id):
+        """
+        Cancel a queued or running job.
+
+        A job shared by several submitters keeps running until all of
+        them cancelled it.
+
+        Args:
+            job_id (str): Job ID returned by submit
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job:
+                return
+            job.owners -= 1
+            if job.owners > 0:
+                return
+        job.cancel()
+
+    def shutdown(self, wait=True):
+        """
+        Cancel all jobs and stop the workers.
+
+        Args:
+            wait (bool): Wait for running jobs to stop
+        """
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            job.cancel()
+        self._pool.shutdown(wait=wait)
+
+    def _prune(self):
+        """Forget jobs that finished long ago. Must be called with the lock held."""
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished and job.finished < cutoff]:
+            del self._jobs[job_id]
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_ingestion_service():
+    """
+    Return the process-wide ingestion service.
+
+    Returns:
+        IngestionService: Shared service
+    """
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = IngestionService()
+        return _service
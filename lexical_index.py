@@ -0,0 +1,319 @@
+import json
+import math
+import os
+import re
+import threading
+from array import array
+
+import numpy as np
+from langchain_core.documents import Document
+
+# Identifiers such as "ERR-4021", "A.3.2" or "x_max" stay one token; their
+# parts are indexed as well so "4021" alone still matches
+_TOKEN_PATTERN = re.compile(r"[0-9a-z]+(?:[-_./:][0-9a-z]+)*")
+_PART_PATTERN = re.compile(r"[0-9a-z]+")
+
+POSTINGS_FILE = "lexical.npz"
+RECORDS_FILE = "lexical.json"
+
+# Compact the postings once this fraction of rows has been deleted
+_COMPACT_RATIO = 0.25
+
+
+def tokenize(text):
+    """
+    Split text into lower-case search terms.
+
+    Args:
+        text (str): Text to tokenize
+
+    Returns:
+        list: Terms in text order; compound identifiers are followed by their parts
+    """
+    terms = []
+    for token in _TOKEN_PATTERN.findall(text.lower()):
+        terms.append(token)
+        if not token.isalnum():
+            terms.extend(_PART_PATTERN.findall(token))
+    return terms
+
+
+class LexicalIndex:
+    def __init__(self, k1=1.5, b=0.75):
+        """
+        Initialize an empty BM25 inverted index over chunks.
+
+        Postings are kept per term as two compact arrays, the chunk rows and
+        the term frequencies, and scored with NumPy at query time.
+
+        Args:
+            k1 (float): BM25 term frequency saturation
+            b (float): BM25 document length normalization
+        """
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._postings = {}  # term -> (array("I") rows, array("I") term frequencies)
+        self._lengths = array("I")  # terms per row
+        self._documents = []  # row -> Document, None once deleted
+        self._ids = {}  # chunk ID -> row
+        self._live = 0
+        self._live_length = 0
+
+    def __len__(self):
+        return self._live
+
+    def add_document(self, document):
+        """
+        Index a chunk, replacing an earlier chunk with the same ID.
+
+        Args:
+            document (Document): Chunk with doc_hash and chunk_index metadata
+        """
+        terms = tokenize(document.page_content)
+        frequencies = {}
+        for term in terms:
+            frequencies[term] = frequencies.get(term, 0) + 1
+
+        with self._lock:
+            doc_id = self.document_id(document)
+            if doc_id in self._ids:
+                self._delete_row(self._ids[doc_id])
+            row = len(self._documents)
+            for term, frequency in frequencies.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = (array("I"), array("I"))
+                postings[0].append(row)
+                postings[1].append(frequency)
+            self._lengths.append(len(terms))
+            self._documents.append(document)
+            self._ids[doc_id] = row
+            self._live += 1
+            self._live_length += len(terms)
+
+    def add_documents(self, documents):
+        """
+        Index several chunks.
+
+        Args:
+            documents (iterable): Chunk Document objects
+        """
+        for document in documents:
+            self.add_document(document)
+
+    def merge(self, other):
+        """
+        Append the chunks of another index without tokenizing them again.
+
+        Chunks whose IDs are already present are replaced.
+
+        Args:
+            other (LexicalIndex): Index to copy from, e.g. one built for a single file
+        """
+        with other._lock:
+            other._compact()
+            documents = list(other._documents)
+            lengths = array("I", other._lengths)
+            postings = {term: (array("I", rows), array("I", frequencies)) for term, (rows, frequencies) in other._postings.items()}
+
+        with self._lock:
+            for document in documents:
+                row = self._ids.get(self.document_id(document))
+                if row is not None:
+                    self._delete_row(row)
+
+            offset = len(self._documents)
+            for term, (rows, frequencies) in postings.items():
+                target = self._postings.get(term)
+                if target is None:
+                    target = self._postings[term] = (array("I"), array("I"))
+                shifted = np.frombuffer(rows, dtype=np.uint32) + np.uint32(offset)
+                target[0].frombytes(shifted.astype(np.uint32).tobytes())
+                target[1].extend(frequencies)
+            for position, document in enumerate(documents):
+                self._ids[self.document_id(document)] = offset + position
+            self._documents.extend(documents)
+            self._lengths.extend(lengths)
+            self._live += len(documents)
+            self._live_length += int(sum(lengths))
+
+    def delete(self, doc_hash):
+        """
+        Remove every chunk of a source file.
+
+        Args:
+            doc_hash (str): Content hash of the source file
+        """
+        with self._lock:
+            for row, document in enumerate(self._documents):
+                if document is not None and document.metadata.get("doc_hash") == doc_hash:
+                    self._delete_row(row)
+            if len(self._documents) and self._live < len(self._documents) * (1 - _COMPACT_RATIO):
+                self._compact()
+
+    def search(self, query, k=4):
+        """
+        Return the k chunks with the highest BM25 score for a query.
+
+        Args:
+            query (str): Search query
+            k (int): Number of chunks to return
+
+        Returns:
+            list: (Document, score) tuples, best first; chunks without any
+            query term are not returned
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            if not terms or not self._live:
+                return []
+
+            lengths = np.frombuffer(self._lengths, dtype=np.uint32).astype(np.float32)
+            average_length = self._live_length / self._live or 1.0
+            length_norm = self.k1 * (1 - self.b + self.b * lengths / average_length)
+            scores = np.zeros(len(self._documents), dtype=np.float32)
+
+            for term in terms:
+                postings = self._postings.get(term)
+                if postings is None:
+                    continue
+                rows = np.frombuffer(postings[0], dtype=np.uint32)
+                frequencies = np.frombuffer(postings[1], dtype=np.uint32).astype(np.float32)
+                # Deleted rows stay in the postings until compaction, so the
+                # document frequency slightly overestimates
+                document_frequency = len(rows)
+                idf = math.log(1 + (self._live - document_frequency + 0.5) / (document_frequency + 0.5))
+                scores[rows] += idf * frequencies * (self.k1 + 1) / (frequencies + length_norm[rows])
+
+            if self._live < len(self._documents):
+                deleted = [row for row, document in enumerate(self._documents) if document is None]
+                scores[deleted] = 0
+
+            matched = np.flatnonzero(scores > 0)
+            if not len(matched):
+                return []
+            if len(matched) > k:
+                matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+            matched = matched[np.argsort(-scores[matched], kind="stable")]
+            return [(self._documents[row], float(scores[row])) for row in matched]
+
+    def persist(self, directory):
+        """
+        Save the index, compacted, to a directory.
+
+        Args:
+            directory (str): Target directory
+        """
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            self._compact()
+            terms = list(self._postings)
+            offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+            for position, term in enumerate(terms):
+                offsets[position + 1] = offsets[position] + len(self._postings[term][0])
+            rows = np.concatenate([np.frombuffer(self._postings[t][0], dtype=np.uint32) for t in terms] or [np.empty(0, np.uint32)])
+            frequencies = np.concatenate([np.frombuffer(self._postings[t][1], dtype=np.uint32) for t in terms] or [np.empty(0, np.uint32)])
+            records = {
+                "k1": self.k1,
+                "b": self.b,
+                "terms": terms,
+                "documents": [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in self._documents],
+            }
+
+            postings_path = os.path.join(directory, POSTINGS_FILE)
+            tmp_path = f"{postings_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(f, offsets=offsets, rows=rows, frequencies=frequencies,
+                         lengths=np.frombuffer(self._lengths, dtype=np.uint32))
+            os.replace(tmp_path, postings_path)
+
+            records_path = os.path.join(directory, RECORDS_FILE)
+            tmp_path = f"{records_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(records, f)
+            os.replace(tmp_path, records_path)
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Open a saved index, or an empty one if the directory holds none.
+
+        Args:
+            directory (str): Directory written by persist()
+
+        Returns:
+            LexicalIndex: Loaded index
+        """
+        records_path = os.path.join(directory, RECORDS_FILE)
+        postings_path = os.path.join(directory, POSTINGS_FILE)
+        if not (os.path.exists(records_path) and os.path.exists(postings_path)):
+            return cls()
+
+        with open(records_path, "r", encoding="utf-8") as f:
+            records = json.load(f)
+        index = cls(k1=records["k1"], b=records["b"])
+        with np.load(postings_path) as arrays:
+            offsets = arrays["offsets"]
+            rows = arrays["rows"].astype(np.uint32)
+            frequencies = arrays["frequencies"].astype(np.uint32)
+            index._lengths = array("I", arrays["lengths"].astype(np.uint32).tobytes())
+
+        for position, term in enumerate(records["terms"]):
+            start, end = offsets[position], offsets[position + 1]
+            index._postings[term] = (array("I", rows[start:end].tobytes()), array("I", frequencies[start:end].tobytes()))
+        index._documents = [Document(page_content=doc["page_content"], metadata=doc["metadata"]) for doc in records["documents"]]
+        index._ids = {cls.document_id(doc): row for row, doc in enumerate(index._documents)}
+        index._live = len(index._documents)
+        index._live_length = int(sum(index._lengths))
+        return index
+
+    @staticmethod
+    def document_id(document):
+        """
+        Return the ID of a chunk, matching the IDs used in the vector store.
+
+        Args:
+            document (Document): Chunk
+
+        Returns:
+            str: "<doc_hash>:<chunk_index>", or the object identity for chunks without a content hash
+        """
+        metadata = document.metadata
+        if metadata.get("doc_hash"):
+            return f"{metadata['doc_hash']}:{metadata.get('chunk_index')}"
+        return f"object:{id(document)}"
+
+    def _delete_row(self, row):
+        """Mark a row as deleted. Must be called with the lock held."""
+        document = self._documents[row]
+        if document is None:
+            return
+        self._documents[row] = None
+        self._ids.pop(self.document_id(document), None)
+        self._live -= 1
+        self._live_length -= self._lengths[row]
+
+    def _compact(self):
+        """Drop deleted rows from the postings and renumber the rest. Must be called with the lock held."""
+        if self._live == len(self._documents):
+            return
+        new_rows = np.full(len(self._documents), -1, dtype=np.int64)
+        kept = [row for row, document in enumerate(self._documents) if document is not None]
+        new_rows[kept] = np.arange(len(kept))
+
+        postings = {}
+        for term, (rows, frequencies) in self._postings.items():
+            old_rows = np.frombuffer(rows, dtype=np.uint32)
+            renumbered = new_rows[old_rows]
+            live = renumbered >= 0
+            if not live.any():
+                continue
+            postings[term] = (
+                array("I", renumbered[live].astype(np.uint32).tobytes()),
+                array("I", np.frombuffer(frequencies, dtype=np.uint32)[live].tobytes()),
+            )
+        self._postings = postings
+        self._lengths = array("I", (self._lengths[row] for row in kept))
+        self._documents = [self._documents[row] for row in kept]
+        self._ids = {self.document_id(document): row for row, document in enumerate(self._documents)}
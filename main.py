@@ -1,6 +1,475 @@
-def main():
-    print("Hello from repl-nix-workspace!")
+import argparse
+import hashlib
+import json
+import os
+import secrets
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from dotenv import load_dotenv
+
+from answer_cache import AnswerCache
+from auth import is_user_library, issue_session, verify_session, verify_user
+from batch_qa import BatchQA, load_questions
+from chat_handler import ChatHandler
+from document_library import open_library, start_janitor
+from ingestion_service import ACTIVE_STATES, get_ingestion_service
+from pdf_processor import PDFProcessor
+from session_tokens import session_ttl
+import tracing
+from vector_store import VectorStore
+
+DEFAULT_LIBRARY = "default"
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8000
+DEFAULT_SERVER_WORKERS = 8
+
+# Idle keep-alive connections are closed after this many seconds
+DEFAULT_KEEPALIVE_SECONDS = 15
+
+DEFAULT_MAX_UPLOAD_MB = 200
+
+NO_DOCUMENTS_MESSAGE = "The library is empty. Ingest PDF files first."
+
+
+class AuthenticationError(Exception):
+    """Raised for a request without valid credentials."""
+
+
+def answer_question(library, question, k=4):
+    """
+    Answer a question from the documents of a library.
+
+    Args:
+        library (DocumentLibrary): Library to search
+        question (str): User question
+        k (int): Number of chunks to retrieve
+
+    Returns:
+        dict: "answer", "sources" and "timings" (stage timings in seconds)
+    """
+    if not library.documents:
+        return {"answer": NO_DOCUMENTS_MESSAGE, "sources": [], "timings": {}}
+
+    doc_hashes = set(library.documents)
+    chat_handler = ChatHandler(
+        library.vectorstore(VectorStore()),
+        corpus_fingerprint=AnswerCache.corpus_fingerprint(doc_hashes),
+        lexical_index=library.lexical_index(),
+        doc_hashes=doc_hashes
+    )
+    answer, sources = chat_handler.get_response(question, k=k)
+    return {"answer": answer, "sources": sources, "timings": chat_handler.last_timings}
+
+
+def format_source(source):
+    """Return 'file.pdf (Page N)' or 'file.pdf (Pages N-M)' for a source entry."""
+    page, page_end = source.get("page"), source.get("page_end")
+    pages = f"Pages {page}-{page_end}" if page_end not in (None, page) else f"Page {page}"
+    return f"{source['filename']} ({pages})"
+
+
+class PooledHTTPServer(HTTPServer):
+    def __init__(self, server_address, handler_class, workers=DEFAULT_SERVER_WORKERS,
+                 keepalive=DEFAULT_KEEPALIVE_SECONDS, max_body_bytes=None):
+        """
+        Initialize an HTTP server that handles connections on a fixed worker pool.
+
+        A keep-alive connection occupies one worker until it is closed or
+        has been idle for keepalive seconds; further connections wait in
+        the listen backlog.
+
+        Args:
+            server_address (tuple): (host, port)
+            handler_class: Request handler class
+            workers (int): Connections served concurrently
+            keepalive (float): Idle seconds before a connection is closed
+            max_body_bytes (int): Largest accepted request body (default:
+                MAX_UPLOAD_MB or 200 MB)
+        """
+        self.request_queue_size = max(workers * 4, 16)
+        super().__init__(server_address, handler_class)
+        self.workers = workers
+        self.keepalive = keepalive
+        self.max_body_bytes = max_body_bytes or int(os.getenv("MAX_UPLOAD_MB", DEFAULT_MAX_UPLOAD_MB)) * 1024 * 1024
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="http")
+
+    def process_request(self, request, client_address):
+        """Hand an accepted connection to the worker pool."""
+        self._pool.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        """Serve every request of a connection, then close it."""
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        """Stop accepting connections and release the workers."""
+        super().server_close()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class APIRequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON API over the document library.
+
+    GET    /health                      liveness check
+    GET    /metrics                     stage latencies and events (Prometheus text format)
+    POST   /login                       session token for {"email": ..., "password": ...}
+    GET    /documents?library=NAME      documents and ingestion jobs of a library
+    POST   /documents?library=NAME&filename=FILE.pdf
+                                        ingest the PDF sent as request body
+    DELETE /documents/<doc_hash>?library=NAME
+                                        remove a document
+    GET    /jobs/<job_id>?library=NAME  ingestion job status
+    DELETE /jobs/<job_id>?library=NAME  cancel an ingestion job
+    POST   /ask?library=NAME            answer {"question": ..., "k": 4}
+
+    Library endpoints require an "Authorization: Bearer <token>" header. A
+    session token of an app user (from /login or the app) opens only that
+    user's library; the PDF_CHAT_API_KEY key opens service libraries, any
+    name that is not the email of an app user.
+    """
+
+    protocol_version = "HTTP/1.1"
+    server_version = "PDFChat/1.0"
+
+    # (method, path) served without credentials
+    public_routes = {("GET", "health"), ("GET", "metrics"), ("POST", "login")}
+
+    def setup(self):
+        # Applies to the socket, so it bounds how long an idle connection is kept
+        self.timeout = self.server.keepalive
+        super().setup()
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def _dispatch(self, method):
+        """Route a request and send the JSON response."""
+        url = urlparse(self.path)
+        self.query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        parts = [part for part in url.path.split("/") if part]
+        try:
+            if (method, "/".join(parts)) not in self.public_routes:
+                self._authenticate()
+
+            if method == "GET" and parts == ["health"]:
+                self._send_json(200, {"status": "ok"})
+            elif method == "GET" and parts == ["metrics"]:
+                self._send_text(200, tracing.render_prometheus(), tracing.METRICS_CONTENT_TYPE)
+            elif method == "POST" and parts == ["login"]:
+                self._login()
+            elif parts == ["documents"] and method == "GET":
+                self._list_documents()
+            elif parts == ["documents"] and method == "POST":
+                self._ingest_document()
+            elif len(parts) == 2 and parts[0] == "documents" and method == "DELETE":
+                self._remove_document(parts[1])
+            elif len(parts) == 2 and parts[0] == "jobs" and method in ("GET", "DELETE"):
+                self._job(parts[1], cancel=method == "DELETE")
+            elif parts == ["ask"] and method == "POST":
+                self._ask()
+            else:
+                # An unread body would be parsed as the next request
+                self.close_connection = True
+                self._send_json(404, {"error": f"Not found: {method} {url.path}"})
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+        except AuthenticationError as e:
+            self.close_connection = True
+            self._send_json(401, {"error": str(e)})
+        except PermissionError as e:
+            self.close_connection = True
+            self._send_json(403, {"error": str(e)})
+        except Exception as e:
+            self.close_connection = True
+            self._send_json(500, {"error": f"Error handling request: {str(e)}"})
+
+    def _list_documents(self):
+        library = self._library()
+        documents = [{"doc_hash": doc_hash, **doc} for doc_hash, doc in library.documents.items()]
+        self._send_json(200, {"documents": documents, "jobs": get_ingestion_service().jobs(library)})
+
+    def _ingest_document(self):
+        library = self._library()
+        data = self._read_body()
+        if not data.startswith(b"%PDF"):
+            raise ValueError("Request body is not a PDF file")
+
+        filename = os.path.basename(self.query.get("filename") or "document.pdf")
+        doc_hash = hashlib.sha256(data).hexdigest()
+        if library.has_document(doc_hash):
+            self._send_json(200, {"doc_hash": doc_hash, "state": "done"})
+            return
+
+        # Joins a running job for the same file instead of queueing another
+        service = get_ingestion_service()
+        job_id = service.submit(library, data, filename=filename, doc_hash=doc_hash)
+        self._send_json(202, {"doc_hash": doc_hash, "job_id": job_id, "state": service.status(job_id)["state"]})
+
+    def _remove_document(self, doc_hash):
+        library = self._library()
+        if not library.has_document(doc_hash):
+            self._send_json(404, {"error": f"Unknown document: {doc_hash}"})
+            return
+        library.remove_document(doc_hash, VectorStore())
+        self._send_json(200, {"doc_hash": doc_hash, "removed": True})
+
+    def _job(self, job_id, cancel=False):
+        service = get_ingestion_service()
+        # Only jobs of a library the caller may open are visible
+        if not any(job["job_id"] == job_id for job in service.jobs(self._library())):
+            self._send_json(404, {"error": f"Unknown job: {job_id}"})
+            return
+        if cancel:
+            service.cancel(job_id)
+        self._send_json(200, service.status(job_id))
+
+    def _ask(self):
+        payload = self._read_json()
+        question = str(payload.get("question") or "").strip()
+        if not question:
+            raise ValueError("Missing question")
+
+        library = self._library(payload.get("library"))
+        self._send_json(200, answer_question(library, question, k=int(payload.get("k", 4))))
+
+    def _login(self):
+        payload = self._read_json()
+        email = str(payload.get("email") or "").strip()
+        if not verify_user(email, str(payload.get("password") or "")):
+            raise AuthenticationError("Invalid email or password")
+        self._send_json(200, {"token": issue_session(email), "expires_in": session_ttl()})
+
+    def _authenticate(self):
+        """
+        Check the bearer token of the request and remember whose it is.
+
+        Sets self.user to the app user of a session token, or to None for
+        the service API key; raises AuthenticationError otherwise.
+        """
+        scheme, _, token = self.headers.get("Authorization", "").partition(" ")
+        token = token.strip()
+        if scheme.lower() != "bearer" or not token:
+            raise AuthenticationError("Missing bearer token")
+
+        api_key = os.getenv("PDF_CHAT_API_KEY")
+        if api_key and secrets.compare_digest(token.encode("utf-8"), api_key.encode("utf-8")):
+            self.user = None
+            return
+        claims = verify_session(token)
+        if claims is None:
+            raise AuthenticationError("Invalid or expired token")
+        self.user = claims["sub"]
+
+    def _library(self, name=None):
+        """Return the library named in the request, if the caller may open it."""
+        name = name or self.query.get("library")
+        if self.user is not None:
+            if name and name.strip().lower() != self.user.strip().lower():
+                raise PermissionError("A session token only opens the library of its user")
+            return open_library(self.user)
+
+        name = name or DEFAULT_LIBRARY
+        if is_user_library(name):
+            raise PermissionError("The API key does not open libraries of app users")
+        return open_library(name)
+
+    def _read_json(self):
+        """Read a JSON object request body."""
+        try:
+            payload = json.loads(self._read_body() or b"{}")
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON body: {str(e)}")
+        if not isinstance(payload, dict):
+            raise ValueError("Request body must be a JSON object")
+        return payload
+
+    def _read_body(self):
+        """Read the request body, which must declare its length."""
+        length = self.headers.get("Content-Length")
+        if length is None:
+            self.close_connection = True
+            raise ValueError("Content-Length header is required")
+        length = int(length)
+        if length > self.server.max_body_bytes:
+            # The body is not read, so the connection cannot be reused
+            self.close_connection = True
+            raise ValueError(f"Request body larger than {self.server.max_body_bytes} bytes")
+        return self.rfile.read(length)
+
+    def _send_json(self, status, payload):
+        self._send_text(status, json.dumps(payload), "application/json")
+
+    def _send_text(self, status, text, content_type):
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if status == 401:
+            self.send_header("WWW-Authenticate", 'Bearer realm="pdf-chat"')
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def ingest_command(args):
+    """Ingest PDF files into a library and wait until they are searchable."""
+    library = open_library(args.library)
+    service = get_ingestion_service()
+    jobs = {}
+    for path in args.paths:
+        if not path.lower().endswith(".pdf"):
+            print(f"Skipping {path}: not a PDF file", file=sys.stderr)
+            continue
+        doc_hash = PDFProcessor.compute_file_hash(path)
+        if library.has_document(doc_hash) or doc_hash in jobs.values():
+            print(f"{os.path.basename(path)}: already in the library")
+            continue
+        jobs[service.submit(library, path, doc_hash=doc_hash)] = doc_hash
+
+    failed = 0
+    while jobs:
+        time.sleep(0.2)
+        for job_id in list(jobs):
+            status = service.status(job_id)
+            if status["state"] in ACTIVE_STATES:
+                continue
+            del jobs[job_id]
+            for warning in status["warnings"]:
+                print(f"{status['filename']}: {warning}", file=sys.stderr)
+            if status["state"] == "done":
+                print(f"{status['filename']}: {status['pages']} pages, {status['embedded']} chunks indexed")
+            else:
+                failed += 1
+                print(f"{status['filename']}: {status['state']}: {status['error']}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def ask_command(args):
+    """Answer a question from a library and print the answer and its sources."""
+    result = answer_question(open_library(args.library), args.question, k=args.k)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return 0
+
+    print(result["answer"])
+    if result["sources"]:
+        print("\nSources:")
+        for source in result["sources"]:
+            print(f"  - {format_source(source)}")
+    return 0
+
+
+def batch_command(args):
+    """Answer a question file and write the results as JSON Lines, resuming earlier runs."""
+    library = open_library(args.library)
+    if not library.documents:
+        print(NO_DOCUMENTS_MESSAGE, file=sys.stderr)
+        return 1
+
+    doc_hashes = set(library.documents)
+    chat_handler = ChatHandler(
+        library.vectorstore(VectorStore()),
+        corpus_fingerprint=AnswerCache.corpus_fingerprint(doc_hashes),
+        lexical_index=library.lexical_index(),
+        doc_hashes=doc_hashes
+    )
+    questions = load_questions(args.questions)
+    output = args.output or f"{os.path.splitext(args.questions)[0]}.answers.jsonl"
+
+    def on_progress(report):
+        finished = report["skipped"] + report["answered"] + report["cached"] + report["failed"]
+        print(f"\r{finished}/{report['total']} questions", end="", file=sys.stderr, flush=True)
+
+    report = BatchQA(chat_handler, max_workers=args.workers).run(questions, output, k=args.k, progress_callback=on_progress)
+    print(file=sys.stderr)
+    print(
+        f"{report['answered']} answered, {report['cached']} from cache, {report['skipped']} already done, "
+        f"{report['failed']} failed in {report['seconds']:.1f}s -> {output}"
+    )
+    return 1 if report["failed"] else 0
+
+
+def serve_command(args):
+    """Run the HTTP API until interrupted."""
+    start_janitor()
+    server = PooledHTTPServer((args.host, args.port), APIRequestHandler, workers=args.workers, keepalive=args.keepalive)
+    print(f"Serving on http://{args.host}:{server.server_port} with {args.workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        get_ingestion_service().shutdown(wait=False)
+    return 0
+
+
+def build_parser():
+    """Return the command line parser."""
+    parser = argparse.ArgumentParser(description="Ingest PDF files and ask questions about them.")
+    parser.add_argument(
+        "--library", default=os.getenv("PDF_CHAT_LIBRARY", DEFAULT_LIBRARY),
+        help="Library name; the e-mail of an app user opens their library (default: PDF_CHAT_LIBRARY or 'default')"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest = commands.add_parser("ingest", help="Add PDF files to the library")
+    ingest.add_argument("paths", nargs="+", help="PDF files")
+    ingest.set_defaults(handler=ingest_command)
+
+    ask = commands.add_parser("ask", help="Answer a question from the library")
+    ask.add_argument("question", help="Question about the documents")
+    ask.add_argument("-k", type=int, default=4, help="Number of chunks to retrieve")
+    ask.add_argument("--json", action="store_true", help="Print the answer, sources and timings as JSON")
+    ask.set_defaults(handler=ask_command)
+
+    batch = commands.add_parser("batch", help="Answer a file of questions")
+    batch.add_argument("questions", help="Question file: one question per line, or JSON Lines with id and question")
+    batch.add_argument("-o", "--output", help="JSON Lines output, resumed if it exists (default: <questions>.answers.jsonl)")
+    batch.add_argument("-k", type=int, default=4, help="Number of chunks to retrieve")
+    batch.add_argument(
+        "--workers", type=int, default=None,
+        help="Concurrent generation requests (default: BATCH_QA_WORKERS or 8)"
+    )
+    batch.set_defaults(handler=batch_command)
+
+    serve = commands.add_parser("serve", help="Run the HTTP API")
+    serve.add_argument("--host", default=os.getenv("HOST", DEFAULT_HOST))
+    serve.add_argument("--port", type=int, default=int(os.getenv("PORT", DEFAULT_PORT)))
+    serve.add_argument(
+        "--workers", type=int, default=int(os.getenv("SERVER_WORKERS", DEFAULT_SERVER_WORKERS)),
+        help="Connections served concurrently (default: SERVER_WORKERS or 8)"
+    )
+    serve.add_argument(
+        "--keepalive", type=float, default=float(os.getenv("KEEPALIVE_SECONDS", DEFAULT_KEEPALIVE_SECONDS)),
+        help="Seconds an idle keep-alive connection is kept open (default: KEEPALIVE_SECONDS or 15)"
+    )
+    serve.set_defaults(handler=serve_command)
+    return parser
+
+
+def main(argv=None):
+    load_dotenv()
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,474 @@
+import json
+import os
+import shutil
+import threading
+import uuid
+
+import numpy as np
+from langchain_core.documents import Document
+
+DTYPES = ("float32", "float16", "int8")
+
+VECTORS_FILE = "vectors.npy"
+SCALES_FILE = "scales.npy"
+RECORDS_FILE = "records.json"
+# Names the generation subdirectory that holds the current files
+CURRENT_FILE = "CURRENT"
+
+# Rows scored per matrix-vector product when the storage type is not float32
+_SCORE_BLOCK_ROWS = 8192
+
+# Queries scored per matrix-matrix product in batched searches
+_QUERY_BLOCK_ROWS = 256
+_MIN_CAPACITY = 256
+
+
+class NumpyIndex:
+    def __init__(self, embedding_function=None, dtype="float32", persist_directory=None, query_embedder=None):
+        """
+        Initialize an empty in-process vector index.
+
+        Embeddings are normalized and kept in one contiguous matrix, so a
+        query is a single matrix-vector product (cosine similarity) followed
+        by argpartition. Implements the parts of the Chroma interface used
+        by VectorStore.
+
+        Args:
+            embedding_function: LangChain embeddings client of the stored
+                documents
+            dtype (str): Storage type, "float32", "float16" or "int8"
+                (per-row scaled quantization)
+            persist_directory (str): Directory used by persist() and load()
+            query_embedder: Embeds the queries of similarity_search and
+                similarity_search_with_score, e.g. the retrieval-query
+                QueryEmbedder of ClientRegistry.query_embedder
+        """
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported index dtype: {dtype}")
+        self.embedding_function = embedding_function
+        self.query_embedder = query_embedder
+        self.dtype = dtype
+        self.persist_directory = persist_directory
+        self._lock = threading.RLock()
+        self._matrix = None  # rows beyond self._size are spare capacity
+        self._scales = None  # per-row dequantization factors for int8
+        self._size = 0
+        self._ids = []
+        self._texts = []
+        self._metadatas = []
+        self._rows = {}  # id -> row
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def dimension(self):
+        """Embedding dimension, None while the index is empty."""
+        return None if self._matrix is None else self._matrix.shape[1]
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        """
+        Insert or replace vectors with their texts and metadata.
+
+        Args:
+            ids (list): Unique IDs
+            embeddings (list): One vector per ID
+            documents (list): Chunk texts
+            metadatas (list): Chunk metadata dicts
+        """
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(ids):
+            raise ValueError("Expected one embedding per ID")
+
+        with self._lock:
+            if self._matrix is not None and vectors.shape[1] != self.dimension:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match index dimension {self.dimension}")
+
+            values, scales = self._encode(vectors)
+            if self._matrix is not None and not self._matrix.flags.writeable:
+                # Copy a memory-mapped matrix into memory before the first write
+                self._reserve(self._size, self.dimension)
+
+            # The last occurrence of a repeated ID wins
+            positions = {doc_id: position for position, doc_id in enumerate(ids)}
+            new_rows = []
+            for doc_id, position in positions.items():
+                row = self._rows.get(doc_id)
+                if row is None:
+                    new_rows.append(position)
+                    continue
+                # Replace an existing entry in place
+                self._matrix[row] = values[position]
+                if scales is not None:
+                    self._scales[row] = scales[position]
+                self._texts[row] = documents[position]
+                self._metadatas[row] = metadatas[position] or {}
+
+            if not new_rows:
+                return
+            self._reserve(self._size + len(new_rows), vectors.shape[1])
+            start, end = self._size, self._size + len(new_rows)
+            self._matrix[start:end] = values[new_rows]
+            if scales is not None:
+                self._scales[start:end] = scales[new_rows]
+            for offset, position in enumerate(new_rows):
+                self._rows[ids[position]] = start + offset
+                self._ids.append(ids[position])
+                self._texts.append(documents[position])
+                self._metadatas.append(metadatas[position] or {})
+            self._size = end
+
+    def delete(self, ids=None, where=None):
+        """
+        Delete entries by ID or by exact metadata match.
+
+        Args:
+            ids (list): IDs to delete
+            where (dict): Metadata key/value pairs an entry must all match
+        """
+        with self._lock:
+            doomed = set(ids or [])
+            if where:
+                doomed.update(
+                    self._ids[row] for row in range(self._size)
+                    if all(self._metadatas[row].get(key) == value for key, value in where.items())
+                )
+            doomed_rows = sorted(self._rows[doc_id] for doc_id in doomed if doc_id in self._rows)
+            if not doomed_rows:
+                return
+
+            keep = np.ones(self._size, dtype=bool)
+            keep[doomed_rows] = False
+            kept_rows = np.flatnonzero(keep)
+            # Boolean indexing copies, which also detaches a memory-mapped matrix
+            self._matrix = np.ascontiguousarray(self._matrix[:self._size][keep])
+            if self._scales is not None:
+                self._scales = np.ascontiguousarray(self._scales[:self._size][keep])
+            self._ids = [self._ids[row] for row in kept_rows]
+            self._texts = [self._texts[row] for row in kept_rows]
+            self._metadatas = [self._metadatas[row] for row in kept_rows]
+            self._rows = {doc_id: row for row, doc_id in enumerate(self._ids)}
+            self._size = len(kept_rows)
+
+    def get_vectors(self, ids):
+        """
+        Return the stored vectors of entries, converted back to float32.
+
+        Args:
+            ids (list): Entry IDs
+
+        Returns:
+            array or None: One normalized vector per ID, None if any ID is unknown
+        """
+        with self._lock:
+            rows = [self._rows.get(doc_id) for doc_id in ids]
+            if any(row is None for row in rows):
+                return None
+            vectors = self._matrix[rows].astype(np.float32)
+            if self._scales is not None:
+                vectors *= self._scales[rows][:, None]
+            return vectors
+
+    def similarity_search_by_vector(self, embedding, k=4):
+        """
+        Return the k documents most similar to a query vector.
+
+        Args:
+            embedding (list): Query vector
+            k (int): Number of documents to return
+
+        Returns:
+            list: Document objects, most similar first
+        """
+        return [doc for doc, _ in self.similarity_search_by_vector_with_relevance_scores(embedding, k=k)]
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k=4):
+        """
+        Return the k documents most similar to a query vector with their distances.
+
+        Args:
+            embedding (list): Query vector
+            k (int): Number of documents to return
+
+        Returns:
+            list: (Document, cosine distance) tuples, lower is more similar
+        """
+        with self._lock:
+            rows, similarities = self._top_k(embedding, k)
+            return [
+                (Document(page_content=self._texts[row], metadata=dict(self._metadatas[row])), 1.0 - float(similarity))
+                for row, similarity in zip(rows, similarities)
+            ]
+
+    def similarity_search_by_vectors(self, embeddings, k=4):
+        """
+        Return the k documents most similar to each of several query vectors.
+
+        All queries are scored with one matrix-matrix product per block of
+        queries instead of one matrix-vector product each.
+
+        Args:
+            embeddings (list): Query vectors
+            k (int): Number of documents to return per query
+
+        Returns:
+            list: One list of Document objects per query, most similar first
+        """
+        results = []
+        with self._lock:
+            for start in range(0, len(embeddings), _QUERY_BLOCK_ROWS):
+                rows, _ = self._top_k_many(embeddings[start:start + _QUERY_BLOCK_ROWS], k)
+                results.extend(
+                    [Document(page_content=self._texts[row], metadata=dict(self._metadatas[row])) for row in query_rows]
+                    for query_rows in rows
+                )
+        return results
+
+    def similarity_search(self, query, k=4):
+        """
+        Embed a query with the query embedder and return the k most similar documents.
+
+        Args:
+            query (str): Search query
+            k (int): Number of documents to return
+
+        Returns:
+            list: Document objects, most similar first
+        """
+        return self.similarity_search_by_vector(self._embed_query(query), k=k)
+
+    def similarity_search_with_score(self, query, k=4):
+        """
+        Embed a query with the query embedder and return the k most similar documents with distances.
+
+        Args:
+            query (str): Search query
+            k (int): Number of documents to return
+
+        Returns:
+            list: (Document, cosine distance) tuples, lower is more similar
+        """
+        return self.similarity_search_by_vector_with_relevance_scores(self._embed_query(query), k=k)
+
+    def persist(self, directory=None):
+        """
+        Save the index so that load() can memory-map it.
+
+        Files are written to a new generation subdirectory, which then
+        replaces the previous one through a single rename of the CURRENT
+        pointer file, so a reader never sees a partially written index.
+
+        Args:
+            directory (str): Target directory, defaults to persist_directory
+        """
+        directory = directory or self.persist_directory
+        if not directory:
+            raise ValueError("No persist directory configured")
+        os.makedirs(directory, exist_ok=True)
+
+        with self._lock:
+            generation = f"gen-{uuid.uuid4().hex}"
+            target = os.path.join(directory, generation)
+            os.makedirs(target)
+            matrix = self._matrix[:self._size] if self._matrix is not None else np.zeros((0, 0), dtype=self.dtype)
+            with open(os.path.join(target, VECTORS_FILE), "wb") as f:
+                np.save(f, matrix)
+            if self._scales is not None:
+                with open(os.path.join(target, SCALES_FILE), "wb") as f:
+                    np.save(f, self._scales[:self._size])
+            records = {
+                "dtype": self.dtype,
+                "size": self._size,
+                "ids": self._ids,
+                "texts": self._texts,
+                "metadatas": self._metadatas,
+            }
+            with open(os.path.join(target, RECORDS_FILE), "w", encoding="utf-8") as f:
+                json.dump(records, f)
+
+            previous = self._current_generation(directory)
+            self._replace(directory, CURRENT_FILE, lambda f: f.write(generation.encode("utf-8")))
+            # Readers that already mapped the old files keep them; later loads follow CURRENT
+            if previous:
+                shutil.rmtree(os.path.join(directory, previous), ignore_errors=True)
+            else:
+                for filename in (VECTORS_FILE, SCALES_FILE, RECORDS_FILE):
+                    try:
+                        os.remove(os.path.join(directory, filename))
+                    except OSError:
+                        pass
+
+    @classmethod
+    def load(cls, directory, embedding_function=None, dtype="float32", mmap=True, query_embedder=None):
+        """
+        Open a saved index, or an empty one if the directory holds none.
+
+        Args:
+            directory (str): Directory written by persist()
+            embedding_function: LangChain embeddings client
+            dtype (str): Storage type for a new index; a saved index keeps its own
+            mmap (bool): Memory-map the vectors instead of reading them; the
+                matrix is copied into memory on the first write
+            query_embedder: Embeds text queries (see __init__)
+
+        Returns:
+            NumpyIndex: Index persisting to the same directory
+        """
+        for _ in range(3):
+            generation = cls._current_generation(directory)
+            # Indexes saved before generations were introduced keep their files in the directory itself
+            source = os.path.join(directory, generation) if generation else directory
+            try:
+                return cls._load_files(source, directory, embedding_function, dtype, mmap, query_embedder)
+            except FileNotFoundError:
+                # A concurrent persist replaced the generation after CURRENT was read
+                if not generation or cls._current_generation(directory) == generation:
+                    raise
+        raise Exception(f"Error loading index from {directory}: it keeps being replaced")
+
+    @classmethod
+    def _load_files(cls, source, directory, embedding_function, dtype, mmap, query_embedder):
+        """Open the index files of one generation, checking that they belong together."""
+        records_path = os.path.join(source, RECORDS_FILE)
+        if not os.path.exists(records_path):
+            if source != directory:
+                raise FileNotFoundError(records_path)
+            return cls(embedding_function=embedding_function, dtype=dtype, persist_directory=directory,
+                       query_embedder=query_embedder)
+
+        with open(records_path, "r", encoding="utf-8") as f:
+            records = json.load(f)
+        index = cls(embedding_function=embedding_function, dtype=records["dtype"], persist_directory=directory,
+                    query_embedder=query_embedder)
+        index._ids = records["ids"]
+        index._texts = records["texts"]
+        index._metadatas = records["metadatas"]
+        index._rows = {doc_id: row for row, doc_id in enumerate(index._ids)}
+        index._size = len(index._ids)
+        if index._size:
+            mmap_mode = "r" if mmap else None
+            index._matrix = np.load(os.path.join(source, VECTORS_FILE), mmap_mode=mmap_mode)
+            if index.dtype == "int8":
+                index._scales = np.load(os.path.join(source, SCALES_FILE), mmap_mode=mmap_mode)
+        rows = {records.get("size", index._size), len(index._texts), len(index._metadatas)}
+        if index._matrix is not None:
+            rows.add(len(index._matrix))
+        if index._scales is not None:
+            rows.add(len(index._scales))
+        if rows != {index._size}:
+            raise ValueError(f"Index files in {source} do not match: row counts {sorted(rows)}")
+        return index
+
+    @staticmethod
+    def _current_generation(directory):
+        """Return the name of the current generation subdirectory, None for the flat layout."""
+        try:
+            with open(os.path.join(directory, CURRENT_FILE), "r", encoding="utf-8") as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def _top_k(self, embedding, k):
+        """
+        Score all rows against a query vector and select the best k.
+
+        Must be called with the lock held.
+
+        Returns:
+            tuple: (row indices, cosine similarities), most similar first
+        """
+        rows, scores = self._top_k_many([embedding], k)
+        return rows[0], scores[0]
+
+    def _top_k_many(self, embeddings, k):
+        """
+        Score all rows against several query vectors and select the best k for each.
+
+        Must be called with the lock held.
+
+        Returns:
+            tuple: (row indices, cosine similarities), one row per query,
+            most similar first
+        """
+        if not self._size or k <= 0:
+            empty = np.empty((len(embeddings), 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+
+        queries = np.asarray(embeddings, dtype=np.float32)
+        if queries.ndim != 2 or queries.shape[1] != self.dimension:
+            raise ValueError(f"Query dimension {queries.shape[-1]} does not match index dimension {self.dimension}")
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        queries = queries / norms
+
+        matrix = self._matrix[:self._size]
+        if self.dtype == "float32":
+            scores = queries @ matrix.T
+        else:
+            # Upcast block by block; numpy has no fast float16/int8 matmul
+            scores = np.empty((len(queries), self._size), dtype=np.float32)
+            for start in range(0, self._size, _SCORE_BLOCK_ROWS):
+                end = min(start + _SCORE_BLOCK_ROWS, self._size)
+                scores[:, start:end] = queries @ matrix[start:end].astype(np.float32).T
+            if self._scales is not None:
+                scores *= self._scales[:self._size]
+
+        k = min(k, self._size)
+        if k < self._size:
+            rows = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            rows = np.broadcast_to(np.arange(self._size), scores.shape)
+        top = np.take_along_axis(scores, rows, axis=1)
+        order = np.argsort(-top, axis=1, kind="stable")
+        return np.take_along_axis(rows, order, axis=1), np.take_along_axis(top, order, axis=1)
+
+    def _encode(self, vectors):
+        """
+        Normalize vectors and convert them to the storage type.
+
+        Returns:
+            tuple: (stored values, per-row scales or None)
+        """
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        vectors = vectors / norms
+        if self.dtype == "float32":
+            return vectors, None
+        if self.dtype == "float16":
+            return vectors.astype(np.float16), None
+
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        values = np.rint(vectors / scales[:, None]).astype(np.int8)
+        return values, scales.astype(np.float32)
+
+    def _reserve(self, size, dimension):
+        """Grow the matrix geometrically so appends are amortized O(1). Must be called with the lock held."""
+        capacity = 0 if self._matrix is None else self._matrix.shape[0]
+        if self._matrix is not None and size <= capacity and self._matrix.flags.writeable:
+            return
+        capacity = max(size, capacity * 2, _MIN_CAPACITY) if size > capacity else capacity
+        matrix = np.empty((capacity, dimension), dtype=self.dtype)
+        if self._size:
+            matrix[:self._size] = self._matrix[:self._size]
+        self._matrix = matrix
+        if self.dtype == "int8":
+            scales = np.empty(capacity, dtype=np.float32)
+            if self._size:
+                scales[:self._size] = self._scales[:self._size]
+            self._scales = scales
+
+    def _embed_query(self, query):
+        """Embed a query with the query embedder; document embeddings would use the wrong task type."""
+        if self.query_embedder is None:
+            raise ValueError("NumpyIndex has no query embedder for text queries")
+        return self.query_embedder.embed_query(query)
+
+    @staticmethod
+    def _replace(directory, filename, write):
+        """Write a file under a temporary name and atomically rename it."""
+        path = os.path.join(directory, filename)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
@@ -1,70 +1,406 @@
 import PyPDF2
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from array import array
+from collections import deque
+from contextlib import contextmanager
+import bisect
+import hashlib
 import io
-import streamlit as st
+import math
+import mmap
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+from text_chunker import TextChunker
+import tracing
+
+# Files with fewer pages are extracted in-process, the pool overhead is not worth it
+PARALLEL_MIN_PAGES = 16
+
+# Uploads larger than this are spooled to disk once and memory-mapped by the
+# pool workers instead of being pickled into every task
+POOL_INLINE_MAX_BYTES = 4 * 1024 * 1024
+
+# Non-seekable streams are buffered in memory up to this size, then on disk
+SPOOL_MAX_BYTES = 16 * 1024 * 1024
+
+# Pages are joined with a blank line, so page breaks are preferred split points
+PAGE_SEPARATOR = "\n\n"
+_PAGE_MARKER = re.compile(r"\n--- Page (\d+) ---\n")
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def _pool_size():
+    """Return the number of extraction worker processes (PDF_EXTRACT_WORKERS or the CPU count)."""
+    return int(os.getenv("PDF_EXTRACT_WORKERS", os.cpu_count() or 1))
+
+
+def _get_process_pool():
+    """
+    Return the process-wide extraction pool, starting it on first use.
+    
+    Workers are spawned rather than forked so they never inherit the
+    threads and sockets of the Streamlit server.
+    
+    Returns:
+        ProcessPoolExecutor: Shared process pool
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=_pool_size(),
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _process_pool
+
+
+def _reset_process_pool():
+    """Drop a broken process pool so the next call starts a new one."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+
+@contextmanager
+def _open_pdf_stream(source):
+    """
+    Open a PDF source as a seekable stream without copying it into memory.
+    
+    Paths and real files are memory-mapped, in-memory uploads are read in
+    place and any other stream is spooled to a temporary buffer.
+    
+    Args:
+        source: File path, bytes, Streamlit uploaded file or binary stream
+        
+    Yields:
+        Seekable binary stream positioned at the start of the PDF
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        yield io.BytesIO(source)
+        return
+    
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+        return
+    
+    if hasattr(source, "getbuffer"):
+        # Streamlit uploads are BytesIO objects that already hold the file
+        source.seek(0)
+        yield source
+        return
+    
+    try:
+        mapped = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        mapped = None
+    if mapped is not None:
+        with mapped:
+            yield mapped
+        return
+    
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as spool:
+        shutil.copyfileobj(source, spool)
+        spool.seek(0)
+        yield spool
+
+
+def _iter_page_texts(pdf_reader, filename, start, end, warnings):
+    """
+    Yield the text of pages [start, end) of an open PDF.
+    
+    Args:
+        pdf_reader (PyPDF2.PdfReader): Open reader
+        filename (str): Source filename, used in warnings
+        start (int): First page index (0-based)
+        end (int): Page index after the last page
+        warnings (list): Receives a message for every page that fails
+        
+    Yields:
+        tuple: (page_number, text) for every non-empty page
+    """
+    for page_num in range(start, end):
+        try:
+            with tracing.span("pdf.extract_page"):
+                page_text = pdf_reader.pages[page_num].extract_text()
+            tracing.count("pdf.pages")
+            if page_text and page_text.strip():  # Only keep non-empty pages
+                yield page_num + 1, page_text
+        except Exception as e:
+            warnings.append(f"Could not extract text from page {page_num + 1} of {filename}: {str(e)}")
+
+
+def _extract_page_range(source, filename, start, end):
+    """
+    Extract the text of pages [start, end) of a PDF.
+    
+    Runs inside pool workers, so problems are returned as data instead of
+    being reported to the UI.
+    
+    Args:
+        source (bytes or str): PDF content or path to a PDF file
+        filename (str): Source filename, used in warnings
+        start (int): First page index (0-based)
+        end (int): Page index after the last page
+        
+    Returns:
+        tuple: (pages, warnings) where pages is a list of (page_number, text)
+    """
+    warnings = []
+    with _open_pdf_stream(source) as stream:
+        pdf_reader = PyPDF2.PdfReader(stream)
+        pages = list(_iter_page_texts(pdf_reader, filename, start, end, warnings))
+    return pages, warnings
+
 
 class PDFProcessor:
-    def __init__(self, chunk_size=1000, chunk_overlap=200):
+    def __init__(self, chunk_size=1000, chunk_overlap=200, length_function=None):
         """
-        Initialize PDF processor with text splitter configuration.
+        Initialize PDF processor with text chunker configuration.
         
         Args:
             chunk_size (int): Size of each text chunk
             chunk_overlap (int): Overlap between chunks
+            length_function (callable): Measures chunk_size and chunk_overlap,
+                e.g. context_packer.estimate_tokens for tokens (default: characters)
         """
-        self.text_splitter = RecursiveCharacterTextSplitter(
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.text_chunker = TextChunker(
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
-            length_function=len,
-            separators=["\n\n", "\n", " ", ""]
+            separators=["\n\n", "\n", " ", ""],
+            length_function=length_function
         )
+        # Per-page extraction problems, reported by the caller
+        self.warnings = []
+    
+    def iter_pages(self, uploaded_file):
+        """
+        Stream the text of an uploaded PDF page by page.
+        
+        The file is read in place (memory-mapped or spooled), and only one
+        page of text is held at a time. Pages that cannot be read are
+        skipped and described in self.warnings.
+        
+        Args:
+            uploaded_file: Streamlit uploaded file object, binary stream or path
+            
+        Yields:
+            tuple: (page_number, text) for every non-empty page
+        """
+        filename = self._display_name(uploaded_file)
+        try:
+            with _open_pdf_stream(uploaded_file) as stream:
+                pdf_reader = PyPDF2.PdfReader(stream)
+                total_pages = len(pdf_reader.pages)
+                yield from _iter_page_texts(pdf_reader, filename, 0, total_pages, self.warnings)
+        except Exception as e:
+            raise Exception(f"Error extracting text from {filename}: {str(e)}")
     
     def extract_text(self, uploaded_file):
         """
         Extract text from uploaded PDF file.
         
+        Pages that cannot be read are skipped and described in self.warnings.
+        
         Args:
             uploaded_file: Streamlit uploaded file object
             
         Returns:
             str: Extracted text from PDF
         """
+        filename = self._display_name(uploaded_file)
+        text = self.join_pages(self.iter_pages(uploaded_file))
+        if not text.strip():
+            raise Exception(f"Error extracting text from {filename}: No text could be extracted from {filename}")
+        return text
+    
+    def iter_pages_parallel(self, uploaded_file, pages_per_task=None):
+        """
+        Stream the text of a PDF page by page, extracting on the process pool.
+        
+        The file is split into page ranges that are extracted by the pool
+        workers, a bounded number ahead of the consumer, and yielded in page
+        order. Chunking and embedding of earlier pages overlap with the
+        extraction of later ones, and only the ranges in flight are held in
+        memory. Small files, and any file on a single worker, are extracted
+        in-process; if the pool breaks, the remaining ranges are extracted
+        in-process too. Pages that cannot
+        be read are skipped and described in self.warnings.
+        
+        Args:
+            uploaded_file: Streamlit uploaded file object, binary stream or path
+            pages_per_task (int): Pages per pool task (by default sized so
+                every worker gets about two tasks, at most 32 pages)
+            
+        Yields:
+            tuple: (page_number, text) for every non-empty page
+        """
+        filename = self._display_name(uploaded_file)
+        spooled_paths = []
+        pending = deque()  # ((start, end), future) in page order
         try:
-            # Create a BytesIO object from uploaded file
-            pdf_bytes = io.BytesIO(uploaded_file.read())
-            
-            # Create PDF reader object
-            pdf_reader = PyPDF2.PdfReader(pdf_bytes)
-            
-            text = ""
-            total_pages = len(pdf_reader.pages)
-            
-            # Extract text from each page
-            for page_num, page in enumerate(pdf_reader.pages):
-                try:
-                    page_text = page.extract_text()
-                    if page_text.strip():  # Only add non-empty pages
-                        text += f"\n--- Page {page_num + 1} ---\n{page_text}\n"
-                except Exception as e:
-                    st.warning(f"Could not extract text from page {page_num + 1} of {uploaded_file.name}: {str(e)}")
-                    continue
+            source = self._pool_source(uploaded_file, spooled_paths)
+            workers = _pool_size()
+            with _open_pdf_stream(source) as stream:
+                pdf_reader = PyPDF2.PdfReader(stream)
+                total_pages = len(pdf_reader.pages)
+                if total_pages < PARALLEL_MIN_PAGES or workers < 2:
+                    yield from _iter_page_texts(pdf_reader, filename, 0, total_pages, self.warnings)
+                    return
             
-            if not text.strip():
-                raise ValueError(f"No text could be extracted from {uploaded_file.name}")
+            pages_per_task = pages_per_task or min(32, max(1, math.ceil(total_pages / (workers * 2))))
+            ranges = deque(
+                (start, min(start + pages_per_task, total_pages))
+                for start in range(0, total_pages, pages_per_task)
+            )
+            pool = _get_process_pool()
+            while ranges or pending:
+                while pool is not None and ranges and len(pending) < workers * 2:
+                    page_range = ranges.popleft()
+                    pending.append((page_range, pool.submit(_extract_page_range, source, filename, *page_range)))
+                
+                if pending:
+                    page_range, future = pending.popleft()
+                    try:
+                        pages, warnings = future.result()
+                        tracing.count("pdf.pages", page_range[1] - page_range[0])
+                    except BrokenProcessPool:
+                        # Finish in-process, starting with the ranges that were in flight
+                        _reset_process_pool()
+                        pool = None
+                        ranges.extendleft(reversed([pending_range for pending_range, _ in pending]))
+                        pending.clear()
+                        pages, warnings = _extract_page_range(source, filename, *page_range)
+                else:
+                    pages, warnings = _extract_page_range(source, filename, *ranges.popleft())
+                
+                self.warnings.extend(warnings)
+                yield from pages
+        except Exception as e:
+            raise Exception(f"Error extracting text from {filename}: {str(e)}")
+        finally:
+            for _, future in pending:
+                future.cancel()
+            for path in spooled_paths:
+                os.unlink(path)
+    
+    @staticmethod
+    def _pool_source(uploaded_file, spooled_paths):
+        """
+        Turn an upload into something cheap to send to pool workers.
+        
+        Paths are passed as they are. Small uploads are passed as bytes,
+        large ones are written to a temporary file once so workers can
+        memory-map it.
+        
+        Args:
+            uploaded_file: Streamlit uploaded file object, binary stream or path
+            spooled_paths (list): Receives temporary files the caller must delete
             
-            return text
+        Returns:
+            bytes or str: PDF content or file path
+        """
+        if isinstance(uploaded_file, (str, os.PathLike)):
+            return os.fspath(uploaded_file)
+        
+        content = PDFProcessor._read_bytes(uploaded_file)
+        if len(content) <= POOL_INLINE_MAX_BYTES:
+            return content
+        
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as spool:
+            spool.write(content)
+        spooled_paths.append(spool.name)
+        return spool.name
+    
+    @staticmethod
+    def join_pages(pages):
+        """
+        Join (page_number, text) records into one text with page markers.
+        
+        Args:
+            pages (iterable): (page_number, text) tuples in page order
             
-        except Exception as e:
-            raise Exception(f"Error extracting text from {uploaded_file.name}: {str(e)}")
+        Returns:
+            str: Document text
+        """
+        return "".join(f"\n--- Page {page_num} ---\n{page_text}\n" for page_num, page_text in pages)
     
-    def create_chunks(self, text, filename):
+    @staticmethod
+    def _display_name(uploaded_file):
+        """
+        Return the file name shown in messages and stored in chunk metadata.
+        
+        Args:
+            uploaded_file: Streamlit uploaded file object, binary stream or path
+            
+        Returns:
+            str: Base name of the file
+        """
+        if isinstance(uploaded_file, (str, os.PathLike)):
+            return os.path.basename(uploaded_file)
+        return os.path.basename(getattr(uploaded_file, "name", "document.pdf"))
+    
+    @staticmethod
+    def _read_bytes(uploaded_file):
+        """
+        Return the full content of an uploaded file.
+        
+        Args:
+            uploaded_file: Streamlit uploaded file object, binary stream or path
+            
+        Returns:
+            bytes: File content
+        """
+        if isinstance(uploaded_file, (str, os.PathLike)):
+            with open(uploaded_file, "rb") as f:
+                return f.read()
+        if hasattr(uploaded_file, "getvalue"):
+            return uploaded_file.getvalue()
+        uploaded_file.seek(0)
+        return uploaded_file.read()
+    
+    @staticmethod
+    def compute_file_hash(uploaded_file):
+        """
+        Compute a content hash for an uploaded file.
+        
+        The hash only depends on the file bytes, so the same PDF uploaded
+        under a different name maps to the same value.
+        
+        Args:
+            uploaded_file: Streamlit uploaded file object
+            
+        Returns:
+            str: SHA-256 hex digest of the file content
+        """
+        return hashlib.sha256(PDFProcessor._read_bytes(uploaded_file)).hexdigest()
+    
+    def create_chunks(self, text, filename, doc_hash=None, lexical_index=None):
         """
         Split text into chunks and create Document objects with metadata.
         
+        Page markers written by join_pages are turned back into page
+        records, so the markers themselves are not embedded.
+        
         Args:
             text (str): Text to be chunked
             filename (str): Source filename
+            doc_hash (str): Content hash of the source file, stored in the
+                chunk metadata so the chunks can be replaced or deleted later
+            lexical_index (LexicalIndex): Optional BM25 index every chunk is added to
             
         Returns:
             list: List of Document objects with metadata
@@ -72,50 +408,198 @@ class PDFProcessor:
         if not text.strip():
             return []
         
+        return list(self.iter_chunks(self._pages_from_text(text), filename, doc_hash, lexical_index=lexical_index))
+    
+    def iter_chunks(self, pages, filename, doc_hash=None, window_chars=None, lexical_index=None):
+        """
+        Chunk a stream of pages without building the whole document text.
+        
+        Pages are joined with a blank line into one logical document text.
+        Extraction records where every page starts in that text, and every
+        chunk gets its character span, so the pages a chunk covers are found
+        with a binary search instead of looking for markers in the chunk.
+        
+        Pages are collected into a window of about window_chars characters
+        that is split on its own. The text from the start of the last chunk
+        of every window is carried into the next one, since that chunk may
+        continue on the following page, so no chunk is cut short at a window
+        boundary. Peak memory is bounded by the window instead of the
+        document size.
+        
+        If a lexical index is given, every chunk is added to it as it is
+        created, while its text is still at hand.
+        
+        Args:
+            pages (iterable): (page_number, text) tuples, e.g. from iter_pages
+            filename (str): Source filename
+            doc_hash (str): Content hash of the source file
+            window_chars (int): Characters buffered before splitting
+                (8 chunks by default)
+            lexical_index (LexicalIndex): Optional BM25 index every chunk is added to
+            
+        Yields:
+            Document: Chunks whose metadata holds the filename, chunk index,
+            first and last page ("page", "page_end") and the character span
+            in the document text ("start", "end")
+        """
+        window_chars = window_chars or self.chunk_size * 8
+        page_index = PageIndex()
+        buffer = []
+        window_start = 0  # offset of the buffered window in the document text
+        chunk_index = 0
+        
         try:
-            # Split text into chunks
-            chunks = self.text_splitter.split_text(text)
-            
-            # Create Document objects with metadata
-            documents = []
-            for i, chunk in enumerate(chunks):
-                if chunk.strip():  # Only add non-empty chunks
-                    # Extract page number from chunk if available
-                    page_num = self._extract_page_number(chunk)
-                    
-                    doc = Document(
-                        page_content=chunk,
-                        metadata={
-                            "filename": filename,
-                            "chunk_index": i,
-                            "page": page_num
-                        }
+            for page_num, page_text in pages:
+                if page_index.length:
+                    buffer.append(PAGE_SEPARATOR)
+                buffer.append(page_text)
+                page_index.add_page(page_num, page_text)
+                if page_index.length - window_start < window_chars:
+                    continue
+                
+                window_text = "".join(buffer)
+                spans = self._split_spans(window_text)
+                for start, end in spans[:-1]:
+                    document = self._make_document(
+                        window_text[start:end], filename, chunk_index, doc_hash,
+                        page_index, window_start + start, window_start + end
                     )
-                    documents.append(doc)
-            
-            return documents
+                    if lexical_index is not None:
+                        lexical_index.add_document(document)
+                    yield document
+                    chunk_index += 1
+                
+                carry_from = spans[-1][0] if spans else len(window_text)
+                buffer = [window_text[carry_from:]]
+                window_start += carry_from
             
+            window_text = "".join(buffer)
+            for start, end in self._split_spans(window_text):
+                document = self._make_document(
+                    window_text[start:end], filename, chunk_index, doc_hash,
+                    page_index, window_start + start, window_start + end
+                )
+                if lexical_index is not None:
+                    lexical_index.add_document(document)
+                yield document
+                chunk_index += 1
+                
         except Exception as e:
             raise Exception(f"Error creating chunks from {filename}: {str(e)}")
     
-    def _extract_page_number(self, chunk):
+    def _split_spans(self, text):
         """
-        Extract page number from chunk text.
+        Split text and return the character span of every chunk.
         
         Args:
-            chunk (str): Text chunk
+            text (str): Text to split
             
         Returns:
-            int or str: Page number if found, otherwise "Unknown"
+            list: (start, end) offsets into text, one per non-empty chunk
         """
-        try:
-            # Look for page markers in the text
-            lines = chunk.split('\n')
-            for line in lines:
-                if line.strip().startswith('--- Page ') and line.strip().endswith(' ---'):
-                    # Extract page number from marker
-                    page_part = line.strip()[9:-4]  # Remove "--- Page " and " ---"
-                    return int(page_part)
-            return "Unknown"
-        except:
+        with tracing.span("pdf.split"):
+            return self.text_chunker.split_spans(text)
+    
+    def _make_document(self, chunk, filename, chunk_index, doc_hash, page_index, start, end):
+        """
+        Create a Document for a chunk with filename, index, page and span metadata.
+        
+        Args:
+            chunk (str): Chunk text
+            filename (str): Source filename
+            chunk_index (int): Position of the chunk in its file
+            doc_hash (str): Content hash of the source file
+            page_index (PageIndex): Page start offsets of the document
+            start (int): Chunk start offset in the document text
+            end (int): Chunk end offset in the document text
+            
+        Returns:
+            Document: Chunk document
+        """
+        first_page, last_page = page_index.page_range(start, end)
+        metadata = {
+            "filename": filename,
+            "chunk_index": chunk_index,
+            "page": first_page,
+            "page_end": last_page,
+            "start": start,
+            "end": end
+        }
+        if doc_hash:
+            metadata["doc_hash"] = doc_hash
+        return Document(page_content=chunk, metadata=metadata)
+    
+    @staticmethod
+    def _pages_from_text(text):
+        """
+        Turn text with join_pages markers back into page records.
+        
+        Args:
+            text (str): Document text
+            
+        Returns:
+            list: (page_number, text) tuples; text without markers is a
+            single page numbered "Unknown"
+        """
+        parts = _PAGE_MARKER.split(text)
+        pages = []
+        if parts[0].strip():
+            pages.append(("Unknown", parts[0]))
+        for i in range(1, len(parts), 2):
+            pages.append((int(parts[i]), parts[i + 1]))
+        return pages
+
+
+class PageIndex:
+    def __init__(self):
+        """
+        Initialize an empty offset-to-page index.
+        
+        Keeps the sorted start offsets of all pages in the joined document
+        text, so any character offset resolves to its page in O(log n).
+        """
+        self.starts = array("q")
+        self.page_numbers = []
+        self.length = 0
+    
+    def add_page(self, page_number, page_text):
+        """
+        Append a page to the end of the document text.
+        
+        Args:
+            page_number (int): Page number in the PDF
+            page_text (str): Page text
+        """
+        if self.length:
+            self.length += len(PAGE_SEPARATOR)
+        self.starts.append(self.length)
+        self.page_numbers.append(page_number)
+        self.length += len(page_text)
+    
+    def page_at(self, offset):
+        """
+        Return the page that contains a character offset.
+        
+        Args:
+            offset (int): Offset in the document text
+            
+        Returns:
+            int or str: Page number, "Unknown" for an empty index
+        """
+        if not self.page_numbers:
             return "Unknown"
+        position = bisect.bisect_right(self.starts, offset) - 1
+        return self.page_numbers[max(position, 0)]
+    
+    def page_range(self, start, end):
+        """
+        Return the first and last page covered by a character span.
+        
+        Args:
+            start (int): Span start offset
+            end (int): Span end offset (exclusive)
+            
+        Returns:
+            tuple: (first_page, last_page)
+        """
+        return self.page_at(start), self.page_at(max(start, end - 1))
@@ -0,0 +1,127 @@
+import threading
+from collections import OrderedDict
+
+import tracing
+
+DEFAULT_MAX_ENTRIES = 512
+
+
+class QueryEmbedder:
+    def __init__(self, embeddings, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        Initialize a query embedder with an in-memory LRU of recent query vectors.
+
+        Args:
+            embeddings: LangChain embeddings client configured with the
+                retrieval-query task type
+            max_entries (int): Number of query vectors kept in memory
+        """
+        self.embeddings = embeddings
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._vectors = OrderedDict()
+        self._lock = threading.Lock()
+
+    def embed_query(self, query):
+        """
+        Embed a search query, reusing the vector of a recent identical query.
+
+        Args:
+            query (str): Search query
+
+        Returns:
+            list: Query vector
+        """
+        key = query.strip()
+        vector = self._lookup(key)
+        if vector is not None:
+            return vector
+
+        with tracing.span("query.embed"):
+            vector = self.embeddings.embed_query(key)
+        self._store({key: vector})
+        return vector
+
+    async def aembed_query(self, query):
+        """
+        Embed a search query without blocking the event loop.
+
+        Args:
+            query (str): Search query
+
+        Returns:
+            list: Query vector
+        """
+        key = query.strip()
+        vector = self._lookup(key)
+        if vector is not None:
+            return vector
+
+        with tracing.span("query.embed"):
+            vector = await self.embeddings.aembed_query(key)
+        self._store({key: vector})
+        return vector
+
+    def embed_queries(self, queries):
+        """
+        Embed several search queries with one batched call for the uncached ones.
+
+        Args:
+            queries (list): Search queries
+
+        Returns:
+            list: One vector per query
+        """
+        keys = [query.strip() for query in queries]
+        found = {}
+        with self._lock:
+            for key in keys:
+                vector = self._vectors.get(key)
+                if vector is not None:
+                    self._vectors.move_to_end(key)
+                    found[key] = vector
+            self.hits += len(found)
+
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        if missing:
+            with self._lock:
+                self.misses += len(missing)
+            with tracing.span("query.embed_batch"):
+                computed = dict(zip(missing, self.embeddings.embed_documents(missing)))
+            self._store(computed)
+            found.update(computed)
+
+        return [found[key] for key in keys]
+
+    def stats(self):
+        """
+        Report cache usage.
+
+        Returns:
+            dict: Hit and miss counts and the number of cached vectors
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._vectors)}
+
+    def _lookup(self, key):
+        """Return the cached vector of a query and count the hit or miss."""
+        with self._lock:
+            vector = self._vectors.get(key)
+            if vector is None:
+                self.misses += 1
+                tracing.count("query_cache.miss")
+                return None
+            self._vectors.move_to_end(key)
+            self.hits += 1
+            tracing.count("query_cache.hit")
+            return vector
+
+    def _store(self, vectors):
+        """Add vectors to the LRU and evict the oldest ones beyond max_entries."""
+        with self._lock:
+            for key, vector in vectors.items():
+                self._vectors[key] = vector
+                self._vectors.move_to_end(key)
+            while len(self._vectors) > self.max_entries:
+                self._vectors.popitem(last=False)
@@ -0,0 +1,57 @@
+import time
+
+import numpy as np
+
+DEFAULT_LAMBDA = 0.5
+
+
+def maximal_marginal_relevance(query_vector, candidate_vectors, k=4, lambda_mult=DEFAULT_LAMBDA, deadline=None):
+    """
+    Select diverse candidates with maximal marginal relevance.
+
+    All similarities are computed up front with two matrix products; the
+    greedy selection then only updates one vector per step. Each step
+    picks the candidate maximizing
+    lambda_mult * sim(query, c) - (1 - lambda_mult) * max sim(c, selected).
+
+    Args:
+        query_vector (list): Query embedding
+        candidate_vectors (array): One embedding per candidate, in relevance order
+        k (int): Number of candidates to select
+        lambda_mult (float): 1 ranks by relevance only, 0 by diversity only
+        deadline (float): perf_counter value after which the remaining
+            slots are filled in relevance order
+
+    Returns:
+        list: Indices of the selected candidates, in selection order
+    """
+    vectors = np.asarray(candidate_vectors, dtype=np.float32)
+    count = len(vectors)
+    k = min(k, count)
+    if k <= 0:
+        return []
+
+    query = np.asarray(query_vector, dtype=np.float32)
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+    relevance = vectors @ query
+    similarity = vectors @ vectors.T
+
+    selected = [int(np.argmax(relevance))]
+    available = np.ones(count, dtype=bool)
+    available[selected[0]] = False
+    redundancy = similarity[selected[0]].copy()  # max similarity to any selected candidate
+
+    while len(selected) < k:
+        if deadline is not None and time.perf_counter() > deadline:
+            # Out of time: keep the diversified head, fill the rest by relevance
+            selected.extend(int(i) for i in np.flatnonzero(available)[:k - len(selected)])
+            break
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(redundancy, similarity[best], out=redundancy)
+
+    return selected
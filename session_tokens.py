@@ -0,0 +1,127 @@
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import time
+
+# Seconds a session stays valid without activity
+DEFAULT_SESSION_TTL = 7 * 24 * 3600
+
+logger = logging.getLogger(__name__)
+
+_process_secret = None
+
+
+def _secret():
+    """Return the signing key: SESSION_SECRET, or a random key for this process only."""
+    global _process_secret
+    configured = os.getenv("SESSION_SECRET")
+    if configured:
+        return configured.encode("utf-8")
+    if _process_secret is None:
+        logger.warning(
+            "SESSION_SECRET is not set; sessions are only valid on this process and end when it restarts"
+        )
+        _process_secret = secrets.token_bytes(32)
+    return _process_secret
+
+
+def _encode(data):
+    """Encode bytes as unpadded URL-safe base64 text."""
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _decode(text):
+    """Decode unpadded URL-safe base64 text; raises ValueError if it is malformed."""
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(payload, secret):
+    """Return the encoded HMAC-SHA256 signature of an encoded payload."""
+    return _encode(hmac.new(secret, payload.encode("ascii"), hashlib.sha256).digest())
+
+
+def session_ttl():
+    """Return the session lifetime in seconds (SESSION_TTL_SECONDS or 7 days)."""
+    return int(os.getenv("SESSION_TTL_SECONDS", DEFAULT_SESSION_TTL))
+
+
+def issue_token(email, ttl=None, secret=None, version=0):
+    """
+    Create a signed session token for a user.
+
+    The token carries the email, its expiry and the session version of
+    the user, signed with HMAC-SHA256, so any replica sharing
+    SESSION_SECRET can verify it without a session store; bumping the
+    version in the user store revokes it (see auth.revoke_sessions).
+
+    Args:
+        email (str): Signed-in user
+        ttl (int): Seconds until the token expires (default: session_ttl())
+        secret (bytes): Signing key (default: SESSION_SECRET)
+        version (int): Session version of the user
+
+    Returns:
+        str: "<payload>.<signature>", URL and cookie safe
+    """
+    now = int(time.time())
+    claims = {"sub": email, "iat": now, "exp": now + (ttl or session_ttl()), "ver": version}
+    payload = _encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+    return f"{payload}.{_sign(payload, secret or _secret())}"
+
+
+def read_token(token, secret=None):
+    """
+    Verify a session token.
+
+    Args:
+        token (str): Token from issue_token
+        secret (bytes): Signing key (default: SESSION_SECRET)
+
+    Returns:
+        dict or None: Claims ("sub", "iat", "exp", "ver") of a valid, unexpired
+        token; None for a missing, tampered or expired one
+    """
+    if not token or token.count(".") != 1:
+        return None
+    payload, signature = token.split(".")
+    try:
+        if not hmac.compare_digest(signature, _sign(payload, secret or _secret())):
+            return None
+        claims = json.loads(_decode(payload))
+    except (ValueError, UnicodeError):
+        return None
+    if not isinstance(claims, dict) or not claims.get("sub") or claims.get("exp", 0) <= time.time():
+        return None
+    return claims
+
+
+def verify_token(token, secret=None):
+    """
+    Return the user of a valid session token.
+
+    Args:
+        token (str): Token from issue_token
+        secret (bytes): Signing key (default: SESSION_SECRET)
+
+    Returns:
+        str or None: Email of the signed-in user
+    """
+    claims = read_token(token, secret)
+    return claims["sub"] if claims else None
+
+
+def needs_refresh(claims):
+    """
+    Check whether a token should be renewed.
+
+    Args:
+        claims (dict): Claims from read_token
+
+    Returns:
+        bool: True once more than half of the lifetime of the token has passed
+    """
+    return claims["exp"] - time.time() < (claims["exp"] - claims["iat"]) / 2
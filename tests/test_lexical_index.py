@@ -0,0 +1,145 @@
+import math
+import random
+
+import pytest
+from langchain_core.documents import Document
+
+from lexical_index import LexicalIndex, tokenize
+
+WORDS = ["alpha", "beta", "gamma", "delta", "epsilon", "ERR-4021", "x_max", "A.3.2"]
+
+
+def chunk(doc_hash, index, text):
+    return Document(page_content=text, metadata={"doc_hash": doc_hash, "chunk_index": index})
+
+
+def random_chunks(doc_hash, count, rng):
+    return [
+        chunk(doc_hash, i, " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 30))))
+        for i in range(count)
+    ]
+
+
+def reference_scores(documents, query, k1=1.5, b=0.75):
+    """Okapi BM25 of every document for a query, computed term by term."""
+    tokenized = [tokenize(doc.page_content) for doc in documents]
+    average_length = sum(len(terms) for terms in tokenized) / len(tokenized)
+    scores = []
+    for terms in tokenized:
+        score = 0.0
+        for term in set(tokenize(query)):
+            frequency = terms.count(term)
+            if not frequency:
+                continue
+            document_frequency = sum(term in other for other in tokenized)
+            idf = math.log(1 + (len(tokenized) - document_frequency + 0.5) / (document_frequency + 0.5))
+            score += idf * frequency * (k1 + 1) / (frequency + k1 * (1 - b + b * len(terms) / average_length))
+        scores.append(score)
+    return scores
+
+
+def ranked(index, query, k=100):
+    return [(doc.page_content, doc.metadata["chunk_index"], score) for doc, score in index.search(query, k=k)]
+
+
+def test_tokenize_keeps_identifiers_and_their_parts():
+    assert tokenize("Error ERR-4021 in A.3.2") == ["error", "err-4021", "err", "4021", "in", "a.3.2", "a", "3", "2"]
+
+
+def test_scores_match_bm25():
+    rng = random.Random(0)
+    documents = random_chunks("d1", 40, rng)
+    index = LexicalIndex()
+    index.add_documents(documents)
+
+    for query in ["alpha", "gamma ERR-4021", "4021 x_max beta", "a.3.2"]:
+        expected = reference_scores(documents, query)
+        results = index.search(query, k=len(documents))
+        assert len(results) == sum(score > 0 for score in expected)
+        for doc, score in results:
+            assert score == pytest.approx(expected[doc.metadata["chunk_index"]], rel=1e-5)
+        assert [score for _, score in results] == sorted((score for _, score in results), reverse=True)
+
+
+def test_exact_identifier_ranks_first():
+    index = LexicalIndex()
+    index.add_documents([
+        chunk("d1", 0, "the error code is ERR-4021 after restart"),
+        chunk("d1", 1, "error codes are listed in the appendix"),
+        chunk("d1", 2, "restart the service"),
+    ])
+
+    assert index.search("ERR-4021", k=1)[0][0].metadata["chunk_index"] == 0
+    assert index.search("unknown words", k=3) == []
+
+
+def test_delete_and_compact_match_a_fresh_index():
+    rng = random.Random(1)
+    kept = random_chunks("keep", 20, rng)
+    index = LexicalIndex()
+    index.add_documents(kept)
+    index.add_documents(random_chunks("drop", 20, rng))
+
+    # Deleting half of the rows compacts the postings
+    index.delete("drop")
+    fresh = LexicalIndex()
+    fresh.add_documents(kept)
+
+    assert len(index) == 20
+    assert len(index._documents) == 20
+    assert all(doc.metadata["doc_hash"] == "keep" for doc, _ in index.search("alpha beta", k=40))
+    for query in ["alpha", "delta ERR-4021", "x_max"]:
+        assert ranked(index, query) == ranked(fresh, query)
+
+
+def test_small_delete_hides_rows_without_compacting():
+    rng = random.Random(2)
+    index = LexicalIndex()
+    index.add_documents(random_chunks("keep", 20, rng))
+    index.add_documents([chunk("drop", 0, "alpha alpha alpha")])
+
+    index.delete("drop")
+
+    assert len(index) == 20
+    assert len(index._documents) == 21
+    assert all(doc.metadata["doc_hash"] == "keep" for doc, _ in index.search("alpha", k=40))
+
+
+def test_readding_a_chunk_replaces_it():
+    index = LexicalIndex()
+    index.add_document(chunk("d1", 0, "alpha"))
+    index.add_document(chunk("d1", 0, "beta"))
+
+    assert len(index) == 1
+    assert index.search("alpha") == []
+    assert index.search("beta")[0][0].page_content == "beta"
+
+
+def test_merge_matches_adding_the_chunks():
+    rng = random.Random(3)
+    first, second = random_chunks("d1", 15, rng), random_chunks("d2", 15, rng)
+    merged = LexicalIndex()
+    merged.add_documents(first)
+    part = LexicalIndex()
+    part.add_documents(second)
+    merged.merge(part)
+    added = LexicalIndex()
+    added.add_documents(first + second)
+
+    for query in ["alpha", "gamma 4021", "a.3.2 epsilon"]:
+        assert ranked(merged, query) == ranked(added, query)
+
+
+def test_persist_and_load_round_trip(tmp_path):
+    rng = random.Random(4)
+    index = LexicalIndex()
+    index.add_documents(random_chunks("d1", 20, rng) + random_chunks("d2", 20, rng))
+    index.delete("d2")
+    index.persist(str(tmp_path))
+
+    loaded = LexicalIndex.load(str(tmp_path))
+
+    assert len(loaded) == 20
+    for query in ["alpha", "delta ERR-4021", "x_max beta"]:
+        assert ranked(loaded, query) == ranked(index, query)
+    assert len(LexicalIndex.load(str(tmp_path / "missing"))) == 0
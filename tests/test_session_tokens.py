@@ -0,0 +1,87 @@
+import time
+
+import pytest
+
+import auth
+import session_tokens
+from auth import UserStore
+from session_tokens import _decode, _encode, issue_token, needs_refresh, read_token, verify_token
+
+SECRET = b"test-secret"
+
+
+def test_valid_token_round_trips():
+    token = issue_token("a@example.com", ttl=60, secret=SECRET, version=2)
+    claims = read_token(token, SECRET)
+
+    assert claims["sub"] == "a@example.com"
+    assert claims["ver"] == 2
+    assert claims["exp"] - claims["iat"] == 60
+    assert verify_token(token, SECRET) == "a@example.com"
+
+
+def test_tampered_token_is_rejected():
+    payload, signature = issue_token("a@example.com", ttl=60, secret=SECRET).split(".")
+    forged = _encode(_decode(payload).replace(b"a@example.com", b"b@example.com"))
+
+    assert read_token(f"{forged}.{signature}", SECRET) is None
+    assert read_token(f"{payload}.{signature[:-2]}xx", SECRET) is None
+    assert read_token(f"{payload}.{signature}", b"other-secret") is None
+
+
+@pytest.mark.parametrize("token", [None, "", "no-dot", "a.b.c", "!!!.???"])
+def test_malformed_token_is_rejected(token):
+    assert read_token(token, SECRET) is None
+
+
+def test_expired_token_is_rejected(monkeypatch):
+    token = issue_token("a@example.com", ttl=60, secret=SECRET)
+    now = time.time()
+
+    monkeypatch.setattr(session_tokens.time, "time", lambda: now + 59)
+    assert read_token(token, SECRET) is not None
+    monkeypatch.setattr(session_tokens.time, "time", lambda: now + 61)
+    assert read_token(token, SECRET) is None
+
+
+def test_refresh_after_half_the_lifetime(monkeypatch):
+    claims = read_token(issue_token("a@example.com", ttl=100, secret=SECRET), SECRET)
+
+    monkeypatch.setattr(session_tokens.time, "time", lambda: claims["iat"] + 40)
+    assert not needs_refresh(claims)
+    monkeypatch.setattr(session_tokens.time, "time", lambda: claims["iat"] + 60)
+    assert needs_refresh(claims)
+
+
+def test_revoked_sessions_are_rejected(monkeypatch, tmp_path):
+    monkeypatch.setenv("SESSION_SECRET", "test-secret")
+    monkeypatch.setattr(auth, "_store", UserStore(str(tmp_path / "users.sqlite3"), legacy_file=None))
+    auth.get_user_store().add("a@example.com", "salt", "hash")
+
+    token = auth.issue_session("a@example.com")
+    assert auth.verify_session(token)["sub"] == "a@example.com"
+
+    assert auth.revoke_sessions("a@example.com")
+    assert auth.verify_session(token) is None
+    assert auth.verify_session(auth.issue_session("a@example.com"))["sub"] == "a@example.com"
+
+    auth.delete_user("a@example.com")
+    assert auth.verify_session(token) is None
+
+
+def test_revocation_by_another_process_applies_after_the_cache_ttl(monkeypatch, tmp_path):
+    monkeypatch.setenv("SESSION_SECRET", "test-secret")
+    monkeypatch.setenv("SESSION_VERSION_TTL_SECONDS", "30")
+    path = str(tmp_path / "users.sqlite3")
+    monkeypatch.setattr(auth, "_store", UserStore(path, legacy_file=None))
+    auth.get_user_store().add("a@example.com", "salt", "hash")
+    token = auth.issue_session("a@example.com")
+    assert auth.verify_session(token) is not None
+
+    # Another process revokes the sessions through its own connection
+    assert UserStore(path, legacy_file=None).bump_session_version("a@example.com")
+    assert auth.verify_session(token) is not None
+
+    now = time.monotonic()
+    monkeypatch.setattr(auth.time, "monotonic", lambda: now + 31)
+    assert auth.verify_session(token) is None
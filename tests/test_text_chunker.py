@@ -0,0 +1,58 @@
+import random
+
+import pytest
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from context_packer import estimate_tokens
+from synthetic_pdf import synthetic_pages
+from text_chunker import DEFAULT_SEPARATORS, TextChunker
+
+PIECES = ["a", "b", "c", "d", " ", "  ", "\n", "\n\n", "\n\n\n", "x" * 50, "word ", "\t", " \n "]
+
+
+def reference_chunks(text, chunk_size, chunk_overlap, length_function=None):
+    """Chunks of RecursiveCharacterTextSplitter as PDFProcessor used them, without blank ones."""
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=length_function or len,
+        separators=list(DEFAULT_SEPARATORS)
+    )
+    return [chunk for chunk in splitter.split_text(text) if chunk.strip()]
+
+
+@pytest.mark.parametrize("length_function", [None, estimate_tokens])
+def test_matches_recursive_splitter_on_random_text(length_function):
+    rng = random.Random(1)
+    for _ in range(500):
+        chunk_size = rng.choice([5, 10, 30, 100, 1000])
+        chunk_overlap = rng.randint(0, chunk_size // 2)
+        text = "".join(rng.choice(PIECES) for _ in range(rng.randint(0, 400)))
+
+        chunker = TextChunker(chunk_size, chunk_overlap, length_function=length_function)
+        assert chunker.split_text(text) == reference_chunks(text, chunk_size, chunk_overlap, length_function)
+
+
+def test_matches_recursive_splitter_on_document_text():
+    text = "\n\n".join(synthetic_pages(50))
+    assert TextChunker(1000, 200).split_text(text) == reference_chunks(text, 1000, 200)
+
+
+def test_spans_are_offsets_of_the_chunks():
+    text = "\n\n".join(synthetic_pages(5))
+    chunker = TextChunker(300, 50)
+    spans = chunker.split_spans(text)
+
+    assert [text[start:end] for start, end in spans] == chunker.split_text(text)
+    assert all(start < end for start, end in spans)
+    assert [start for start, _ in spans] == sorted(start for start, _ in spans)
+
+
+def test_chunks_exclude_surrounding_whitespace():
+    assert TextChunker(10, 0).split_spans("  ab  \n\n   \n\n cd ") == [(2, 4), (14, 16)]
+    assert TextChunker(10, 0).split_spans(" \n\n \t ") == []
+
+
+def test_overlap_larger_than_chunk_size_is_rejected():
+    with pytest.raises(ValueError):
+        TextChunker(chunk_size=100, chunk_overlap=101)
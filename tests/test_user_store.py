@@ -0,0 +1,75 @@
+import json
+import os
+
+import pytest
+
+import auth
+from auth import UserStore
+
+
+@pytest.fixture
+def store_path(tmp_path):
+    return str(tmp_path / "users.sqlite3")
+
+
+def test_migrates_users_json_once(tmp_path, store_path):
+    legacy = tmp_path / "users.json"
+    legacy.write_text(json.dumps({
+        "a@example.com": {"salt": "s1", "hash": "h1"},
+        "b@example.com": {"salt": "s2", "hash": "h2"},
+        "broken@example.com": {"salt": "s3"},
+    }), encoding="utf-8")
+
+    store = UserStore(store_path, legacy_file=str(legacy))
+
+    assert store.emails() == ["a@example.com", "b@example.com"]
+    assert store.get("a@example.com") == ("s1", "h1")
+    assert not legacy.exists()
+    assert (tmp_path / "users.json.migrated").exists()
+
+
+def test_migration_keeps_existing_users(tmp_path, store_path):
+    UserStore(store_path, legacy_file=None).add("a@example.com", "new-salt", "new-hash")
+    legacy = tmp_path / "users.json"
+    legacy.write_text(json.dumps({"a@example.com": {"salt": "old-salt", "hash": "old-hash"}}), encoding="utf-8")
+
+    store = UserStore(store_path, legacy_file=str(legacy))
+
+    assert store.get("a@example.com") == ("new-salt", "new-hash")
+
+
+def test_duplicate_insert_is_rejected(store_path):
+    store = UserStore(store_path, legacy_file=None)
+
+    assert store.add("a@example.com", "s1", "h1")
+    assert not store.add("a@example.com", "s2", "h2")
+    assert store.get("a@example.com") == ("s1", "h1")
+
+
+def test_upsert_and_delete(store_path):
+    store = UserStore(store_path, legacy_file=None)
+    store.upsert("a@example.com", "s1", "h1")
+    store.upsert("a@example.com", "s2", "h2")
+
+    assert store.get("a@example.com") == ("s2", "h2")
+    assert store.delete("a@example.com")
+    assert not store.delete("a@example.com")
+    assert store.get("a@example.com") is None
+
+
+def test_users_are_shared_between_connections(store_path):
+    UserStore(store_path, legacy_file=None).add("a@example.com", "s1", "h1")
+
+    assert UserStore(store_path, legacy_file=None).get("a@example.com") == ("s1", "h1")
+
+
+def test_create_and_verify_user(monkeypatch, store_path):
+    monkeypatch.setattr(auth, "_store", UserStore(store_path, legacy_file=None))
+    monkeypatch.setattr(auth, "PBKDF2_ROUNDS", 1000)
+
+    assert auth.create_user("a@example.com", "secret") == (True, "User created")
+    assert auth.create_user("a@example.com", "other") == (False, "User already exists")
+    assert auth.verify_user("a@example.com", "secret")
+    assert not auth.verify_user("a@example.com", "other")
+    assert not auth.verify_user("missing@example.com", "secret")
+    assert os.path.exists(store_path)
@@ -0,0 +1,181 @@
+import bisect
+import re
+from collections import deque
+
+# Paragraphs, then lines, then words, then characters
+DEFAULT_SEPARATORS = ("\n\n", "\n", " ", "")
+
+
+class TextChunker:
+    def __init__(self, chunk_size=1000, chunk_overlap=200, separators=DEFAULT_SEPARATORS, length_function=None):
+        """
+        Initialize a recursive character chunker that works on offsets.
+
+        Chunks are the same as those of LangChain's RecursiveCharacterTextSplitter
+        with the same separators (kept at the start of the following piece)
+        and whitespace stripping, but the text is never split into substrings:
+        pieces are the offsets between separator occurrences, merged in a
+        single pass per separator level, and only pieces longer than a chunk
+        are split again with the next separator.
+
+        Args:
+            chunk_size (int): Maximum chunk length
+            chunk_overlap (int): Maximum length shared by consecutive chunks
+            separators (tuple): Split points in order of preference; "" splits
+                between characters
+            length_function (callable): Measures a piece of text, e.g.
+                context_packer.estimate_tokens to size chunks in tokens
+                (default: characters, taken from the offsets without slicing)
+        """
+        if chunk_overlap > chunk_size:
+            raise ValueError(f"Chunk overlap ({chunk_overlap}) is larger than the chunk size ({chunk_size})")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = tuple(separators)
+        self.length_function = length_function
+
+    def split_spans(self, text):
+        """
+        Split text into chunks and return their offsets.
+
+        Args:
+            text (str): Text to split
+
+        Returns:
+            list: (start, end) offsets into text, one per non-empty chunk,
+            with leading and trailing whitespace excluded
+        """
+        spans = []
+        self._split(text, 0, len(text), 0, spans)
+        return spans
+
+    def split_text(self, text):
+        """
+        Split text into chunk strings.
+
+        Args:
+            text (str): Text to split
+
+        Returns:
+            list: Chunk texts
+        """
+        return [text[start:end] for start, end in self.split_spans(text)]
+
+    def _split(self, text, start, end, level, spans):
+        """Append the chunk spans of text[start:end], splitting with separators[level:]."""
+        separators = self.separators
+        separator = separators[-1] if separators else ""
+        next_level = len(separators)
+        for i in range(level, len(separators)):
+            if separators[i] == "":
+                separator = ""
+                break
+            if text.find(separators[i], start, end) >= 0:
+                separator = separators[i]
+                next_level = i + 1
+                break
+
+        bounds = self._boundaries(text, start, end, separator)
+        if self.length_function is None:
+            self._merge_offsets(text, bounds, next_level, spans)
+        else:
+            self._merge_measured(text, bounds, next_level, spans)
+
+    def _merge_offsets(self, text, bounds, next_level, spans):
+        """
+        Merge pieces measured in characters into chunks.
+
+        Piece lengths are offset differences, so the pieces that still fit
+        into a chunk and those kept as overlap are found by binary search
+        over the piece boundaries instead of piece by piece.
+        """
+        chunk_size = self.chunk_size
+        chunk_overlap = self.chunk_overlap
+        pieces = len(bounds) - 1
+        first = last = 0  # the open chunk holds pieces [first, last)
+        while last < pieces:
+            length = bounds[last + 1] - bounds[last]
+            if length >= chunk_size:
+                # Close the open chunk, then split the long piece on its own
+                if first < last:
+                    self._emit(text, bounds[first], bounds[last], spans)
+                self._split_long(text, bounds[last], bounds[last + 1], next_level, spans)
+                first = last = last + 1
+                continue
+
+            if first < last and bounds[last] - bounds[first] + length > chunk_size:
+                self._emit(text, bounds[first], bounds[last], spans)
+                # Keep at most chunk_overlap of the tail, and only as much as fits with the new piece
+                keep_from = max(bounds[last] - chunk_overlap, bounds[last] + length - chunk_size)
+                first = bisect.bisect_left(bounds, keep_from, first + 1, last)
+
+            # Take the piece and every following one that still fits
+            last = max(last + 1, bisect.bisect_right(bounds, bounds[first] + chunk_size, last + 1, pieces + 1) - 1)
+
+        if first < last:
+            self._emit(text, bounds[first], bounds[last], spans)
+
+    def _merge_measured(self, text, bounds, next_level, spans):
+        """Merge pieces measured with length_function into chunks, piece by piece."""
+        measure = self.length_function
+        chunk_size = self.chunk_size
+        chunk_overlap = self.chunk_overlap
+        current = deque()  # (start, end, length) of the pieces of the open chunk
+        total = 0
+
+        for index in range(len(bounds) - 1):
+            piece_start, piece_end = bounds[index], bounds[index + 1]
+            length = measure(text[piece_start:piece_end])
+
+            if length >= chunk_size:
+                if current:
+                    self._emit(text, current[0][0], current[-1][1], spans)
+                    current.clear()
+                    total = 0
+                self._split_long(text, piece_start, piece_end, next_level, spans)
+                continue
+
+            if total + length > chunk_size and current:
+                self._emit(text, current[0][0], current[-1][1], spans)
+                while total > chunk_overlap or (total + length > chunk_size and total > 0):
+                    total -= current.popleft()[2]
+            current.append((piece_start, piece_end, length))
+            total += length
+
+        if current:
+            self._emit(text, current[0][0], current[-1][1], spans)
+
+    def _split_long(self, text, start, end, next_level, spans):
+        """Split a piece that does not fit into a chunk with the next separator, if any is left."""
+        if next_level < len(self.separators):
+            self._split(text, start, end, next_level, spans)
+        else:
+            self._emit(text, start, end, spans)
+
+    @staticmethod
+    def _boundaries(text, start, end, separator):
+        """
+        Return the piece boundaries of text[start:end] split before every occurrence of separator.
+
+        Returns:
+            Sequence: Ascending offsets from start to end; piece i is
+            text[bounds[i]:bounds[i + 1]]
+        """
+        if not separator:
+            return range(start, end + 1)
+
+        bounds = [match.start() for match in re.compile(re.escape(separator)).finditer(text, start, end)]
+        if not bounds or bounds[0] > start:
+            bounds.insert(0, start)
+        bounds.append(end)
+        return bounds
+
+    @staticmethod
+    def _emit(text, start, end, spans):
+        """Append the span without its surrounding whitespace, unless nothing is left."""
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if end > start:
+            spans.append((start, end))
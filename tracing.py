@@ -0,0 +1,545 @@
+import bisect
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+DEFAULT_WINDOW_SECONDS = 300
+_WINDOW_SLICES = 10
+_RECENT_TRACES = 50
+_QUANTILES = (0.5, 0.9, 0.99)
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+logger = logging.getLogger("pdf_chat.trace")
+
+_enabled = os.getenv("TRACING", "0").lower() in ("1", "true", "yes")
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class RollingHistogram:
+    def __init__(self, buckets=BUCKETS, window_seconds=None):
+        """
+        Initialize a latency histogram.
+
+        Keeps cumulative bucket counts, as Prometheus expects, and the same
+        counts for a rolling window made of time slices, from which recent
+        quantiles are estimated.
+
+        Args:
+            buckets (tuple): Bucket upper bounds in seconds, ascending
+            window_seconds (float): Length of the rolling window (default:
+                TRACING_WINDOW_SECONDS or 300)
+        """
+        self.buckets = buckets
+        self.window_seconds = window_seconds or float(os.getenv("TRACING_WINDOW_SECONDS", DEFAULT_WINDOW_SECONDS))
+        self._slice_seconds = self.window_seconds / _WINDOW_SLICES
+        self._lock = threading.Lock()
+        self.counts = [0] * (len(buckets) + 1)  # last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self._slices = deque()  # (slice start, bucket counts, count, sum)
+
+    def observe(self, seconds):
+        """
+        Record one duration.
+
+        Args:
+            seconds (float): Observed duration
+        """
+        bucket = bisect.bisect_left(self.buckets, seconds)
+        now = time.monotonic()
+        with self._lock:
+            self.counts[bucket] += 1
+            self.count += 1
+            self.sum += seconds
+
+            self._expire(now)
+            if not self._slices or now - self._slices[-1][0] >= self._slice_seconds:
+                self._slices.append([now, [0] * len(self.counts), 0, 0.0])
+            current = self._slices[-1]
+            current[1][bucket] += 1
+            current[2] += 1
+            current[3] += seconds
+
+    def window(self):
+        """
+        Summarize the rolling window.
+
+        Returns:
+            dict: "count", "mean" and the estimated "p50", "p90" and "p99" in seconds
+        """
+        with self._lock:
+            self._expire(time.monotonic())
+            counts = [sum(column) for column in zip(*(s[1] for s in self._slices))] or [0] * len(self.counts)
+            count = sum(s[2] for s in self._slices)
+            total = sum(s[3] for s in self._slices)
+
+        summary = {"count": count, "mean": total / count if count else 0.0}
+        for quantile in _QUANTILES:
+            summary[f"p{round(quantile * 100)}"] = self._quantile(counts, count, quantile)
+        return summary
+
+    def _quantile(self, counts, count, quantile):
+        """Estimate a quantile by linear interpolation inside its bucket."""
+        if not count:
+            return 0.0
+        rank = quantile * count
+        seen = 0
+        for bucket, bucket_count in enumerate(counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[bucket - 1] if bucket else 0.0
+                upper = self.buckets[bucket] if bucket < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+    def _expire(self, now):
+        """Drop slices that left the window. Must be called with the lock held."""
+        while self._slices and now - self._slices[0][0] >= self.window_seconds:
+            self._slices.popleft()
+
+
+class Trace:
+    def __init__(self, name, **attributes):
+        """
+        Initialize the trace of one question or ingestion.
+
+        Spans and counts recorded while the trace is active are summed per
+        stage, so a trace stays small however many pages or batches it covers.
+
+        Args:
+            name (str): Operation, e.g. "question" or "ingest"
+            **attributes: Values logged with the trace
+        """
+        self.name = name
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.attributes = dict(attributes)
+        self.stages = {}  # stage -> [seconds, calls]
+        self.counts = {}
+        self.started = time.perf_counter()
+        self.timestamp = time.time()
+        self.duration = None
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        """Add the duration of a stage."""
+        with self._lock:
+            entry = self.stages.setdefault(stage, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    def count(self, name, value=1):
+        """Add to a named count, e.g. cache hits."""
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def set(self, **attributes):
+        """Attach values to the trace."""
+        with self._lock:
+            self.attributes.update(attributes)
+
+    def finish(self, **attributes):
+        """
+        End the trace: record its total duration, keep it for the debug panel and log it.
+
+        Args:
+            **attributes: Values attached before logging
+        """
+        if self.duration is not None:
+            return
+        self.set(**attributes)
+        self.duration = time.perf_counter() - self.started
+        _registry.observe(f"{self.name}.total", self.duration)
+        _registry.keep(self)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps(self.as_dict(), default=str))
+
+    def as_dict(self):
+        """
+        Return the trace as a JSON-serializable dict.
+
+        Returns:
+            dict: Name, ID, timestamp, total seconds, per-stage seconds and
+            calls, counts and attributes
+        """
+        with self._lock:
+            return {
+                "trace": self.name,
+                "trace_id": self.trace_id,
+                "timestamp": self.timestamp,
+                "seconds": self.duration,
+                "stages": {stage: {"seconds": round(s, 6), "calls": n} for stage, (s, n) in self.stages.items()},
+                "counts": dict(self.counts),
+                "attributes": dict(self.attributes),
+            }
+
+
+class _Span:
+    """Times a stage and records it in the histograms and the active trace."""
+
+    __slots__ = ("stage", "started")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.stage, time.perf_counter() - self.started)
+        return False
+
+
+class _NoopSpan:
+    """Shared stand-in returned while tracing is disabled."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def add(self, stage, seconds):
+        pass
+
+    def count(self, name, value=1):
+        pass
+
+    def set(self, **attributes):
+        pass
+
+    def finish(self, **attributes):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class MetricsRegistry:
+    def __init__(self):
+        """Initialize empty per-stage histograms, counters and recent traces."""
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.recent = deque(maxlen=_RECENT_TRACES)
+
+    def observe(self, stage, seconds):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(stage, RollingHistogram())
+        histogram.observe(seconds)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def keep(self, trace):
+        with self._lock:
+            self.recent.append(trace)
+
+    def render_prometheus(self):
+        """
+        Render all metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: Cumulative stage histograms, rolling-window quantiles and event counters
+        """
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+
+        lines = [
+            "# HELP rag_stage_seconds Duration of pipeline stages.",
+            "# TYPE rag_stage_seconds histogram",
+        ]
+        for stage, histogram in histograms:
+            with histogram._lock:
+                counts, count, total = list(histogram.counts), histogram.count, histogram.sum
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append(f'rag_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'rag_stage_seconds_sum{{stage="{stage}"}} {total}')
+            lines.append(f'rag_stage_seconds_count{{stage="{stage}"}} {count}')
+
+        lines += [
+            "# HELP rag_stage_seconds_window Duration of pipeline stages over the rolling window.",
+            "# TYPE rag_stage_seconds_window summary",
+        ]
+        for stage, histogram in histograms:
+            window = histogram.window()
+            for quantile in _QUANTILES:
+                value = window[f"p{round(quantile * 100)}"]
+                lines.append(f'rag_stage_seconds_window{{stage="{stage}",quantile="{quantile}"}} {value}')
+            lines.append(f'rag_stage_seconds_window_sum{{stage="{stage}"}} {window["mean"] * window["count"]}')
+            lines.append(f'rag_stage_seconds_window_count{{stage="{stage}"}} {window["count"]}')
+
+        lines += [
+            "# HELP rag_events_total Pipeline events such as cache hits, pages, chunks and tokens.",
+            "# TYPE rag_events_total counter",
+        ]
+        for name, value in counters:
+            lines.append(f'rag_events_total{{event="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+_registry = MetricsRegistry()
+
+
+def enabled():
+    """Return True if tracing is on (TRACING=1 or enable())."""
+    return _enabled
+
+
+def enable(log=True):
+    """
+    Turn tracing on.
+
+    Args:
+        log (bool): Also log every finished trace as one JSON line to stderr,
+            unless the pdf_chat.trace logger is configured already
+    """
+    global _enabled
+    _enabled = True
+    if log and not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+
+def disable():
+    """Turn tracing off; metrics recorded so far are kept."""
+    global _enabled
+    _enabled = False
+
+
+def span(stage):
+    """
+    Time a block as a pipeline stage.
+
+    Args:
+        stage (str): Stage name, e.g. "query.embed"
+
+    Returns:
+        Context manager; a shared no-op while tracing is disabled
+    """
+    return _Span(stage) if _enabled else _NOOP
+
+
+def observe(stage, seconds):
+    """
+    Record a stage duration measured by the caller.
+
+    Args:
+        stage (str): Stage name
+        seconds (float): Duration
+    """
+    if not _enabled:
+        return
+    _registry.observe(stage, seconds)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(stage, seconds)
+
+
+def count(name, value=1):
+    """
+    Add to an event counter, e.g. cache hits or tokens.
+
+    Args:
+        name (str): Event name
+        value (int): Amount to add
+    """
+    if not _enabled:
+        return
+    _registry.count(name, value)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.count(name, value)
+
+
+def annotate(**attributes):
+    """
+    Attach values to the active trace, e.g. the error of a stage that fell back.
+
+    Args:
+        **attributes: Values logged with the trace
+    """
+    if not _enabled:
+        return
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.set(**attributes)
+
+
+def start_trace(name, **attributes):
+    """
+    Start a trace without activating it; see activate() and Trace.finish().
+
+    Args:
+        name (str): Operation name
+        **attributes: Values logged with the trace
+
+    Returns:
+        Trace: New trace, or a no-op stand-in while tracing is disabled
+    """
+    return Trace(name, **attributes) if _enabled else _NOOP
+
+
+@contextmanager
+def activate(trace):
+    """
+    Make a trace the target of spans and counts inside a with block.
+
+    Args:
+        trace (Trace): Trace from start_trace
+
+    Yields:
+        Trace: The same trace
+    """
+    if trace is _NOOP:
+        yield trace
+        return
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def trace(name, **attributes):
+    """
+    Start, activate and finish a trace around a with block.
+
+    Args:
+        name (str): Operation name
+        **attributes: Values logged with the trace
+
+    Yields:
+        Trace: Active trace, or a no-op stand-in while tracing is disabled
+    """
+    current = start_trace(name, **attributes)
+    try:
+        with activate(current):
+            yield current
+    finally:
+        current.finish()
+
+
+def bind(function):
+    """
+    Carry the active trace into a function run on another thread.
+
+    Args:
+        function (callable): Function submitted to a thread pool
+
+    Returns:
+        callable: The function, run in a copy of the current context while tracing is enabled
+    """
+    if not _enabled:
+        return function
+    return functools.partial(contextvars.copy_context().run, function)
+
+
+def recent_traces(name=None, limit=10):
+    """
+    Return the most recent finished traces, newest first.
+
+    Args:
+        name (str): Only traces of this operation
+        limit (int): Maximum number of traces
+
+    Returns:
+        list: Trace dicts (see Trace.as_dict)
+    """
+    with _registry._lock:
+        traces = list(_registry.recent)
+    traces = [t for t in reversed(traces) if name is None or t.name == name]
+    return [t.as_dict() for t in traces[:limit]]
+
+
+def stage_summary():
+    """
+    Summarize every stage over the rolling window.
+
+    Returns:
+        dict: stage -> {"count", "mean", "p50", "p90", "p99"} in seconds
+    """
+    with _registry._lock:
+        histograms = sorted(_registry.histograms.items())
+    return {stage: histogram.window() for stage, histogram in histograms}
+
+
+def render_prometheus():
+    """
+    Render all metrics in the Prometheus text exposition format.
+
+    Returns:
+        str: Metrics page
+    """
+    return _registry.render_prometheus()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", METRICS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_metrics_server = None
+_metrics_lock = threading.Lock()
+
+
+def start_metrics_server(port=None, host="0.0.0.0"):
+    """
+    Serve /metrics on a background thread, once per process.
+
+    Args:
+        port (int): Port (default: METRICS_PORT; nothing is started if unset)
+        host (str): Interface to bind
+
+    Returns:
+        ThreadingHTTPServer or None: Running server
+    """
+    global _metrics_server
+    port = port or int(os.getenv("METRICS_PORT", "0"))
+    if not port:
+        return None
+    with _metrics_lock:
+        if _metrics_server is None:
+            _metrics_server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            _metrics_server.daemon_threads = True
+            threading.Thread(target=_metrics_server.serve_forever, name="metrics", daemon=True).start()
+        return _metrics_server
+
+
+if _enabled:
+    enable(log=os.getenv("TRACING_LOG", "1").lower() not in ("0", "false", "no"))
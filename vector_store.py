@@ -1,58 +1,185 @@
 from langchain_community.vectorstores import Chroma
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-import tempfile
+from langchain_core.documents import Document
+from clients import get_registry
+from embedding_scheduler import EmbeddingScheduler
+from numpy_index import DTYPES, NumpyIndex
+from reranker import DEFAULT_LAMBDA, maximal_marginal_relevance
+import asyncio
 import os
+import time
+import uuid
+import numpy as np
 import streamlit as st
+import tracing
+
+EMBEDDING_MODEL = "models/gemini-embedding-001"
+EMBEDDING_TASK_TYPE = "retrieval_document"
+BACKENDS = ("chroma", "numpy")
+
+# Reciprocal rank fusion constant; damps the influence of the very top ranks
+RRF_K = 60
+
+# Candidates taken from each ranking in hybrid search: max(4k, 20)
+HYBRID_FETCH_FACTOR = 4
+HYBRID_MIN_FETCH = 20
 
 class VectorStore:
-    def __init__(self):
+    def __init__(self, batch_size=None, max_workers=None, requests_per_minute=None, backend=None, index_dtype=None):
         """
-        Initialize vector store with Google Gemini embeddings.
+        Initialize vector store with cached Google Gemini embeddings.
+        
+        Args:
+            batch_size (int): Number of chunks per embedding request
+            max_workers (int): Number of embedding requests run concurrently
+            requests_per_minute (float): Embedding request quota
+            backend (str): Index backend, "chroma" or "numpy" (default: VECTOR_BACKEND or "chroma")
+            index_dtype (str): Storage type of the numpy backend, "float32", "float16" or "int8"
+                (default: VECTOR_INDEX_DTYPE or "float32")
         """
+        self.backend = backend or os.getenv("VECTOR_BACKEND", "chroma")
+        self.index_dtype = index_dtype or os.getenv("VECTOR_INDEX_DTYPE", "float32")
+        if self.backend not in BACKENDS:
+            raise ValueError(f"Unsupported vector backend: {self.backend}")
+        if self.index_dtype not in DTYPES:
+            raise ValueError(f"Unsupported index dtype: {self.index_dtype}")
+        
         try:
-            # Get Gemini API key from environment
-            api_key = os.getenv("GEMINI_API_KEY")
-            if not api_key:
-                raise ValueError("GEMINI_API_KEY not found in environment variables")
+            # Reuse the process-wide embeddings client, backed by the on-disk cache
+            registry = get_registry()
+            self.embeddings = registry.embeddings(EMBEDDING_MODEL, EMBEDDING_TASK_TYPE)
+            self.embedding_cache = self.embeddings.cache
+            
+            # User queries use their own task type and an in-memory cache of recent vectors
+            self.query_embedder = registry.query_embedder(EMBEDDING_MODEL)
             
-            # Use Google Gemini embeddings for document search
-            self.embeddings = GoogleGenerativeAIEmbeddings(
-                model="models/gemini-embedding-001",
-                google_api_key=api_key,
-                task_type="retrieval_document"
+            # Embed ingested chunks in concurrent, rate-limited batches; unless a
+            # quota is given, all sessions share the process-wide limiter
+            self.scheduler = EmbeddingScheduler(
+                self.embeddings,
+                batch_size=batch_size,
+                max_workers=max_workers,
+                requests_per_minute=requests_per_minute,
+                rate_limiter=None if requests_per_minute is not None else registry.embedding_rate_limiter()
             )
+            self.last_report = None
+            self.last_rerank = None
         except Exception as e:
             raise Exception(f"Error initializing embeddings: {str(e)}")
     
-    def create_vectorstore(self, documents):
+    def create_vectorstore(self, documents, progress_callback=None, persist_directory=None):
         """
-        Create a Chroma vector store from documents.
+        Create a vector store from documents.
         
         Args:
             documents (list): List of Document objects
+            progress_callback (callable): Optional, called with the embedding report after every batch
+            persist_directory (str): Directory to persist the collection in; in memory if omitted
             
         Returns:
-            Chroma: Initialized vector store
+            Chroma or NumpyIndex: Initialized vector store
         """
         if not documents:
             raise ValueError("No documents provided for vector store creation")
         
         try:
-            # Create temporary directory for Chroma persistence
-            temp_dir = tempfile.mkdtemp()
-            
-            # Create Chroma vector store
-            vectorstore = Chroma.from_documents(
-                documents=documents,
-                embedding=self.embeddings,
-                persist_directory=temp_dir
-            )
+            # Open an empty vector store and fill it batch by batch
+            vectorstore = self.open_vectorstore(persist_directory)
+            report = self._embed_and_write(vectorstore, documents, progress_callback)
+            if not report["embedded"]:
+                raise ValueError(report["errors"][0] if report["errors"] else "No documents were embedded")
             
             return vectorstore
             
         except Exception as e:
             raise Exception(f"Error creating vector store: {str(e)}")
     
+    def open_vectorstore(self, persist_directory=None):
+        """
+        Open a vector store, reusing the collection already persisted in a directory.
+        
+        Args:
+            persist_directory (str): Directory of a persistent collection; without
+                one, a new in-memory collection is created
+            
+        Returns:
+            Chroma or NumpyIndex: Vector store of the configured backend, empty if the directory is new
+        """
+        try:
+            if self.backend == "numpy":
+                if persist_directory:
+                    return NumpyIndex.load(
+                        persist_directory, embedding_function=self.embeddings, dtype=self.index_dtype,
+                        query_embedder=self.query_embedder
+                    )
+                return NumpyIndex(
+                    embedding_function=self.embeddings, dtype=self.index_dtype, query_embedder=self.query_embedder
+                )
+            
+            if persist_directory:
+                return Chroma(
+                    embedding_function=self.embeddings,
+                    persist_directory=persist_directory
+                )
+            
+            # In-memory collections share one client per process, so each needs its own name
+            return Chroma(
+                collection_name=f"session-{uuid.uuid4().hex}",
+                embedding_function=self.embeddings
+            )
+            
+        except Exception as e:
+            raise Exception(f"Error opening vector store: {str(e)}")
+    
+    def add_documents(self, vectorstore, documents, progress_callback=None):
+        """
+        Embed documents and add them to an existing vector store.
+        
+        Args:
+            vectorstore: Chroma vector store
+            documents (list): List of Document objects
+            progress_callback (callable): Optional, called with the embedding report after every batch
+            
+        Returns:
+            dict: Embedding report (see EmbeddingScheduler.run)
+        """
+        try:
+            return self._embed_and_write(vectorstore, documents, progress_callback)
+            
+        except Exception as e:
+            raise Exception(f"Error adding documents to vector store: {str(e)}")
+    
+    def delete_documents(self, vectorstore, doc_hash):
+        """
+        Delete every chunk that belongs to a source file.
+        
+        Args:
+            vectorstore: Chroma vector store
+            doc_hash (str): Content hash of the source file
+        """
+        try:
+            vectorstore.delete(where={"doc_hash": doc_hash})
+            self._persist(vectorstore)
+            
+        except Exception as e:
+            raise Exception(f"Error deleting documents from vector store: {str(e)}")
+    
+    def delete_chunks(self, vectorstore, ids):
+        """
+        Delete chunks by ID.
+        
+        Args:
+            vectorstore: Chroma vector store
+            ids (list): Chunk IDs (see document_ids)
+        """
+        if not ids:
+            return
+        try:
+            vectorstore.delete(ids=list(ids))
+            self._persist(vectorstore)
+            
+        except Exception as e:
+            raise Exception(f"Error deleting chunks from vector store: {str(e)}")
+    
     def similarity_search(self, vectorstore, query, k=4):
         """
         Perform similarity search in the vector store.
@@ -62,17 +189,71 @@ class VectorStore:
             query (str): Search query
             k (int): Number of similar documents to return
             
+        Returns:
+            list: List of similar documents with metadata
+        """
+        try:
+            query_vector = self.query_embedder.embed_query(query)
+        except Exception as e:
+            raise Exception(f"Error performing similarity search: {str(e)}")
+        
+        return self.similarity_search_by_vector(vectorstore, query_vector, k=k)
+    
+    def similarity_search_by_vector(self, vectorstore, query_vector, k=4):
+        """
+        Perform similarity search with a precomputed query vector.
+        
+        Args:
+            vectorstore: Chroma vector store
+            query_vector (list): Query embedding from query_embedder
+            k (int): Number of similar documents to return
+            
         Returns:
             list: List of similar documents with metadata
         """
         try:
             # Perform similarity search
-            docs = vectorstore.similarity_search(query, k=k)
+            with tracing.span("retrieval.vector"):
+                docs = vectorstore.similarity_search_by_vector(query_vector, k=k)
             return docs
             
         except Exception as e:
             raise Exception(f"Error performing similarity search: {str(e)}")
     
+    def similarity_search_by_vectors(self, vectorstore, query_vectors, k=4):
+        """
+        Perform one batched similarity search for several precomputed query vectors.
+        
+        Args:
+            vectorstore: Chroma vector store or NumpyIndex
+            query_vectors (list): Query embeddings from query_embedder
+            k (int): Number of similar documents to return per query
+            
+        Returns:
+            list: One list of similar documents per query vector
+        """
+        try:
+            if not len(query_vectors):
+                return []
+            if isinstance(vectorstore, NumpyIndex):
+                with tracing.span("retrieval.vector_batch"):
+                    return vectorstore.similarity_search_by_vectors(query_vectors, k=k)
+            
+            # Chroma scores all query embeddings in a single call
+            with tracing.span("retrieval.vector_batch"):
+                results = vectorstore._collection.query(
+                    query_embeddings=[list(map(float, vector)) for vector in query_vectors],
+                    n_results=k,
+                    include=["documents", "metadatas"]
+                )
+            return [
+                [Document(page_content=text, metadata=metadata or {}) for text, metadata in zip(texts, metadatas)]
+                for texts, metadatas in zip(results["documents"], results["metadatas"])
+            ]
+            
+        except Exception as e:
+            raise Exception(f"Error performing batched similarity search: {str(e)}")
+    
     def similarity_search_with_score(self, vectorstore, query, k=4):
         """
         Perform similarity search with relevance scores.
@@ -86,9 +267,283 @@ class VectorStore:
             list: List of tuples (document, score)
         """
         try:
-            # Perform similarity search with scores
-            docs_with_scores = vectorstore.similarity_search_with_score(query, k=k)
+            query_vector = self.query_embedder.embed_query(query)
+        except Exception as e:
+            raise Exception(f"Error performing similarity search with scores: {str(e)}")
+        
+        return self.similarity_search_with_score_by_vector(vectorstore, query_vector, k=k)
+    
+    def similarity_search_with_score_by_vector(self, vectorstore, query_vector, k=4):
+        """
+        Perform similarity search with relevance scores and a precomputed query vector.
+        
+        Args:
+            vectorstore: Chroma vector store
+            query_vector (list): Query embedding from query_embedder
+            k (int): Number of similar documents to return
+            
+        Returns:
+            list: List of tuples (document, score)
+        """
+        try:
+            # Perform similarity search with scores (distances, lower is more similar)
+            docs_with_scores = vectorstore.similarity_search_by_vector_with_relevance_scores(query_vector, k=k)
             return docs_with_scores
             
         except Exception as e:
             raise Exception(f"Error performing similarity search with scores: {str(e)}")
+    
+    async def asimilarity_search(self, vectorstore, query, k=4):
+        """
+        Perform similarity search without blocking the event loop.
+        
+        The query is embedded with the async embeddings API and the local
+        index is searched on a worker thread.
+        
+        Args:
+            vectorstore: Chroma vector store
+            query (str): Search query
+            k (int): Number of similar documents to return
+            
+        Returns:
+            list: List of similar documents with metadata
+        """
+        try:
+            query_vector = await self.query_embedder.aembed_query(query)
+        except Exception as e:
+            raise Exception(f"Error performing similarity search: {str(e)}")
+        
+        return await asyncio.to_thread(self.similarity_search_by_vector, vectorstore, query_vector, k)
+    
+    async def asimilarity_search_with_score(self, vectorstore, query, k=4):
+        """
+        Perform similarity search with relevance scores without blocking the event loop.
+        
+        Args:
+            vectorstore: Chroma vector store
+            query (str): Search query
+            k (int): Number of similar documents to return
+            
+        Returns:
+            list: List of tuples (document, score)
+        """
+        try:
+            query_vector = await self.query_embedder.aembed_query(query)
+        except Exception as e:
+            raise Exception(f"Error performing similarity search with scores: {str(e)}")
+        
+        return await asyncio.to_thread(self.similarity_search_with_score_by_vector, vectorstore, query_vector, k)
+    
+    def hybrid_search(self, vectorstore, lexical_index, query, k=4, query_vector=None, fetch_k=None,
+                      vector_docs=None):
+        """
+        Perform hybrid search, fusing vector and BM25 rankings.
+        
+        Both searches over-fetch candidates, which are merged with
+        reciprocal rank fusion. Chunks that match exact identifiers rank
+        high even when their embeddings are not the closest.
+        
+        Args:
+            vectorstore: Chroma vector store or NumpyIndex
+            lexical_index (LexicalIndex): BM25 index over the same chunks
+            query (str): Search query
+            k (int): Number of documents to return
+            query_vector (list): Precomputed query embedding, embedded if omitted
+            fetch_k (int): Candidates taken from each ranking (default max(4k, 20))
+            vector_docs (list): Precomputed vector ranking, e.g. from
+                similarity_search_by_vectors; replaces the vector search
+            
+        Returns:
+            list: List of similar documents with metadata
+        """
+        fetch_k = fetch_k or max(k * HYBRID_FETCH_FACTOR, HYBRID_MIN_FETCH)
+        try:
+            if vector_docs is not None:
+                vector_docs = vector_docs[:fetch_k]
+            else:
+                if query_vector is None:
+                    query_vector = self.query_embedder.embed_query(query)
+                with tracing.span("retrieval.vector"):
+                    vector_docs = vectorstore.similarity_search_by_vector(query_vector, k=fetch_k)
+            with tracing.span("retrieval.lexical"):
+                lexical_docs = [doc for doc, _ in lexical_index.search(query, k=fetch_k)] if lexical_index is not None else []
+            return self.reciprocal_rank_fusion([vector_docs, lexical_docs], k=k)
+            
+        except Exception as e:
+            raise Exception(f"Error performing hybrid search: {str(e)}")
+    
+    def max_marginal_relevance(self, vectorstore, query_vector, candidates, k=4, lambda_mult=DEFAULT_LAMBDA,
+                               time_budget=None):
+        """
+        Pick k diverse chunks from over-fetched candidates with maximal marginal relevance.
+        
+        The stored embeddings of the candidates are fetched in one call and
+        scored with NumPy. If the budget runs out, the remaining slots are
+        filled in the original order; if it is spent before selection starts,
+        the first k candidates are returned unchanged. The outcome is kept in
+        self.last_rerank.
+        
+        Args:
+            vectorstore: Chroma vector store or NumpyIndex holding the candidates
+            query_vector (list): Query embedding
+            candidates (list): Document objects, most relevant first
+            k (int): Number of documents to return
+            lambda_mult (float): 1 ranks by relevance only, 0 by diversity only
+            time_budget (float): Seconds the stage may take, unlimited if None
+            
+        Returns:
+            list: Selected Document objects
+        """
+        started = time.perf_counter()
+        deadline = started + time_budget if time_budget else None
+        self.last_rerank = {"candidates": len(candidates), "applied": False}
+        try:
+            if len(candidates) <= k:
+                return candidates
+            
+            vectors = self._stored_vectors(vectorstore, candidates)
+            if vectors is None or (deadline is not None and time.perf_counter() > deadline):
+                return candidates[:k]
+            
+            order = maximal_marginal_relevance(query_vector, vectors, k=k, lambda_mult=lambda_mult, deadline=deadline)
+            self.last_rerank["applied"] = True
+            return [candidates[i] for i in order]
+            
+        except Exception as e:
+            raise Exception(f"Error reranking search results: {str(e)}")
+        finally:
+            self.last_rerank["seconds"] = time.perf_counter() - started
+            tracing.observe("retrieval.rerank", self.last_rerank["seconds"])
+    
+    def _stored_vectors(self, vectorstore, documents):
+        """
+        Fetch the stored embeddings of documents by chunk ID.
+        
+        Args:
+            vectorstore: Chroma vector store or NumpyIndex
+            documents (list): Document objects with doc_hash and chunk_index metadata
+            
+        Returns:
+            array or None: One vector per document, None if any is missing
+        """
+        if not all(doc.metadata.get("doc_hash") for doc in documents):
+            return None
+        ids = self.document_ids(documents)
+        if isinstance(vectorstore, NumpyIndex):
+            return vectorstore.get_vectors(ids)
+        
+        stored = vectorstore._collection.get(ids=ids, include=["embeddings"])
+        by_id = dict(zip(stored["ids"], stored["embeddings"]))
+        if len(by_id) < len(set(ids)):
+            return None
+        return np.asarray([by_id[doc_id] for doc_id in ids], dtype=np.float32)
+    
+    @staticmethod
+    def reciprocal_rank_fusion(rankings, k=4, rrf_k=RRF_K):
+        """
+        Merge rankings of documents with reciprocal rank fusion.
+        
+        Args:
+            rankings (list): Lists of Document objects, best first
+            k (int): Number of documents to return
+            rrf_k (int): Fusion constant added to every rank
+            
+        Returns:
+            list: Fused Document objects, best first
+        """
+        scores = {}
+        documents = {}
+        for ranking in rankings:
+            for rank, doc in enumerate(ranking, start=1):
+                key = VectorStore._chunk_key(doc)
+                scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+                documents.setdefault(key, doc)
+        best = sorted(scores, key=scores.get, reverse=True)[:k]
+        return [documents[key] for key in best]
+    
+    @staticmethod
+    def _chunk_key(doc):
+        """
+        Identify a chunk across result lists.
+        
+        Args:
+            doc (Document): Chunk
+            
+        Returns:
+            tuple: (source, chunk index, start offset)
+        """
+        metadata = doc.metadata
+        return (
+            metadata.get("doc_hash") or metadata.get("filename"),
+            metadata.get("chunk_index"),
+            metadata.get("start")
+        )
+    
+    def _embed_and_write(self, vectorstore, documents, progress_callback=None):
+        """
+        Embed documents through the scheduler and upsert each finished batch.
+        
+        Args:
+            vectorstore: Chroma vector store
+            documents (iterable): Document objects
+            progress_callback (callable): Optional progress callback
+            
+        Returns:
+            dict: Embedding report, also kept in self.last_report
+        """
+        def write_batch(batch, vectors):
+            self._upsert(vectorstore, batch, vectors)
+        
+        try:
+            self.last_report = self.scheduler.run(documents, write_batch, progress_callback)
+        finally:
+            # Save once per ingest rather than once per batch
+            self._persist(vectorstore)
+        return self.last_report
+    
+    def _upsert(self, vectorstore, documents, vectors):
+        """
+        Write embedded documents to the backend of a vector store.
+        
+        Args:
+            vectorstore: Chroma vector store or NumpyIndex
+            documents (list): Document objects
+            vectors (list): One embedding per document
+        """
+        target = vectorstore if isinstance(vectorstore, NumpyIndex) else vectorstore._collection
+        with tracing.span("index.write"):
+            target.upsert(
+                ids=self.document_ids(documents),
+                embeddings=vectors,
+                documents=[doc.page_content for doc in documents],
+                metadatas=[doc.metadata for doc in documents]
+            )
+    
+    @staticmethod
+    def _persist(vectorstore):
+        """
+        Save a persistent NumpyIndex; Chroma persists on every write by itself.
+        
+        Args:
+            vectorstore: Chroma vector store or NumpyIndex
+        """
+        if isinstance(vectorstore, NumpyIndex) and vectorstore.persist_directory:
+            with tracing.span("index.persist"):
+                vectorstore.persist()
+    
+    @staticmethod
+    def document_ids(documents):
+        """
+        Build stable chunk IDs from the source file hash and chunk index.
+        
+        Args:
+            documents (list): List of Document objects
+            
+        Returns:
+            list: One ID per document (random for documents without a content hash)
+        """
+        return [
+            f"{doc.metadata['doc_hash']}:{doc.metadata['chunk_index']}"
+            if doc.metadata.get("doc_hash") else str(uuid.uuid4())
+            for doc in documents
+        ]